@@ -10,10 +10,10 @@
 # This code was adapted from aiorq module written by Vincent Driessen
 # and released under 2-clause BSD license.
 
-from .job import cancel_job, get_current_job, requeue_job
+from .job import cancel_job, get_current_job, requeue_job, Retry
 from .queue import get_failed_queue, Queue
 from .worker import Worker
 
 
-__all__ = ['cancel_job', 'get_current_job', 'requeue_job',
+__all__ = ['cancel_job', 'get_current_job', 'requeue_job', 'Retry',
            'get_failed_queue', 'Queue', 'Worker']
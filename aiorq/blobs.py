@@ -0,0 +1,190 @@
+"""
+    aiorq.blobs
+    ~~~~~~~~~~~
+
+    Offload large job arguments into shared content addressed blobs
+    and broadcast values.
+
+    :copyright: (c) 2015-2016 by Artem Malyshev.
+    :license: LGPL-3, see LICENSE for more details.
+"""
+
+import hashlib
+import pickle
+from collections import OrderedDict
+
+from .exceptions import MissingArgumentError
+
+
+class BlobRef:
+    """Placeholder of the offloaded argument in the job data."""
+
+    def __init__(self, hash):
+
+        self.hash = hash
+
+    def __eq__(self, other):
+
+        return isinstance(other, BlobRef) and self.hash == other.hash
+
+    def __repr__(self):
+
+        return 'BlobRef({!r})'.format(self.hash)
+
+
+class Broadcast:
+    """Handle of the value stored once with `Queue.broadcast` and
+    shared by any number of jobs."""
+
+    def __init__(self, hash):
+
+        self.hash = hash
+
+    def __eq__(self, other):
+
+        return isinstance(other, Broadcast) and self.hash == other.hash
+
+    def __repr__(self):
+
+        return 'Broadcast({!r})'.format(self.hash)
+
+
+def content_hash(data):
+    """Content address of the pickled value."""
+
+    return hashlib.sha256(data).hexdigest()
+
+
+def offload_args(args, kwargs, threshold):
+    """Replace arguments pickled into at least ``threshold`` bytes
+    with blob references.  Strings and bytes are measured by their
+    length, so small ones aren't pickled twice.
+
+    Returns new args and kwargs and dict of blob payloads by their
+    SHA-256 hash.
+
+    :type args: tuple
+    :type kwargs: dict
+    :type threshold: int
+
+    """
+
+    blobs = {}
+
+    def offload(value):
+        if isinstance(value, (str, bytes)) and len(value) < threshold:
+            return value
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) < threshold:
+            return value
+        hash = content_hash(data)
+        blobs[hash] = data
+        return BlobRef(hash)
+
+    args = tuple(offload(value) for value in args)
+    kwargs = {key: offload(value) for key, value in kwargs.items()}
+    return args, kwargs, blobs
+
+
+def resolve_args(args, kwargs, blobs):
+    """Replace blob references with arguments stored in ``blobs``.
+    Raise `MissingArgumentError` if referenced blob is missing.
+
+    :type args: tuple
+    :type kwargs: dict
+    :type blobs: dict
+
+    """
+
+    def resolve(value):
+        if isinstance(value, BlobRef):
+            if blobs.get(value.hash) is None:
+                raise MissingArgumentError(
+                    'Offloaded argument {} is gone'.format(value.hash))
+            return pickle.loads(blobs[value.hash])
+        return value
+
+    return replace_args(args, kwargs, resolve)
+
+
+def broadcast_hashes(args, kwargs):
+    """Hashes of broadcast values passed as arguments.
+
+    :type args: tuple
+    :type kwargs: dict
+
+    """
+
+    return sorted({value.hash for value in list(args) + list(kwargs.values())
+                   if isinstance(value, Broadcast)})
+
+
+def resolve_broadcasts(args, kwargs, values):
+    """Replace broadcast handles with their ``values``.  Raise
+    `MissingArgumentError` if value of any handle is missing.
+
+    :type args: tuple
+    :type kwargs: dict
+    :type values: dict
+
+    """
+
+    def resolve(value):
+        if isinstance(value, Broadcast):
+            if value.hash not in values:
+                raise MissingArgumentError(
+                    'Broadcast value {} is gone'.format(value.hash))
+            return values[value.hash]
+        return value
+
+    return replace_args(args, kwargs, resolve)
+
+
+def replace_args(args, kwargs, function):
+    """Apply ``function`` to each argument."""
+
+    args = tuple(function(value) for value in args)
+    kwargs = {key: function(value) for key, value in kwargs.items()}
+    return args, kwargs
+
+
+class BlobCache:
+    """Least recently used blob payloads bounded by total size in
+    bytes.  Deserialized values can be cached with the size of their
+    payload."""
+
+    def __init__(self, max_size):
+
+        self.max_size = max_size
+        self.size = 0
+        self._blobs = OrderedDict()
+        self._sizes = {}
+
+    def __contains__(self, hash):
+
+        return hash in self._blobs
+
+    def get(self, hash):
+        """Blob payload or None if it isn't cached."""
+
+        if hash not in self._blobs:
+            return None
+        self._blobs.move_to_end(hash)
+        return self._blobs[hash]
+
+    def put(self, hash, data, size=None):
+        """Cache blob payload evicting least recently used ones."""
+
+        if size is None:
+            size = len(data)
+        if hash in self._blobs:
+            del self._blobs[hash]
+            self.size -= self._sizes.pop(hash)
+        if size > self.max_size:
+            return
+        self._blobs[hash] = data
+        self._sizes[hash] = size
+        self.size += size
+        while self.size > self.max_size:
+            evicted, _ = self._blobs.popitem(last=False)
+            self.size -= self._sizes.pop(evicted)
@@ -6,6 +6,7 @@ import aioredis
 import click
 
 from .compat import ensure_future
+from .protocol import sweep_jobs
 from .worker import Worker
 
 
@@ -20,22 +21,50 @@ def cli():
 @click.argument('queues', nargs=-1)
 @click.option('--verbose', '-v', 'log_level', flag_value='DEBUG')
 @click.option('--quiet', '-q', 'log_level', flag_value='WARNING')
-def worker(queues, log_level):
+@click.option('--preload', multiple=True,
+              help='Module with job functions to import at startup.')
+def worker(queues, log_level, preload):
     """Starts an aiorq worker."""
 
     level_name = log_level or 'INFO'
     level = getattr(logging, level_name)
     logging.basicConfig(level=level)
     loop = asyncio.get_event_loop()
-    ensure_future(run_worker(loop, queues), loop=loop)
+    ensure_future(run_worker(loop, queues, preload), loop=loop)
     loop.run_forever()
     loop.close()
 
 
+@cli.command()
+@click.option('--count', default=100, help='Keys examined at once.')
+def sweep(count):
+    """Deletes orphan job hashes."""
+
+    loop = asyncio.get_event_loop()
+    deleted = loop.run_until_complete(run_sweep(count))
+    loop.close()
+    click.echo('Deleted {} orphan job hashes'.format(deleted))
+
+
+@asyncio.coroutine
+def run_sweep(count):
+    redis = yield from aioredis.create_redis(('localhost', 6379))
+    cursor, deleted = yield from sweep_jobs(redis, count=count)
+    while cursor:
+        cursor, slice_deleted = yield from sweep_jobs(redis, cursor, count)
+        deleted += slice_deleted
+    redis.close()
+    return deleted
+
+
 @asyncio.coroutine
-def run_worker(loop, queues):
+def run_worker(loop, queues, preload):
     redis = yield from aioredis.create_redis(('localhost', 6379))
-    worker = Worker(queues, connection=redis)
+    pubsub = yield from aioredis.create_redis(('localhost', 6379))
+    worker = Worker(queues, connection=redis, pubsub_connection=pubsub,
+                    preload=preload)
     loop.add_signal_handler(signal.SIGTERM, worker.request_stop, loop)
     yield from worker.work()
+    pubsub.close()
+    redis.close()
     loop.stop()
@@ -0,0 +1,73 @@
+"""
+    aiorq.coalescer
+    ~~~~~~~~~~~~~~~
+
+    Merge writes issued during the same event loop tick.
+
+    :copyright: (c) 2015-2016 by Artem Malyshev.
+    :license: LGPL-3, see LICENSE for more details.
+"""
+
+import asyncio
+
+from .compat import ensure_future
+
+
+class WriteCoalescer:
+    """Send Redis writes issued during the same event loop tick in a
+    single transaction.
+
+    Many concurrent jobs doing their bookkeeping at once produce one
+    round trip instead of one per write.
+    """
+
+    def __init__(self, connection, *, loop=None):
+
+        self.connection = connection
+        self._loop = loop
+        self._commands = []
+        self._waiter = None
+
+    @property
+    def loop(self):
+        """Event loop flushes are scheduled on."""
+
+        return self._loop or asyncio.get_event_loop()
+
+    def write(self, command, *args):
+        """Schedule ``command`` method call of the transaction with
+        given arguments.
+
+        Returns future resolved when the transaction is executed.
+
+        :type command: str
+
+        """
+
+        self._commands.append((command, args))
+        if self._waiter is None:
+            self._waiter = asyncio.Future(loop=self.loop)
+            self.loop.call_soon(self.flush)
+        return self._waiter
+
+    def flush(self):
+        """Execute all scheduled commands in one transaction."""
+
+        commands, waiter = self._commands, self._waiter
+        self._commands, self._waiter = [], None
+        if commands:
+            ensure_future(self.execute(commands, waiter), loop=self.loop)
+
+    @asyncio.coroutine
+    def execute(self, commands, waiter):
+        """Execute given commands and resolve their waiter."""
+
+        multi = self.connection.multi_exec()
+        for command, args in commands:
+            getattr(multi, command)(*args)
+        try:
+            yield from multi.execute()
+        except Exception as error:
+            waiter.set_exception(error)
+        else:
+            waiter.set_result(None)
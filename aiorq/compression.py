@@ -0,0 +1,113 @@
+"""
+    aiorq.compression
+    ~~~~~~~~~~~~~~~~~
+
+    Job data compression codecs.
+
+    :copyright: (c) 2015-2016 by Artem Malyshev.
+    :license: LGPL-3, see LICENSE for more details.
+"""
+
+import bz2
+import lzma
+import zlib
+
+
+class ZlibCodec:
+    """Fast compression with moderate ratio."""
+
+    name = 'zlib'
+
+    def compress(self, data):
+
+        return zlib.compress(data)
+
+    def decompress(self, data):
+
+        return zlib.decompress(data)
+
+
+class LZMACodec:
+    """Best ratio at the cost of slow compression."""
+
+    name = 'lzma'
+
+    def compress(self, data):
+
+        return lzma.compress(data)
+
+    def decompress(self, data):
+
+        return lzma.decompress(data)
+
+
+class BZ2Codec:
+    """Good ratio on repetitive text."""
+
+    name = 'bz2'
+
+    def compress(self, data):
+
+        return bz2.compress(data)
+
+    def decompress(self, data):
+
+        return bz2.decompress(data)
+
+
+codecs = {codec.name: codec for codec in [ZlibCodec(), LZMACodec(), BZ2Codec()]}
+
+
+def register_codec(codec):
+    """Make codec instance available by its name.  Workers decompress
+    job data with the codec registered under the name stored in the
+    job, so custom codec must be registered on both sides.
+
+    :type codec: codec instance
+
+    """
+
+    codecs[codec.name] = codec
+    return codec
+
+
+def get_codec(codec):
+    """Compression codec instance by its name.  Codec instances are
+    returned as is if their name is registered.
+
+    :type codec: str or codec instance
+
+    """
+
+    if not isinstance(codec, str):
+        if codec.name not in codecs:
+            raise ValueError('Compression codec is not registered: {}'.format(
+                codec.name))
+        return codec
+    try:
+        return codecs[codec]
+    except KeyError:
+        raise ValueError('Unknown compression codec: {}'.format(codec))
+
+
+def compress(codec, data, threshold):
+    """Compress ``data`` with ``codec`` if it is at least ``threshold``
+    bytes long and compression pays off.
+
+    Returns data, name of the used codec or None and compression
+    ratio or None.
+
+    :type data: bytes
+    :type threshold: int
+
+    """
+
+    if codec is None:
+        return data, None, None
+    codec = get_codec(codec)
+    if len(data) < threshold:
+        return data, None, None
+    compressed = codec.compress(data)
+    if len(compressed) >= len(data):
+        return data, None, None
+    return compressed, codec.name, len(compressed) / len(data)
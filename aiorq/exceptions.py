@@ -19,7 +19,19 @@ class InvalidOperationError(Exception):
     pass
 
 
+class WorkersSuspendedError(Exception):
+    """Workers are suspended and must not take new jobs."""
+
+    pass
+
+
 class JobTimeoutException(Exception):
     """Error signify that coroutine is not finished in time."""
 
     pass
+
+
+class MissingArgumentError(Exception):
+    """Offloaded job argument or broadcast value is gone."""
+
+    pass
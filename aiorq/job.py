@@ -11,21 +11,28 @@
 # and released under 2-clause BSD license.
 
 import asyncio
-import pickle
 
 from . import protocol
+from .exceptions import NoSuchJobError
+from .blobs import resolve_args
+from .compression import get_codec
+from .serializers import get_serializer
 from .specs import JobStatus
-from .utils import utcformat, utcparse, import_attribute, function_name
+from .utils import utcformat, utcparse, resolve_function, function_name
 
 
 @asyncio.coroutine
 def cancel_job(job_id, connection=None):
     """Cancels the job with the given job ID, preventing execution.
 
-    Discards any job info (i.e. it can't be requeued later).
+    Discards any job info (i.e. it can't be requeued later).  Running
+    job is stopped by its worker and keeps canceled status.
     """
 
-    return None
+    spec = yield from protocol.job(connection, job_id)
+    if spec:
+        origin = spec[b'origin'].decode()
+        yield from protocol.cancel_job(connection, origin, job_id)
 
 
 @asyncio.coroutine
@@ -37,7 +44,9 @@ def requeue_job(job_id, connection=None):
     NoSuchJobError is raised.
     """
 
-    return None
+    if not (yield from protocol.job(connection, job_id)):
+        raise NoSuchJobError('No such job: {}'.format(job_id))
+    yield from protocol.requeue_job(connection, job_id)
 
 
 @asyncio.coroutine
@@ -51,33 +60,64 @@ def get_current_job(connection=None):
     return None
 
 
-def create_job(redis, id, spec):
-    """Create job instance from job id and protocol job spec."""
-
-    job_id = id if isinstance(id, str) else id.decode()
-    created_at = utcparse(spec[b'created_at'].decode())
-    enqueued_at = utcparse(spec[b'enqueued_at'].decode())
-    func_name, instance, args, kwargs = pickle.loads(spec[b'data'])
-    if instance:
-        func = getattr(instance, func_name)
-    else:
-        func = import_attribute(func_name)
-    description = spec[b'description'].decode()
-    status = spec[b'status'].decode()
-    origin = spec[b'origin'].decode()
-    timeout = spec[b'timeout']
-    result_ttl = spec[b'result_ttl']
-    job = Job(connection=redis, id=job_id, created_at=created_at,
-              enqueued_at=enqueued_at, func=func, args=args,
-              kwargs=kwargs, description=description, timeout=timeout,
-              result_ttl=result_ttl, status=status, origin=origin)
+def create_job(redis, id, spec, blobs=None):
+    """Create job instance from job id and protocol job spec.
+    Offloaded arguments are restored from ``blobs`` if given.
+
+    Job fields are decoded on first access.  Job data is unpickled
+    only when function or its arguments are accessed, so listing jobs
+    doesn't pay for their payloads.
+    """
+
+    job = Job.__new__(Job)
+    job.connection = redis
+    job.id = id if isinstance(id, str) else id.decode()
+    job._spec = spec
+    job._blobs = blobs
     return job
 
 
+class spec_field:
+    """Job attribute computed from the protocol job spec on first
+    access.  Computed value is stored in the instance dict, so it can
+    be reassigned as usual attribute."""
+
+    def __init__(self, function):
+
+        self.function = function
+        self.name = function.__name__
+        self.__doc__ = function.__doc__
+
+    def __get__(self, instance, owner):
+
+        if instance is None:
+            return self
+        value = self.function(instance)
+        instance.__dict__[self.name] = value
+        return value
+
+
+class Retry:
+    """Retry policy for failed jobs.
+
+    Job is executed at most `max_attempts` times.  Delay before next
+    attempt starts from `backoff` seconds and doubles after each
+    failure.  Random part up to `jitter` fraction of the delay is
+    added to spread retries of simultaneously failed jobs.
+    """
+
+    def __init__(self, max_attempts, backoff=1, jitter=0):
+
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.jitter = jitter
+
+
 class Job:
     """A Job is just convenient data structure to pass around (meta) data."""
 
     protocol = protocol
+    compression_ratio = None
 
     def __init__(self, connection, id, func, args, kwargs, description,
                  timeout, result_ttl, origin, created_at,
@@ -97,6 +137,84 @@ class Job:
         self.status = status  # TODO: don't store in spec if None
         self.dependency_id = dependency_id  # TODO: don't store in spec if None
 
+    @spec_field
+    def created_at(self):
+
+        return utcparse(self._spec[b'created_at'].decode())
+
+    @spec_field
+    def enqueued_at(self):
+
+        if b'enqueued_at' in self._spec:
+            return utcparse(self._spec[b'enqueued_at'].decode())
+        return None
+
+    @spec_field
+    def description(self):
+
+        return self._spec[b'description'].decode()
+
+    @spec_field
+    def status(self):
+
+        return self._spec[b'status'].decode()
+
+    @spec_field
+    def origin(self):
+
+        return self._spec[b'origin'].decode()
+
+    @spec_field
+    def timeout(self):
+
+        return self._spec[b'timeout']
+
+    @spec_field
+    def result_ttl(self):
+
+        return self._spec.get(b'result_ttl')
+
+    @spec_field
+    def dependency_id(self):
+
+        return None
+
+    @spec_field
+    def _call(self):
+        """Unpickled function and arguments of the job."""
+
+        spec = self._spec
+        data = spec[b'data']
+        if b'codec' in spec:
+            data = get_codec(spec[b'codec'].decode()).decompress(data)
+        serializer = get_serializer(
+            spec.get(b'serializer', b'pickle').decode())
+        buffers = [spec[b'buffer:' + str(number).encode()]
+                   for number in range(int(spec.get(b'buffers', 0)))]
+        func_name, instance, args, kwargs = serializer.loads(data, buffers)
+        if self._blobs is not None:
+            args, kwargs = resolve_args(args, kwargs, self._blobs)
+        if instance:
+            func = getattr(instance, func_name)
+        else:
+            func = resolve_function(func_name)
+        return func, args, kwargs
+
+    @spec_field
+    def func(self):
+
+        return self._call[0]
+
+    @spec_field
+    def args(self):
+
+        return self._call[1]
+
+    @spec_field
+    def kwargs(self):
+
+        return self._call[2]
+
     @asyncio.coroutine
     def get_status(self):
         """Get job status asynchronously."""
@@ -137,6 +255,23 @@ class Job:
         self.status = status.decode()
         return self.status == JobStatus.STARTED
 
+    @property
+    @asyncio.coroutine
+    def is_canceled(self):
+
+        status = yield from self.protocol.job_status(self.connection, self.id)
+        self.status = status.decode()
+        return self.status == JobStatus.CANCELED
+
+    @property
+    @asyncio.coroutine
+    def exc_info(self):
+        """Exception information of the failed job."""
+
+        exc_info = yield from self.protocol.job_exc_info(
+            self.connection, self.id)
+        return exc_info.decode() if exc_info else None
+
     @property
     @asyncio.coroutine
     def is_deferred(self):
@@ -8,9 +8,6 @@
     :license: LGPL-3, see LICENSE for more details.
 """
 
-from .specs import JobStatus
-
-
 def queues_key():
     """Redis key for all named queues names."""
 
@@ -23,12 +20,6 @@ def queue_key(name):
     return 'rq:queue:' + name
 
 
-def failed_queue_key():
-    """Redis key for failed queue."""
-
-    return queue_key(JobStatus.FAILED)
-
-
 def job_key(id):
     """Redis key for job hash."""
 
@@ -41,6 +32,18 @@ def dependents(id):
     return 'rq:job:' + id + ':dependents'
 
 
+def unique_lock(name):
+    """Redis key for unique job lock."""
+
+    return 'rq:unique:' + name
+
+
+def coalesced_job(queue, name):
+    """Redis key for the queued job which absorbs coalesced enqueues."""
+
+    return 'rq:coalesce:' + queue + ':' + name
+
+
 def started_registry(queue):
     """Redis key for started job registry."""
 
@@ -59,6 +62,108 @@ def deferred_registry(queue):
     return 'rq:deferred:' + queue
 
 
+def canceled_jobs(queue):
+    """Redis key for canceled job ids still present in the queue."""
+
+    return 'rq:canceled:' + queue
+
+
+def failed_registry():
+    """Redis key for failed job registry."""
+
+    return 'rq:failed'
+
+
+def failed_origin_index(origin):
+    """Redis key for failed jobs of the given origin queue."""
+
+    return 'rq:failed:origin:' + origin
+
+
+def failed_exc_type_index(exc_type):
+    """Redis key for failed jobs with the given exception type."""
+
+    return 'rq:failed:exc_type:' + exc_type
+
+
+def traceback_key(exc_hash):
+    """Redis key for deduplicated traceback."""
+
+    return 'rq:traceback:' + exc_hash
+
+
+def failures_key():
+    """Redis key for failure summary."""
+
+    return 'rq:failures'
+
+
+def blob_key(hash):
+    """Redis key for offloaded job argument."""
+
+    return 'rq:blob:' + hash
+
+
+def broadcast_key(hash):
+    """Redis key for broadcast value."""
+
+    return 'rq:broadcast:' + hash
+
+
+def scheduled_registry(queue):
+    """Redis key for scheduled job registry."""
+
+    return 'rq:scheduled:' + queue
+
+
+def expired_counter(queue):
+    """Redis key for number of jobs expired in the queue."""
+
+    return 'rq:expired:' + queue
+
+
+def compacted_entries(queue):
+    """Redis key for number of compacted entries left in the queue."""
+
+    return 'rq:compacted:' + queue
+
+
+def maintenance_lease():
+    """Redis key for maintenance lease."""
+
+    return 'rq:maintenance'
+
+
+def maintenance_fence():
+    """Redis key for maintenance lease fencing token counter."""
+
+    return 'rq:maintenance:fence'
+
+
+def paused_queues():
+    """Redis key for paused queues set."""
+
+    return 'rq:paused'
+
+
+def workers_suspended():
+    """Redis key for workers suspension flag."""
+
+    return 'rq:suspended'
+
+
+def resume_channel():
+    """Redis channel notified when workers are resumed."""
+
+    return 'rq:resume'
+
+
+def cancel_channel():
+    """Redis channel notified when running job is canceled."""
+
+    return 'rq:cancel'
+
+
 def workers_key():
     """Redis key for workers set."""
 
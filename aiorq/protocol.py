@@ -9,13 +9,387 @@
 """
 
 import asyncio
+import random
 
-from .exceptions import InvalidOperationError
-from .keys import (queues_key, queue_key, failed_queue_key, job_key,
+from .exceptions import InvalidOperationError, WorkersSuspendedError
+from .keys import (queues_key, queue_key, job_key,
                    started_registry, finished_registry, deferred_registry,
-                   workers_key, worker_key, dependents)
+                   scheduled_registry, expired_counter, compacted_entries,
+                   workers_key, worker_key, dependents, unique_lock,
+                   coalesced_job, maintenance_lease, maintenance_fence,
+                   paused_queues, canceled_jobs, failed_registry,
+                   failed_origin_index, failed_exc_type_index,
+                   traceback_key, failures_key, blob_key, broadcast_key)
 from .specs import JobStatus, WorkerStatus
-from .utils import unset, current_timestamp, utcformat, utcnow
+from .utils import unset, current_timestamp, utcformat, utcnow, utcparse
+
+
+# Lua snippets shared between scripts below.
+
+release_unique_lock = """
+    local function release_unique_lock(job, id)
+        local lock = redis.call("hget", job, "unique_key")
+        if lock and redis.call("get", lock) == id then
+            redis.call("del", lock)
+        end
+    end
+"""
+
+# Drops job references to its offloaded arguments.  Blob is deleted
+# with its last reference.  Referencing job ids are kept next to the
+# blob, so references of vanished jobs can be swept.
+release_blobs = """
+    local function release_blobs(job)
+        local blobs = redis.call("hget", job, "blobs")
+        if blobs then
+            local id = string.sub(job, 8)
+            for hash in string.gmatch(blobs, "%S+") do
+                local blob = "rq:blob:"..hash
+                if redis.call("hincrby", blob, "refcount", -1) <= 0 then
+                    redis.call("del", blob, blob..":jobs")
+                else
+                    redis.call("srem", blob..":jobs", id)
+                end
+            end
+            redis.call("hdel", job, "blobs")
+        end
+    end
+"""
+
+# Drops job reference to its deduplicated traceback.  Traceback is
+# deleted with its last reference.
+release_traceback = """
+    local function release_traceback(job)
+        local exc_hash = redis.call("hget", job, "exc_hash")
+        if exc_hash then
+            local traceback = "rq:traceback:"..exc_hash
+            if redis.call("hincrby", traceback, "refcount", -1) <= 0 then
+                redis.call("del", traceback)
+            end
+            redis.call("hdel", job, "exc_hash")
+        end
+    end
+"""
+
+# Expects release_traceback defined.  Traceback with non empty hash
+# is stored once and referenced from the job.
+store_traceback = """
+    local function store_traceback(job, exc_info, exc_hash, seen_at)
+        release_traceback(job)
+        if exc_hash == "" then
+            redis.call("hset", job, "exc_info", exc_info)
+            return
+        end
+        local traceback = "rq:traceback:"..exc_hash
+        if redis.call("hsetnx", traceback, "exc_info", exc_info) == 1 then
+            redis.call("hset", traceback, "first_seen", seen_at)
+        end
+        redis.call("hincrby", traceback, "refcount", 1)
+        redis.call("hset", traceback, "last_seen", seen_at)
+        redis.call("hset", job, "exc_hash", exc_hash)
+        redis.call("hdel", job, "exc_info")
+    end
+"""
+
+# Keeps finished job for its result TTL, job without TTL is deleted
+# at once.
+expire_job = """
+    local function expire_job(job)
+        local ttl = tonumber(redis.call("hget", job, "result_ttl")) or 500
+        if ttl > 0 then
+            redis.call("expire", job, ttl)
+        elseif ttl == 0 then
+            redis.call("del", job)
+        end
+    end
+"""
+
+# Expects release_unique_lock, release_blobs, release_traceback and
+# expire_job defined.  Deferred dependents of the job which will never
+# finish are canceled together with their own dependents.
+cancel_dependents = """
+    local function cancel_dependents(job, ended_at)
+        local parents = {job}
+        while #parents > 0 do
+            local parent = table.remove(parents)
+            local children = redis.call("smembers", parent..":dependents")
+            for _, child in ipairs(children) do
+                local child_job = "rq:job:"..child
+                local state = redis.call("hmget", child_job,
+                                         "status", "origin")
+                if state[1] == "deferred" then
+                    redis.call("zrem", "rq:deferred:"..state[2], child)
+                    release_unique_lock(child_job, child)
+                    release_blobs(child_job)
+                    release_traceback(child_job)
+                    redis.call("hmset", child_job, "status", "canceled",
+                               "ended_at", ended_at)
+                    expire_job(child_job)
+                    table.insert(parents, child_job)
+                end
+            end
+            redis.call("del", parent..":dependents")
+        end
+    end
+"""
+
+# Expects release_traceback defined.  Removes failed job from failed
+# registry, its indexes and failure summary.  Returns job origin.
+forget_failed_job = """
+    local function forget_failed_job(id)
+        local job = "rq:job:"..id
+        local state = redis.call("hmget", job, "origin", "exc_type",
+                                 "failure")
+        redis.call("zrem", "rq:failed", id)
+        if state[1] then
+            redis.call("zrem", "rq:failed:origin:"..state[1], id)
+        end
+        if state[2] and state[2] ~= "" then
+            redis.call("zrem", "rq:failed:exc_type:"..state[2], id)
+        end
+        if state[3] then
+            if redis.call("hincrby", "rq:failures", state[3], -1) <= 0 then
+                redis.call("hdel", "rq:failures", state[3])
+            end
+            redis.call("hdel", job, "failure")
+        end
+        release_traceback(job)
+        return state[1]
+    end
+"""
+
+# Expects release_unique_lock and store_traceback defined.  Failed
+# job is indexed by origin and by exception type unless it's empty
+# and counted in the failure summary.
+move_to_failed = """
+    local function move_to_failed(queue, id, ended_at, exc_info, now,
+                                  exc_type, exc_hash, func)
+        local job = "rq:job:"..id
+        release_unique_lock(job, id)
+        redis.call("zadd", "rq:failed", now, id)
+        redis.call("zadd", "rq:failed:origin:"..queue, now, id)
+        if exc_type ~= "" then
+            redis.call("zadd", "rq:failed:exc_type:"..exc_type, now, id)
+        end
+        local failure = exc_type.."\t"..func.."\t"..queue
+        redis.call("hincrby", "rq:failures", failure, 1)
+        redis.call("hmset", job, "status", "failed", "ended_at", ended_at,
+                   "exc_type", exc_type, "failure", failure)
+        store_traceback(job, exc_info, exc_hash, ended_at)
+        return "failed"
+    end
+"""
+
+# Expects release_unique_lock, release_blobs, store_traceback and
+# expire_job defined.  Failed job handled by worker exception handlers
+# leaves the started registry but isn't moved to the failed queue.  It
+# is kept for its result TTL instead.
+drop_failed_job = """
+    local function drop_failed_job(queue, id, ended_at, exc_info,
+                                   exc_type, exc_hash)
+        local job = "rq:job:"..id
+        redis.call("zrem", "rq:wip:"..queue, id)
+        release_unique_lock(job, id)
+        release_blobs(job)
+        redis.call("hmset", job, "status", "failed", "ended_at", ended_at,
+                   "exc_type", exc_type)
+        store_traceback(job, exc_info, exc_hash, ended_at)
+        expire_job(job)
+        return "failed"
+    end
+"""
+
+# Expects cancel_dependents defined.  Job canceled while running is
+# kept for its result TTL whatever its outcome, its dependents are
+# canceled.
+keep_canceled_job = """
+    local function keep_canceled_job(job, id, ended_at)
+        release_unique_lock(job, id)
+        release_blobs(job)
+        release_traceback(job)
+        redis.call("hset", job, "ended_at", ended_at)
+        cancel_dependents(job, ended_at)
+        expire_job(job)
+        return "canceled"
+    end
+"""
+
+# Expects move_to_failed and keep_canceled_job defined and
+# math.random seeded.
+fail_or_retry_job = """
+    local function fail_or_retry_job(queue, id, ended_at, exc_info, now,
+                                     exc_type, exc_hash, func)
+        local job = "rq:job:"..id
+        redis.call("zrem", "rq:wip:"..queue, id)
+        if redis.call("hget", job, "status") == "canceled" then
+            return keep_canceled_job(job, id, ended_at)
+        end
+        local retry = redis.call("hmget", job, "attempts", "retry_max",
+                                 "retry_backoff", "retry_jitter")
+        local attempts = tonumber(retry[1]) or 0
+        if attempts < (tonumber(retry[2]) or 0) then
+            local delay = tonumber(retry[3]) * 2 ^ math.max(attempts - 1, 0)
+            delay = delay * (1 + tonumber(retry[4]) * math.random())
+            redis.call("zadd", "rq:scheduled:"..queue, now + delay, id)
+            redis.call("hmset", job, "status", "scheduled",
+                       "exc_type", exc_type)
+            store_traceback(job, exc_info, exc_hash, ended_at)
+            return "scheduled"
+        end
+        return move_to_failed(queue, id, ended_at, exc_info, now,
+                              exc_type, exc_hash, func)
+    end
+"""
+
+# Expects release_unique_lock, release_blobs, release_traceback and
+# cancel_dependents defined.  Returns job id and its hash
+# fields, nil if the queue is empty or paused or false if ``discard``
+# expired jobs were thrown away during this script call.
+pop_job = """
+    local discarded = 0
+    local function pop_job(name, now, promote, enqueued_at, discard)
+        if redis.call("sismember", "rq:paused", name) == 1 then
+            return nil
+        end
+        local queue, scheduled = "rq:queue:"..name, "rq:scheduled:"..name
+        local due = redis.call("zrangebyscore", scheduled, "-inf", now,
+                               "limit", 0, promote)
+        for _, id in ipairs(due) do
+            redis.call("zrem", scheduled, id)
+            if redis.call("exists", "rq:job:"..id) == 1 then
+                redis.call("hmset", "rq:job:"..id, "status", "queued",
+                           "enqueued_at", enqueued_at)
+                redis.call("rpush", queue, id)
+            end
+        end
+        while true do
+            local id = redis.call("lpop", queue)
+            if not id then
+                return nil
+            end
+            local job = "rq:job:"..id
+            local fields = {}
+            if id == "rq:compacted" then
+                if redis.call("decr", "rq:compacted:"..name) <= 0 then
+                    redis.call("del", "rq:compacted:"..name)
+                end
+            elseif redis.call("srem", "rq:canceled:"..name, id) == 0 then
+                fields = redis.call("hgetall", job)
+            end
+            if #fields > 0 then
+                local spec = {}
+                for i = 1, #fields, 2 do
+                    spec[fields[i]] = fields[i + 1]
+                end
+                if spec.coalesce_key and
+                   redis.call("get", spec.coalesce_key) == id then
+                    redis.call("del", spec.coalesce_key)
+                end
+                if not spec.expires_at or
+                   tonumber(spec.expires_at) > tonumber(now) then
+                    return id, fields
+                end
+                release_unique_lock(job, id)
+                release_blobs(job)
+                release_traceback(job)
+                cancel_dependents(job, enqueued_at)
+                redis.call("del", job)
+                redis.call("incr", "rq:expired:"..name)
+                discarded = discarded + 1
+                if discarded >= discard then
+                    return false
+                end
+            end
+        end
+    end
+"""
+
+# Expects keep_canceled_job defined.  Dependents of the finished job
+# are enqueued into their origin queues.
+finish_job_and_release = """
+    local function finish_job_and_release(queue, id, ended_at, now,
+                                          result_ttl, result)
+        local job = "rq:job:"..id
+        redis.call("zrem", "rq:wip:"..queue, id)
+        if redis.call("hget", job, "status") == "canceled" then
+            return keep_canceled_job(job, id, ended_at)
+        end
+        release_unique_lock(job, id)
+        release_blobs(job)
+        release_traceback(job)
+        if result_ttl == 0 then
+            redis.call("del", job)
+        else
+            local score = result_ttl
+            if result_ttl >= 0 then
+                score = now + result_ttl
+            end
+            redis.call("zadd", "rq:finished:"..queue, score, id)
+            redis.call("hmset", job, "status", "finished",
+                       "ended_at", ended_at)
+            if result then
+                redis.call("hset", job, "result", result)
+            end
+            if result_ttl == -1 then
+                redis.call("persist", job)
+            else
+                redis.call("expire", job, result_ttl)
+            end
+        end
+        for _, child in ipairs(redis.call("smembers", job..":dependents")) do
+            local origin = redis.call("hget", "rq:job:"..child, "origin")
+            if origin then
+                redis.call("zrem", "rq:deferred:"..origin, child)
+                redis.call("sadd", "rq:queues", origin)
+                redis.call("rpush", "rq:queue:"..origin, child)
+                redis.call("hmset", "rq:job:"..child, "status", "queued",
+                           "enqueued_at", ended_at)
+            end
+        end
+        redis.call("del", job..":dependents")
+        return "finished"
+    end
+"""
+
+# Empty token means caller doesn't hold maintenance lease at all.
+holds_maintenance_lease = """
+    local function holds_maintenance_lease(token)
+        return token == "" or redis.call("get", "rq:maintenance") == token
+    end
+"""
+
+
+def lease_token(lease):
+    """Script argument for optional maintenance lease token."""
+
+    return '' if lease is unset else lease
+
+
+def check_lease(reply):
+    """Raise if fenced maintenance script was rejected."""
+
+    if reply is None:
+        raise InvalidOperationError('Maintenance lease is lost')
+    return reply
+
+
+# Use with arguments built by lease_renewal.
+renew_leases = """
+    local score = ARGV[1]
+    for i, registry in ipairs(KEYS) do
+        redis.call("zadd", registry, "xx", score, ARGV[i + 1])
+    end
+"""
+
+
+def lease_renewal(jobs, lease):
+    """Keys and arguments of the `renew_leases` script."""
+
+    keys, args = [], [current_timestamp() + lease]
+    for queue, id in jobs:
+        keys.append(started_registry(queue))
+        args.append(id)
+    return keys, args
 
 
 @asyncio.coroutine
@@ -43,6 +417,34 @@ def jobs(redis, queue, start=0, end=-1):
     return (yield from redis.lrange(queue_key(queue), start, end))
 
 
+@asyncio.coroutine
+def queued_jobs(redis, queue, start=0, end=-1):
+    """Queue jobs which can still be dequeued.  Canceled jobs, jobs
+    with missing hash and compacted entries in the given range of the
+    queue are skipped.
+
+    :type redis: `aioredis.Redis`
+    :type queue: str
+    :type start: int
+    :type end: int
+
+    """
+
+    script = """
+        local ids = redis.call("lrange", KEYS[1], ARGV[1], ARGV[2])
+        local result = {}
+        for _, id in ipairs(ids) do
+            if redis.call("sismember", KEYS[2], id) == 0 and
+               redis.call("exists", "rq:job:"..id) == 1 then
+                table.insert(result, id)
+            end
+        end
+        return result
+    """
+    keys = [queue_key(queue), canceled_jobs(queue)]
+    return (yield from redis.eval(script, keys=keys, args=[start, end]))
+
+
 @asyncio.coroutine
 def job(redis, id):
     """Get job hash by job id.
@@ -53,6 +455,16 @@ def job(redis, id):
     """
 
     job_hash = yield from redis.hgetall(job_key(id))
+    return parse_job_hash(job_hash)
+
+
+def parse_job_hash(job_hash):
+    """Convert numeric fields of the job hash.
+
+    :type job_hash: dict
+
+    """
+
     if b'timeout' in job_hash:
         job_hash[b'timeout'] = int(job_hash[b'timeout'])
     if b'result_ttl' in job_hash:
@@ -116,28 +528,51 @@ def deferred_jobs(redis, queue, start=0, end=-1):
     return (yield from redis.zrange(deferred_registry(queue), start, end))
 
 
+@asyncio.coroutine
+def scheduled_jobs(redis, queue, start=0, end=-1):
+    """All scheduled jobs from this queue.  Jobs are waiting in this
+    registry for another attempt after failure.
+
+    :type redis: `aioredis.Redis`
+    :type queue: str
+    :type start: int
+    :type end: int
+
+    """
+
+    return (yield from redis.zrange(scheduled_registry(queue), start, end))
+
+
 @asyncio.coroutine
 def queue_length(redis, name):
-    """Get length of given queue.
+    """Get length of given queue.  Canceled jobs and entries left by
+    compaction aren't counted.
 
     :type redis: `aioredis.Redis`
     :type name: str
 
     """
 
-    return (yield from redis.llen(queue_key(name)))
+    multi = redis.multi_exec()
+    multi.llen(queue_key(name))
+    multi.scard(canceled_jobs(name))
+    multi.get(compacted_entries(name))
+    length, canceled, compacted = yield from multi.execute()
+    return length - canceled - int(compacted or 0)
 
 
 @asyncio.coroutine
 def empty_queue(redis, name):
-    """Removes all jobs on the queue.
+    """Removes all jobs on the queue.  Their unique locks, blobs and
+    tracebacks are released, their deferred dependents are canceled.
 
     :type redis: `aioredis.Redis`
     :type name: str
 
     """
 
-    script = """
+    script = (release_unique_lock + release_blobs + release_traceback +
+              expire_job + cancel_dependents + """
         local prefix = "rq:job:"
         local q = KEYS[1]
         local count = 0
@@ -148,26 +583,175 @@ def empty_queue(redis, name):
             end
 
             -- Delete the relevant keys
-            redis.call("del", prefix..job_id)
-            redis.call("del", prefix..job_id..":dependents")
-            count = count + 1
+            local job = prefix..job_id
+            local coalesce = redis.call("hget", job, "coalesce_key")
+            if coalesce and redis.call("get", coalesce) == job_id then
+                redis.call("del", coalesce)
+            end
+            release_unique_lock(job, job_id)
+            release_blobs(job)
+            release_traceback(job)
+            cancel_dependents(job, ARGV[1])
+            redis.call("del", job)
+            if redis.call("srem", KEYS[2], job_id) == 0 and
+               job_id ~= "rq:compacted" then
+                count = count + 1
+            end
         end
+        redis.call("del", KEYS[2], KEYS[3])
         return count
+    """)
+    keys = [queue_key(name), canceled_jobs(name), compacted_entries(name)]
+    return (yield from redis.eval(
+        script, keys=keys, args=[utcformat(utcnow())]))
+
+
+@asyncio.coroutine
+def pause_queue(redis, name):
+    """Stop dequeuing jobs from given queue.  Jobs can still be
+    enqueued into it.
+
+    :type redis: `aioredis.Redis`
+    :type name: str
+
     """
-    return (yield from redis.eval(script, keys=[queue_key(name)]))
+
+    yield from redis.sadd(paused_queues(), name)
 
 
 @asyncio.coroutine
-def compact_queue(redis):
-    pass
+def resume_queue(redis, name):
+    """Continue dequeuing jobs from given queue.
+
+    :type redis: `aioredis.Redis`
+    :type name: str
+
+    """
+
+    yield from redis.srem(paused_queues(), name)
+
+
+@asyncio.coroutine
+def queue_paused(redis, name):
+    """Check if given queue is paused.
+
+    :type redis: `aioredis.Redis`
+    :type name: str
+
+    """
+
+    return bool((yield from redis.sismember(paused_queues(), name)))
+
+
+@asyncio.coroutine
+def compact_queue(redis, name, offset=0, *, limit=1000, lease=unset):
+    """Remove canceled and missing jobs from the queue.  Single call
+    examines at most ``limit`` queue entries starting from ``offset``.
+    Order of the remaining jobs is preserved.
+
+    Removed entries are overwritten in place with a marker, so call
+    cost doesn't depend on the number of entries removed before.
+    Markers are dropped from the queue ends at once and from the rest
+    of the queue when dequeued.
+
+    Returns next offset and number of removed jobs.  Compaction is
+    over when returned offset is zero.  Raise `InvalidOperationError`
+    if ``lease`` token is given and maintenance lease is lost.
+
+    :type redis: `aioredis.Redis`
+    :type name: str
+    :type offset: int
+    :type limit: int
+    :type lease: str
+
+    """
+
+    script = holds_maintenance_lease + """
+        if not holds_maintenance_lease(ARGV[3]) then
+            return false
+        end
+        local queue, canceled, compacted = KEYS[1], KEYS[2], KEYS[3]
+        local offset, limit = tonumber(ARGV[1]), tonumber(ARGV[2])
+        local marker = "rq:compacted"
+        local ids = redis.call("lrange", queue, offset, offset + limit - 1)
+        local removed = 0
+        for i, id in ipairs(ids) do
+            if id ~= marker and
+               (redis.call("srem", canceled, id) == 1 or
+                redis.call("exists", "rq:job:"..id) == 0) then
+                redis.call("lset", queue, offset + i - 1, marker)
+                removed = removed + 1
+            end
+        end
+        redis.call("incrby", compacted, removed)
+        local dropped = 0
+        while dropped < offset + #ids and
+              redis.call("lindex", queue, 0) == marker do
+            redis.call("lpop", queue)
+            dropped = dropped + 1
+        end
+        local next = offset + #ids - dropped
+        while redis.call("lindex", queue, -1) == marker do
+            redis.call("rpop", queue)
+            dropped = dropped + 1
+        end
+        if redis.call("decrby", compacted, dropped) <= 0 then
+            redis.call("del", compacted)
+        end
+        if #ids < limit then
+            return {0, removed}
+        end
+        return {next, removed}
+    """
+    keys = [queue_key(name), canceled_jobs(name), compacted_entries(name)]
+    args = [offset, limit, lease_token(lease)]
+    offset, removed = check_lease((yield from redis.eval(
+        script, keys=keys, args=args)))
+    return offset, removed
 
 
 @asyncio.coroutine
 def enqueue_job(redis, queue, id, data, description, timeout,
                 created_at, *, result_ttl=unset, dependency_id=unset,
-                at_front=False):
+                at_front=False, unique_key=unset, unique_ttl=unset,
+                coalesce_key=unset, retry=unset, ttl=unset,
+                hash_ttl=unset, serializer=unset, codec=unset, blobs=unset,
+                buffers=unset):
     """Persists the job specification to it corresponding Redis id.
 
+    Job with ``unique_key`` will be stored only if there is no other
+    job holding the same key.  Otherwise nothing is stored and fields
+    of the job holding this key are returned.  Key is released when
+    its job is finished or failed, or after ``unique_ttl`` seconds.
+
+    Job with ``coalesce_key`` replaces data and description of the
+    job enqueued with the same key in the same queue if that job is
+    still waiting in the queue.  No new job is stored in that case.
+
+    Failed job with ``retry`` policy is retried until given amount of
+    attempts is exhausted.  Policy is a tuple of maximum attempts
+    number, backoff in seconds and jitter factor.
+
+    Job with ``ttl`` is discarded if it wasn't dequeued within given
+    amount of seconds.
+
+    Job hash with ``hash_ttl`` expires after given amount of seconds
+    unless the job is started.  This bounds memory leaked by jobs
+    lost from the queue.
+
+    Job ``data`` encoded with other than pickle ``serializer`` keeps
+    serializer name in the job hash.  Compressed ``data`` keeps its
+    ``codec`` name the same way.
+
+    ``blobs`` are payloads of offloaded arguments by their hash.
+    Each blob is stored once and referenced by all jobs using it.
+    Reference is released when the job is finished or deleted.
+
+    Out-of-band pickle ``buffers`` are stored in separate job hash
+    fields next to ``data``.
+
+    Returns job id, job status and enqueued_at time.
+
     :type redis: `aioredis.Redis`
     :type queue: str
     :type id: str
@@ -178,70 +762,378 @@ def enqueue_job(redis, queue, id, data, description, timeout,
     :type result_ttl: int or None or unset
     :type dependency_id: str or unset
     :type at_front: bool
+    :type unique_key: str or unset
+    :type unique_ttl: int or unset
+    :type coalesce_key: str or unset
+    :type retry: tuple or unset
+    :type ttl: int or unset
+    :type hash_ttl: int or unset
+    :type serializer: str or unset
+    :type codec: str or unset
+    :type blobs: dict or unset
+    :type buffers: list or unset
 
     """
 
+    script = release_blobs + """
+        local queues, queue, job, deferred = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+        local dependency, dependents, lock = KEYS[5], KEYS[6], KEYS[7]
+        local coalesce = KEYS[8]
+        local name, id, at_front, score = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+        local enqueued_at, lock_ttl, hash_ttl = ARGV[5], ARGV[6], ARGV[7]
+        local blobs = tonumber(ARGV[8])
+        local fields = {}
+        for i = 9 + blobs, #ARGV, 2 do
+            fields[ARGV[i]] = ARGV[i + 1]
+        end
+        local function take_blobs(owner)
+            for i = 1, blobs do
+                local blob = KEYS[8 + i]
+                redis.call("hsetnx", blob, "data", ARGV[8 + i])
+                redis.call("hincrby", blob, "refcount", 1)
+                redis.call("sadd", blob..":jobs", owner)
+            end
+        end
+
+        if lock ~= "" then
+            local set_args = {lock, id, "nx"}
+            if lock_ttl ~= "" then
+                set_args = {lock, id, "nx", "ex", lock_ttl}
+            end
+            if not redis.call("set", unpack(set_args)) then
+                local holder = redis.call("get", lock)
+                local state = redis.call("hmget", "rq:job:"..holder,
+                                         "status", "enqueued_at")
+                if state[1] then
+                    return {holder, state[1], state[2]}
+                end
+                -- Holder job hash is gone, steal its lock.
+                set_args[3] = "xx"
+                redis.call("set", unpack(set_args))
+            end
+        end
+
+        if coalesce ~= "" then
+            local holder = redis.call("get", coalesce)
+            if holder then
+                local holder_job = "rq:job:"..holder
+                local state = redis.call("hmget", holder_job,
+                                         "status", "enqueued_at")
+                if state[1] == "queued" then
+                    release_blobs(holder_job)
+                    take_blobs(holder)
+                    redis.call("hmset", holder_job,
+                               "data", fields.data,
+                               "description", fields.description)
+                    local buffers = redis.call("hget", holder_job, "buffers")
+                    for i = 0, (tonumber(buffers) or 0) - 1 do
+                        redis.call("hdel", holder_job, "buffer:"..i)
+                    end
+                    for i = 0, (tonumber(fields.buffers) or 0) - 1 do
+                        redis.call("hset", holder_job, "buffer:"..i,
+                                   fields["buffer:"..i])
+                    end
+                    for _, field in ipairs({"serializer", "codec", "blobs",
+                                            "buffers"}) do
+                        if fields[field] then
+                            redis.call("hset", holder_job, field,
+                                       fields[field])
+                        else
+                            redis.call("hdel", holder_job, field)
+                        end
+                    end
+                    return {holder, state[1], state[2]}
+                end
+            end
+        end
+
+        local status = "queued"
+        if dependency ~= "" and
+           redis.call("hget", dependency, "status") ~= "finished" then
+            status = "deferred"
+        end
+        redis.call("sadd", queues, name)
+        take_blobs(id)
+        redis.call("hmset", job, "status", status, unpack(ARGV, 9 + blobs))
+        if hash_ttl ~= "" then
+            redis.call("expire", job, hash_ttl)
+        end
+        if status == "deferred" then
+            redis.call("zadd", deferred, score, id)
+            redis.call("sadd", dependents, id)
+            return {id, status, false}
+        end
+        redis.call("hset", job, "enqueued_at", enqueued_at)
+        if coalesce ~= "" then
+            redis.call("set", coalesce, id)
+        end
+        if at_front == "1" then
+            redis.call("lpush", queue, id)
+        else
+            redis.call("rpush", queue, id)
+        end
+        return {id, status, enqueued_at}
+    """
     if result_ttl is None:
         result_ttl = -1
-    has_dependency = False
-    if dependency_id is not unset:
-        dependency_status = yield from job_status(redis, dependency_id)
-        if dependency_status != JobStatus.FINISHED.encode():
-            has_dependency = True
-    if has_dependency:
-        status = JobStatus.DEFERRED
-    else:
-        status = JobStatus.QUEUED
     fields = (
         'origin', queue,
         'data', data,
         'description', description,
         'timeout', timeout,
-        'created_at', created_at,
-        'status', status)
+        'created_at', created_at)
     if result_ttl is not unset:
         fields += ('result_ttl', result_ttl)
-    if not has_dependency:
-        fields += ('enqueued_at', utcformat(utcnow()))
+    if serializer is not unset:
+        fields += ('serializer', serializer)
+    if codec is not unset:
+        fields += ('codec', codec)
+    if buffers is not unset:
+        fields += ('buffers', len(buffers))
+        for number, buffer in enumerate(buffers):
+            fields += ('buffer:{}'.format(number), buffer)
+    if ttl is not unset:
+        fields += ('ttl', ttl,
+                   'expires_at', current_timestamp() + ttl)
+    if retry is not unset:
+        max_attempts, backoff, jitter = retry
+        fields += ('retry_max', max_attempts,
+                   'retry_backoff', backoff,
+                   'retry_jitter', jitter)
+    keys = [queues_key(), queue_key(queue), job_key(id),
+            deferred_registry(queue)]
+    if dependency_id is not unset:
+        keys += [job_key(dependency_id), dependents(dependency_id)]
+    else:
+        keys += ['', '']
+    if unique_key is not unset:
+        keys.append(unique_lock(unique_key))
+        fields += ('unique_key', unique_lock(unique_key))
+    else:
+        keys.append('')
+    if coalesce_key is not unset:
+        keys.append(coalesced_job(queue, coalesce_key))
+        fields += ('coalesce_key', coalesced_job(queue, coalesce_key))
+    else:
+        keys.append('')
+    if unique_ttl is unset:
+        unique_ttl = ''
+    if hash_ttl is unset:
+        hash_ttl = ''
+    blob_hashes = sorted(blobs) if blobs is not unset else []
+    if blob_hashes:
+        fields += ('blobs', ' '.join(blob_hashes))
+    keys.extend(blob_key(hash) for hash in blob_hashes)
+    args = [queue, id, int(at_front), current_timestamp(),
+            utcformat(utcnow()), unique_ttl, hash_ttl, len(blob_hashes)]
+    args.extend(blobs[hash] for hash in blob_hashes)
+    args.extend(fields)
+    id, status, enqueued_at = yield from redis.eval(
+        script, keys=keys, args=args)
+    if enqueued_at is not None:
+        enqueued_at = utcparse(enqueued_at.decode())
+    return id.decode(), status.decode(), enqueued_at
+
+
+@asyncio.coroutine
+def fetch_blobs(redis, hashes):
+    """Payloads of offloaded arguments by their hashes.  Missing blobs
+    are None.
+
+    :type redis: `aioredis.Redis`
+    :type hashes: list
+
+    """
+
     multi = redis.multi_exec()
-    multi.sadd(queues_key(), queue)
-    multi.hmset(job_key(id), *fields)
-    if has_dependency:
-        score = current_timestamp()
-        multi.zadd(deferred_registry(queue), score, id)
-        multi.sadd(dependents(dependency_id), id)
+    for hash in hashes:
+        multi.hget(blob_key(hash), 'data')
+    return dict(zip(hashes, (yield from multi.execute())))
+
+
+@asyncio.coroutine
+def store_broadcast(redis, hash, data, *, ttl=unset):
+    """Store broadcast value payload under its hash.  Payload expires
+    after ``ttl`` seconds if given.
+
+    :type redis: `aioredis.Redis`
+    :type hash: str
+    :type data: bytes
+    :type ttl: int
+
+    """
+
+    if ttl is unset:
+        yield from redis.set(broadcast_key(hash), data)
     else:
-        if at_front:
-            multi.lpush(queue_key(queue), id)
-        else:
-            multi.rpush(queue_key(queue), id)
-    # TODO: do we need expire job hash?
-    yield from multi.execute()
-    # TODO: return calculated fields.
+        yield from redis.set(broadcast_key(hash), data, expire=ttl)
 
 
 @asyncio.coroutine
-def dequeue_job(redis, queue):
-    """Dequeue the front-most job from this queue.
+def fetch_broadcasts(redis, hashes):
+    """Payloads of broadcast values by their hashes.  Missing values
+    are None.
+
+    :type redis: `aioredis.Redis`
+    :type hashes: list
+
+    """
+
+    keys = [broadcast_key(hash) for hash in hashes]
+    return dict(zip(hashes, (yield from redis.mget(*keys))))
+
+
+@asyncio.coroutine
+def delete_broadcast(redis, hash):
+    """Delete broadcast value.
+
+    :type redis: `aioredis.Redis`
+    :type hash: str
+
+    """
+
+    yield from redis.delete(broadcast_key(hash))
+
+
+@asyncio.coroutine
+def dequeue_job(redis, queue, *, promote=100, discard=1000):
+    """Dequeue the front-most job from this queue.  Dequeued job stops
+    to absorb coalesced enqueues.  Nothing is dequeued from paused
+    queue.
+
+    Scheduled jobs which are due are moved into the queue before, at
+    most ``promote`` of them at once.
+
+    Jobs with expired TTL are removed and counted on the Redis side
+    without being returned, at most ``discard`` of them in one script
+    call.
 
     :type redis: `aioredis.Redis`
     :type queue: str
+    :type promote: int
+    :type discard: int
 
     """
 
+    script = (release_unique_lock + release_blobs + release_traceback +
+              expire_job + cancel_dependents + pop_job + """
+        local id, fields = pop_job(ARGV[1], ARGV[2], ARGV[3], ARGV[4],
+                                   tonumber(ARGV[5]))
+        if id == false then
+            return 0
+        end
+        if not id then
+            return {}
+        end
+        return {id, fields}
+    """)
     while True:
-        job_id = yield from redis.lpop(queue_key(queue))
-        if not job_id:
+        args = [queue, current_timestamp(), promote, utcformat(utcnow()),
+                discard]
+        reply = yield from redis.eval(script, args=args)
+        if reply == 0:
+            continue
+        if not reply:
             return None, {}
-        job_hash = yield from job(redis, job_id.decode())
-        if not job_hash:
+        job_id, pairs = reply
+        job_hash = dict(zip(pairs[::2], pairs[1::2]))
+        return job_id, parse_job_hash(job_hash)
+
+
+@asyncio.coroutine
+def claim_job(redis, queues, *, lease=unset, promote=100, discard=1000):
+    """Dequeue the front-most job from the first non empty and not
+    paused queue of ``queues`` and start it in one call.
+
+    Started job stays in the started registry until its timeout
+    expires or for ``lease`` seconds if given.  Scheduled jobs
+    promotion and expired jobs discarding work as in `dequeue_job`.
+
+    Returns queue name, job id and job hash or ``(None, None, {})``
+    if all queues are empty.  Raise `WorkersSuspendedError` instead
+    of claiming anything while workers are suspended.
+
+    :type redis: `aioredis.Redis`
+    :type queues: list
+    :type lease: int
+    :type promote: int
+    :type discard: int
+
+    """
+
+    script = (release_unique_lock + release_blobs + release_traceback +
+              expire_job + cancel_dependents + pop_job + """
+        local now, promote, started_at = ARGV[1], ARGV[2], ARGV[3]
+        local discard, lease = tonumber(ARGV[4]), tonumber(ARGV[5])
+        if redis.call("exists", "rq:suspended") == 1 then
+            return "suspended"
+        end
+        for i = 6, #ARGV do
+            local name = ARGV[i]
+            local id = pop_job(name, now, promote, started_at, discard)
+            if id == false then
+                return 0
+            end
+            if id then
+                local job = "rq:job:"..id
+                local score = lease
+                if not score then
+                    local timeout = redis.call("hget", job, "timeout")
+                    score = (tonumber(timeout) or 180) + 60
+                end
+                redis.call("hmset", job, "status", "started",
+                           "started_at", started_at)
+                redis.call("hincrby", job, "attempts", 1)
+                redis.call("zadd", "rq:wip:"..name, now + score, id)
+                redis.call("persist", job)
+                return {name, id, redis.call("hgetall", job)}
+            end
+        end
+        return {}
+    """)
+    while True:
+        args = [current_timestamp(), promote, utcformat(utcnow()), discard,
+                lease_token(lease)]
+        args.extend(queues)
+        reply = yield from redis.eval(script, args=args)
+        if reply == 0:
             continue
-        return job_id, job_hash
+        if reply == b'suspended':
+            raise WorkersSuspendedError
+        if not reply:
+            return None, None, {}
+        queue, job_id, pairs = reply
+        job_hash = dict(zip(pairs[::2], pairs[1::2]))
+        return queue.decode(), job_id.decode(), parse_job_hash(job_hash)
+
+
+@asyncio.coroutine
+def expired_count(redis, queue):
+    """Number of jobs discarded from this queue because of expired TTL.
+
+    :type redis: `aioredis.Redis`
+    :type queue: str
+
+    """
+
+    return int((yield from redis.get(expired_counter(queue))) or 0)
 
 
 @asyncio.coroutine
 def cancel_job(redis, queue, id):
-    """Removes job from queue.
+    """Removes job from queue.  Job hash is removed as well, its
+    deferred dependents are canceled.
+
+    Queued job id is only marked as canceled, which takes constant
+    time regardless of the queue length.  It is discarded when it
+    reaches the queue head or by `compact_queue`.
+
+    Running job gets canceled status instead and its worker is
+    notified to stop it.  Repeated cancellation of the running job
+    only notifies its worker again.
+
+    Job registries are looked up by job ``origin``.  Given ``queue``
+    is used only if job hash has no origin.
 
     :type redis: `aioredis.Redis`
     :type queue: str
@@ -249,32 +1141,215 @@ def cancel_job(redis, queue, id):
 
     """
 
-    # TODO: what we need to do with job hash and dependents set?
-    yield from redis.lrem(queue_key(queue), 1, id)
+    script = (release_unique_lock + release_blobs + release_traceback +
+              expire_job + cancel_dependents + forget_failed_job + """
+        local job = KEYS[1]
+        local id, ended_at = ARGV[1], ARGV[3]
+        local status, queue = unpack(redis.call("hmget", job, "status",
+                                                "origin"))
+        queue = queue or ARGV[2]
+        if status == "started" or
+           (status == "canceled" and
+            redis.call("zscore", "rq:wip:"..queue, id)) then
+            redis.call("hset", job, "status", "canceled")
+            redis.call("publish", "rq:cancel", id)
+            return
+        elseif status == "queued" then
+            redis.call("sadd", "rq:canceled:"..queue, id)
+        elseif status == "deferred" then
+            redis.call("zrem", "rq:deferred:"..queue, id)
+        elseif status == "scheduled" then
+            redis.call("zrem", "rq:scheduled:"..queue, id)
+        elseif status == "failed" then
+            forget_failed_job(id)
+        end
+        release_unique_lock(job, id)
+        release_blobs(job)
+        release_traceback(job)
+        cancel_dependents(job, ended_at)
+        redis.call("del", job)
+    """)
+    yield from redis.eval(script, keys=[job_key(id)],
+                          args=[id, queue, utcformat(utcnow())])
+
+
+@asyncio.coroutine
+def sweep_jobs(redis, cursor=0, count=100, *, lease=unset):
+    """Delete orphan job hashes.  Single call examines one ``SCAN``
+    slice of about ``count`` keys starting from ``cursor``.
+
+    Job hash is orphan if it has no TTL and its job isn't referenced
+    from any registry it should be in according to its status.
+    Queued jobs are never swept since lookup in the list isn't
+    cheap.  Use ``hash_ttl`` for queued jobs instead.  Deferred
+    dependents of deleted and missing jobs are canceled.
+
+    Returns next cursor and number of deleted hashes.  Sweep is over
+    when returned cursor is zero.  Raise `InvalidOperationError` if
+    ``lease`` token is given and maintenance lease is lost.
+
+    :type redis: `aioredis.Redis`
+    :type cursor: int
+    :type count: int
+    :type lease: str
+
+    """
+
+    script = (release_unique_lock + release_blobs + release_traceback +
+              expire_job + cancel_dependents + holds_maintenance_lease + """
+        if not holds_maintenance_lease(ARGV[1]) then
+            return false
+        end
+        local ended_at = ARGV[2]
+        local registries = {
+            deferred = "rq:deferred:",
+            scheduled = "rq:scheduled:",
+            started = "rq:wip:",
+            finished = "rq:finished:",
+        }
+        local function registry(status, origin)
+            if status == "failed" then
+                return "rq:failed"
+            end
+            return registries[status]..origin
+        end
+        local deleted = 0
+        for _, key in ipairs(KEYS) do
+            local job = string.match(key, "^(rq:job:.+):dependents$")
+            if job then
+                if redis.call("exists", job) == 0 then
+                    cancel_dependents(job, ended_at)
+                end
+            elseif redis.call("type", key).ok == "hash" and
+                   redis.call("ttl", key) == -1 then
+                local id = string.sub(key, 8)
+                local state = redis.call("hmget", key, "status", "origin")
+                local status, origin = state[1], state[2]
+                local orphan = not status or not origin
+                if not orphan and (registries[status] or
+                                   status == "failed") then
+                    orphan = not redis.call(
+                        "zscore", registry(status, origin), id)
+                end
+                if orphan then
+                    release_unique_lock(key, id)
+                    release_blobs(key)
+                    release_traceback(key)
+                    cancel_dependents(key, ended_at)
+                    redis.call("del", key)
+                    deleted = deleted + 1
+                end
+            end
+        end
+        return deleted
+    """)
+    cursor, keys = yield from redis.scan(
+        cursor, match=job_key('*'), count=count)
+    deleted = 0
+    if keys:
+        deleted = check_lease((yield from redis.eval(
+            script, keys=keys,
+            args=[lease_token(lease), utcformat(utcnow())])))
+    return int(cursor), deleted
+
+
+@asyncio.coroutine
+def sweep_blobs(redis, cursor=0, count=100, *, lease=unset):
+    """Drop blob references of vanished jobs, for example queued jobs
+    with expired ``hash_ttl``.  Blob without references left is
+    deleted.  Single call examines one ``SCAN`` slice of about
+    ``count`` keys starting from ``cursor``.
+
+    Returns next cursor and number of deleted blobs.  Sweep is over
+    when returned cursor is zero.  Raise `InvalidOperationError` if
+    ``lease`` token is given and maintenance lease is lost.
+
+    :type redis: `aioredis.Redis`
+    :type cursor: int
+    :type count: int
+    :type lease: str
+
+    """
+
+    script = holds_maintenance_lease + """
+        if not holds_maintenance_lease(ARGV[1]) then
+            return false
+        end
+        local deleted = 0
+        for _, blob in ipairs(KEYS) do
+            if not string.match(blob, ":jobs$") and
+               redis.call("exists", blob) == 1 then
+                local refs = blob..":jobs"
+                for _, id in ipairs(redis.call("smembers", refs)) do
+                    if redis.call("exists", "rq:job:"..id) == 0 then
+                        redis.call("srem", refs, id)
+                        redis.call("hincrby", blob, "refcount", -1)
+                    end
+                end
+                if redis.call("scard", refs) == 0 then
+                    redis.call("del", blob, refs)
+                    deleted = deleted + 1
+                end
+            end
+        end
+        return deleted
+    """
+    cursor, keys = yield from redis.scan(
+        cursor, match=blob_key('*'), count=count)
+    deleted = 0
+    if keys:
+        deleted = check_lease((yield from redis.eval(
+            script, keys=keys, args=[lease_token(lease)])))
+    return int(cursor), deleted
 
 
 @asyncio.coroutine
-def start_job(redis, queue, id, timeout):
+def start_job(redis, queue, id, timeout, *, lease=unset):
     """Start given job.
 
+    Job stays in the started registry until ``timeout`` expires.  If
+    ``lease`` is given, job is considered lost after ``lease``
+    seconds unless its worker renews it with `renew_job_leases`.
+
     :type redis: `aioredis.Redis`
     :type queue: str
     :type id: str
     :type timeout: int
+    :type lease: int
 
     """
 
     fields = ('status', JobStatus.STARTED,
               'started_at', utcformat(utcnow()))
-    score = current_timestamp() + timeout + 60
-    # TODO: worker heartbeat.
+    if lease is unset:
+        score = current_timestamp() + timeout + 60
+    else:
+        score = current_timestamp() + lease
     multi = redis.multi_exec()
     multi.hmset(job_key(id), *fields)
+    multi.hincrby(job_key(id), 'attempts', 1)
     multi.zadd(started_registry(queue), score, id)
     multi.persist(job_key(id))
     yield from multi.execute()
 
 
+@asyncio.coroutine
+def renew_job_leases(redis, jobs, lease):
+    """Extend leases of the running jobs for ``lease`` seconds from
+    now in a single call.  Jobs already reclaimed from the started
+    registry aren't added back.
+
+    :type redis: `aioredis.Redis`
+    :type jobs: iterable of (queue, id) pairs
+    :type lease: int
+
+    """
+
+    keys, args = lease_renewal(jobs, lease)
+    if keys:
+        yield from redis.eval(renew_leases, keys=keys, args=args)
+
+
 @asyncio.coroutine
 def finish_job(redis, queue, id, *, result_ttl=500):
     """Finish given job.
@@ -286,58 +1361,435 @@ def finish_job(redis, queue, id, *, result_ttl=500):
 
     """
 
-    if result_ttl == 0:
-        yield from redis.delete(job_key(id))
-        # TODO: enqueue dependents
-        return
-    # TODO: set result
-    fields = ('status', JobStatus.FINISHED,
-              'ended_at', utcformat(utcnow()))
-    score = result_ttl if result_ttl < 0 else current_timestamp() + result_ttl
-    multi = redis.multi_exec()
-    multi.zrem(started_registry(queue), id)
-    multi.zadd(finished_registry(queue), score, id)
-    multi.hmset(job_key(id), *fields)
-    if result_ttl == -1:
-        multi.persist(job_key(id))
-    else:
-        multi.expire(job_key(id), result_ttl)
-    yield from multi.execute()
-    while True:
-        job_id = yield from redis.spop(dependents(id))
-        if not job_id:
-            break
-        job_id = job_id.decode()
-        origin = (yield from redis.hget(job_key(job_id), 'origin')).decode()
-        multi = redis.multi_exec()
-        multi.zrem(deferred_registry(origin), job_id)
-        multi.rpush(queue_key(origin), job_id)
-        multi.hmset(job_key(job_id),
-                    'status', JobStatus.QUEUED,
-                    'enqueued_at', utcformat(utcnow()))
-        yield from multi.execute()
+    yield from complete_job(redis, queue, id, result_ttl=result_ttl,
+                            leased=False)
 
 
 @asyncio.coroutine
-def fail_job(redis, queue, id, exc_info):
-    """Puts the given job in failed queue.
+def fail_job(redis, queue, id, exc_info, *, exc_type=unset, exc_hash=unset,
+             function=unset):
+    """Puts the given job in failed job registry.  Failed jobs are
+    indexed by origin queue and by ``exc_type`` if given.
+
+    Traceback with ``exc_hash`` is stored once for all jobs failed
+    with the same hash, job keeps the hash only.  Failed job is
+    counted in `failure_summary` by its exception type, ``function``
+    and origin.
+
+    Job with attempts left according to its retry policy is scheduled
+    for another attempt instead.  Delay before the attempt is retry
+    backoff doubled with each failed attempt and increased by a
+    random part up to retry jitter of its value.
+
+    Returns resulting job status.
 
     :type redis: `aioredis.Redis`
     :type queue: str
     :type id: str
     :type exc_info: str
+    :type exc_type: str
+    :type exc_hash: str
+    :type function: str
 
     """
 
-    multi = redis.multi_exec()
-    multi.sadd(queues_key(), failed_queue_key())
-    multi.rpush(failed_queue_key(), id)
-    fields = ('status', JobStatus.FAILED,
-              'ended_at', utcformat(utcnow()),
-              'exc_info', exc_info)
-    multi.hmset(job_key(id), *fields)
-    multi.zrem(started_registry(queue), id)
-    yield from multi.execute()
+    return (yield from complete_job(
+        redis, queue, id, exc_info=exc_info, exc_type=exc_type,
+        exc_hash=exc_hash, function=function, leased=False))
+
+
+@asyncio.coroutine
+def quarantine_job(redis, queue, id, exc_info, *, exc_type=unset,
+                   exc_hash=unset, function=unset):
+    """Puts the given job in failed job registry regardless of its
+    state and retry policy.  Job is removed from its queue and
+    registries first.  Failed jobs are indexed as in `fail_job`.
+
+    Returns False if there is no such job.
+
+    :type redis: `aioredis.Redis`
+    :type queue: str
+    :type id: str
+    :type exc_info: str
+    :type exc_type: str
+    :type exc_hash: str
+    :type function: str
+
+    """
+
+    script = (release_unique_lock + release_traceback + store_traceback +
+              forget_failed_job + move_to_failed + """
+        local queue, id = ARGV[1], ARGV[2]
+        local job = "rq:job:"..id
+        local status = redis.call("hget", job, "status")
+        if not status then
+            return false
+        end
+        if status == "queued" then
+            redis.call("sadd", "rq:canceled:"..queue, id)
+        elseif status == "failed" then
+            forget_failed_job(id)
+        end
+        redis.call("zrem", "rq:wip:"..queue, id)
+        redis.call("zrem", "rq:deferred:"..queue, id)
+        redis.call("zrem", "rq:scheduled:"..queue, id)
+        redis.call("zrem", "rq:finished:"..queue, id)
+        redis.call("persist", job)
+        move_to_failed(queue, id, ARGV[3], ARGV[4], ARGV[5],
+                       ARGV[6], ARGV[7], ARGV[8])
+        return true
+    """)
+    args = [queue, id, utcformat(utcnow()), exc_info, current_timestamp(),
+            '' if exc_type is unset else exc_type,
+            '' if exc_hash is unset else exc_hash,
+            '' if function is unset else function]
+    return bool((yield from redis.eval(script, args=args)))
+
+
+@asyncio.coroutine
+def complete_job(redis, queue, id, *, result=unset, result_ttl=500,
+                 exc_info=unset, exc_type=unset, exc_hash=unset,
+                 function=unset, failed_queue=True, leased=True):
+    """Complete started job in one call.
+
+    Job finished with ``result`` goes to the finished registry and
+    its dependents are enqueued, see `finish_job`.  Job failed with
+    ``exc_info`` is retried or goes to the failed queue, see
+    `fail_job`.  Without ``failed_queue`` failed job only leaves the
+    started registry with failed status and is kept for its result
+    TTL.
+
+    ``leased`` job is completed only if it's still in the started
+    registry.  Otherwise its lease was lost and the job is already
+    failed or retried by the reclaimer, so it's left alone.
+
+    Returns resulting job status or None if the lease was lost.
+
+    :type redis: `aioredis.Redis`
+    :type queue: str
+    :type id: str
+    :type result: bytes
+    :type result_ttl: int
+    :type exc_info: str
+    :type exc_type: str
+    :type exc_hash: str
+    :type function: str
+    :type failed_queue: bool
+    :type leased: bool
+
+    """
+
+    script = (release_unique_lock + release_blobs + release_traceback +
+              store_traceback + move_to_failed + expire_job +
+              cancel_dependents + keep_canceled_job + fail_or_retry_job +
+              drop_failed_job + finish_job_and_release + """
+        local queue, id, ended_at, now = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+        if ARGV[5] == "1" and
+           not redis.call("zscore", "rq:wip:"..queue, id) then
+            return false
+        end
+        if ARGV[6] == "failed" and ARGV[12] == "0" and
+           redis.call("hget", "rq:job:"..id, "status") ~= "canceled" then
+            return drop_failed_job(queue, id, ended_at, ARGV[7],
+                                   ARGV[9], ARGV[10])
+        end
+        if ARGV[6] == "failed" then
+            math.randomseed(tonumber(ARGV[8]))
+            return fail_or_retry_job(queue, id, ended_at, ARGV[7], now,
+                                     ARGV[9], ARGV[10], ARGV[11])
+        end
+        local result
+        if ARGV[8] == "1" then
+            result = ARGV[9]
+        end
+        return finish_job_and_release(queue, id, ended_at, tonumber(now),
+                                      tonumber(ARGV[7]), result)
+    """)
+    args = [queue, id, utcformat(utcnow()), current_timestamp(),
+            int(leased)]
+    if exc_info is not unset:
+        args.extend([JobStatus.FAILED, exc_info, random.randint(0, 2 ** 31),
+                     '' if exc_type is unset else exc_type,
+                     '' if exc_hash is unset else exc_hash,
+                     '' if function is unset else function,
+                     int(failed_queue)])
+    elif result is unset:
+        args.extend([JobStatus.FINISHED, result_ttl, 0])
+    else:
+        args.extend([JobStatus.FINISHED, result_ttl, 1, result])
+    status = yield from redis.eval(script, args=args)
+    return status.decode() if status is not None else None
+
+
+@asyncio.coroutine
+def clean_started_jobs(redis, queue, *, limit=100, lease=unset):
+    """Fail jobs which stay in the started registry for too long.
+    Their workers are most likely dead.  Job retry policy is applied
+    as usual.  At most ``limit`` jobs are processed.
+
+    Such jobs fail with ``LeaseExpired`` exception type and are
+    counted in `failure_summary` by the function name taken from
+    their description.
+
+    Returns number of processed jobs.  Raise `InvalidOperationError`
+    if ``lease`` token is given and maintenance lease is lost.
+
+    :type redis: `aioredis.Redis`
+    :type queue: str
+    :type limit: int
+    :type lease: str
+
+    """
+
+    script = (release_unique_lock + release_blobs + release_traceback +
+              store_traceback + move_to_failed + expire_job +
+              cancel_dependents + keep_canceled_job + fail_or_retry_job +
+              holds_maintenance_lease + """
+        if not holds_maintenance_lease(ARGV[7]) then
+            return false
+        end
+        local queue, now, limit = ARGV[1], ARGV[2], ARGV[3]
+        local ended_at, exc_info = ARGV[4], ARGV[5]
+        math.randomseed(tonumber(ARGV[6]))
+        local ids = redis.call("zrangebyscore", "rq:wip:"..queue, 0, now,
+                               "limit", 0, limit)
+        for _, id in ipairs(ids) do
+            local description = redis.call("hget", "rq:job:"..id,
+                                           "description") or ""
+            fail_or_retry_job(queue, id, ended_at, exc_info, now,
+                              "LeaseExpired", "",
+                              string.match(description, "^[^(]*"))
+        end
+        return #ids
+    """)
+    args = [queue, current_timestamp(), limit, utcformat(utcnow()),
+            'Moved to failed queue by started registry cleanup',
+            random.randint(0, 2 ** 31), lease_token(lease)]
+    return check_lease((yield from redis.eval(script, args=args)))
+
+
+@asyncio.coroutine
+def clean_finished_jobs(redis, queue, *, limit=100, lease=unset):
+    """Remove expired jobs from the finished registry.  At most
+    ``limit`` jobs are removed.
+
+    Returns number of removed jobs.  Raise `InvalidOperationError` if
+    ``lease`` token is given and maintenance lease is lost.
+
+    :type redis: `aioredis.Redis`
+    :type queue: str
+    :type limit: int
+    :type lease: str
+
+    """
+
+    script = holds_maintenance_lease + """
+        if not holds_maintenance_lease(ARGV[3]) then
+            return false
+        end
+        local finished, now, limit = KEYS[1], ARGV[1], ARGV[2]
+        local ids = redis.call("zrangebyscore", finished, 0, now,
+                               "limit", 0, limit)
+        if #ids > 0 then
+            redis.call("zrem", finished, unpack(ids))
+        end
+        return #ids
+    """
+    args = [current_timestamp(), limit, lease_token(lease)]
+    return check_lease((yield from redis.eval(
+        script, keys=[finished_registry(queue)], args=args)))
+
+
+@asyncio.coroutine
+def clean_deferred_jobs(redis, queue, offset=0, *, limit=100, lease=unset):
+    """Remove jobs without job hash from the deferred registry.
+    Single call examines at most ``limit`` registry entries starting
+    from ``offset``.
+
+    Returns next offset and number of removed jobs.  Cleanup is over
+    when returned offset is zero.  Raise `InvalidOperationError` if
+    ``lease`` token is given and maintenance lease is lost.
+
+    :type redis: `aioredis.Redis`
+    :type queue: str
+    :type offset: int
+    :type limit: int
+    :type lease: str
+
+    """
+
+    script = holds_maintenance_lease + """
+        if not holds_maintenance_lease(ARGV[3]) then
+            return false
+        end
+        local deferred = KEYS[1]
+        local offset, limit = tonumber(ARGV[1]), tonumber(ARGV[2])
+        local ids = redis.call("zrange", deferred, offset, offset + limit - 1)
+        local removed = 0
+        for _, id in ipairs(ids) do
+            if redis.call("exists", "rq:job:"..id) == 0 then
+                redis.call("zrem", deferred, id)
+                removed = removed + 1
+            end
+        end
+        if #ids < limit then
+            return {0, removed}
+        end
+        return {offset + limit - removed, removed}
+    """
+    args = [offset, limit, lease_token(lease)]
+    offset, removed = check_lease((yield from redis.eval(
+        script, keys=[deferred_registry(queue)], args=args)))
+    return offset, removed
+
+
+@asyncio.coroutine
+def acquire_maintenance_lease(redis, holder, ttl):
+    """Try to become the only maintenance runner for ``ttl`` seconds.
+    Lease isn't released explicitly, so it passes to another worker
+    when it expires even if the holder dies.
+
+    Returns fencing token which grows with each acquired lease or
+    None if someone else holds the lease.  Pass this token to the
+    cleanup functions so stale holder can't clean after its lease
+    went to another worker.
+
+    :type redis: `aioredis.Redis`
+    :type holder: str
+    :type ttl: int or float
+
+    """
+
+    script = """
+        local lease, fence = KEYS[1], KEYS[2]
+        local holder, ttl = ARGV[1], ARGV[2]
+        if not redis.call("set", lease, holder, "nx", "px", ttl) then
+            return false
+        end
+        local token = redis.call("incr", fence)..":"..holder
+        redis.call("set", lease, token, "px", ttl)
+        return token
+    """
+    keys = [maintenance_lease(), maintenance_fence()]
+    token = yield from redis.eval(
+        script, keys=keys, args=[holder, int(ttl * 1000)])
+    return token.decode() if token is not None else None
+
+
+@asyncio.coroutine
+def failed_jobs(redis, start=0, end=-1, *, origin=None, exc_type=None):
+    """Failed jobs ordered by failure time.  Jobs can be filtered
+    either by ``origin`` queue or by ``exc_type``.
+
+    :type redis: `aioredis.Redis`
+    :type start: int
+    :type end: int
+    :type origin: str
+    :type exc_type: str
+
+    """
+
+    key = failed_index(origin, exc_type)
+    return (yield from redis.zrange(key, start, end))
+
+
+@asyncio.coroutine
+def failed_count(redis, *, origin=None, exc_type=None):
+    """Number of failed jobs.  Jobs can be filtered either by
+    ``origin`` queue or by ``exc_type``.
+
+    :type redis: `aioredis.Redis`
+    :type origin: str
+    :type exc_type: str
+
+    """
+
+    return (yield from redis.zcard(failed_index(origin, exc_type)))
+
+
+def failed_index(origin, exc_type):
+    """Redis key of the failed jobs index for given filter."""
+
+    if origin is not None and exc_type is not None:
+        raise InvalidOperationError(
+            'Failed jobs can be filtered by origin or exception type only')
+    if origin is not None:
+        return failed_origin_index(origin)
+    if exc_type is not None:
+        return failed_exc_type_index(exc_type)
+    return failed_registry()
+
+
+# Expects forget_failed_job defined.  Returns true if job was pushed
+# back into its origin queue.
+requeue_failed_job = """
+    local function requeue_failed_job(id, enqueued_at)
+        local job = "rq:job:"..id
+        local origin = forget_failed_job(id)
+        if not origin then
+            return false
+        end
+        redis.call("hmset", job, "status", "queued",
+                   "enqueued_at", enqueued_at)
+        redis.call("hdel", job, "exc_info", "exc_type", "ended_at",
+                   "attempts")
+        redis.call("sadd", "rq:queues", origin)
+        redis.call("rpush", "rq:queue:"..origin, id)
+        return true
+    end
+"""
+
+
+@asyncio.coroutine
+def job_exc_info(redis, id):
+    """Exception information of the failed job.  Deduplicated
+    traceback is resolved by its hash.
+
+    :type redis: `aioredis.Redis`
+    :type id: str
+
+    """
+
+    script = """
+        local state = redis.call("hmget", KEYS[1], "exc_info", "exc_hash")
+        if state[2] then
+            return redis.call("hget", "rq:traceback:"..state[2], "exc_info")
+        end
+        return state[1]
+    """
+    return (yield from redis.eval(script, keys=[job_key(id)]))
+
+
+@asyncio.coroutine
+def traceback_entry(redis, exc_hash):
+    """Deduplicated traceback with its reference count and first and
+    last seen time.
+
+    :type redis: `aioredis.Redis`
+    :type exc_hash: str
+
+    """
+
+    fields = yield from redis.hgetall(traceback_key(exc_hash))
+    if b'refcount' in fields:
+        fields[b'refcount'] = int(fields[b'refcount'])
+    return fields
+
+
+@asyncio.coroutine
+def failure_summary(redis):
+    """Number of failed jobs grouped by exception type, function and
+    origin queue.
+
+    Returns dict with ``(exc_type, function, origin)`` keys.
+
+    :type redis: `aioredis.Redis`
+
+    """
+
+    groups = yield from redis.hgetall(failures_key())
+    return {tuple(group.decode().split('\t')): int(count)
+            for group, count in groups.items()}
 
 
 @asyncio.coroutine
@@ -349,17 +1801,134 @@ def requeue_job(redis, id):
 
     """
 
-    job = yield from redis.hgetall(job_key(id))  # origin only?
-    is_failed_job = yield from redis.lrem(failed_queue_key(), 1, id)
-    if not job:
-        return
-    if not is_failed_job:
+    script = (release_traceback + forget_failed_job + requeue_failed_job +
+              """
+        local id, enqueued_at = ARGV[1], ARGV[2]
+        if not redis.call("zscore", "rq:failed", id) then
+            return redis.call("exists", "rq:job:"..id)
+        end
+        requeue_failed_job(id, enqueued_at)
+        return 0
+    """)
+    if (yield from redis.eval(script, args=[id, utcformat(utcnow())])):
         raise InvalidOperationError('Cannot requeue non-failed job')
-    multi = redis.multi_exec()
-    multi.hset(job_key(id), 'status', JobStatus.QUEUED)
-    multi.hdel(job_key(id), 'exc_info')
-    multi.rpush(queue_key(job[b'origin'].decode()), id)
-    yield from multi.execute()
+
+
+@asyncio.coroutine
+def delete_failed_job(redis, id):
+    """Delete failed job with the given job ID.  Its deferred
+    dependents are canceled.
+
+    :type redis: `aioredis.Redis`
+    :type id: str
+
+    """
+
+    script = (release_unique_lock + release_blobs + release_traceback +
+              expire_job + cancel_dependents + forget_failed_job + """
+        local id = ARGV[1]
+        if not redis.call("zscore", "rq:failed", id) then
+            return redis.call("exists", "rq:job:"..id)
+        end
+        forget_failed_job(id)
+        release_blobs("rq:job:"..id)
+        cancel_dependents("rq:job:"..id, ARGV[2])
+        redis.call("del", "rq:job:"..id)
+        return 0
+    """)
+    if (yield from redis.eval(script, args=[id, utcformat(utcnow())])):
+        raise InvalidOperationError('Cannot delete non-failed job')
+
+
+@asyncio.coroutine
+def requeue_failed(redis, *, origin=None, exc_type=None, limit=None,
+                   chunk=1000):
+    """Requeue failed jobs.  Jobs can be filtered either by ``origin``
+    queue or by ``exc_type``.  Single script call moves at most
+    ``chunk`` jobs back to their origin queues.
+
+    Returns number of requeued jobs.
+
+    :type redis: `aioredis.Redis`
+    :type origin: str
+    :type exc_type: str
+    :type limit: int
+    :type chunk: int
+
+    """
+
+    script = (release_traceback + forget_failed_job + requeue_failed_job +
+              """
+        local index, count, enqueued_at = ARGV[1], ARGV[2], ARGV[3]
+        local ids = redis.call("zrange", index, 0, count - 1)
+        local requeued = 0
+        for _, id in ipairs(ids) do
+            redis.call("zrem", index, id)
+            if requeue_failed_job(id, enqueued_at) then
+                requeued = requeued + 1
+            end
+        end
+        return {#ids, requeued}
+    """)
+    return (yield from failed_batches(
+        redis, script, origin, exc_type, limit, chunk,
+        utcformat(utcnow())))
+
+
+@asyncio.coroutine
+def purge_failed(redis, *, origin=None, exc_type=None, limit=None,
+                 chunk=1000):
+    """Delete failed jobs.  Jobs can be filtered either by ``origin``
+    queue or by ``exc_type``.  Single script call deletes at most
+    ``chunk`` jobs.  Deferred dependents of deleted jobs are canceled.
+
+    Returns number of deleted jobs.
+
+    :type redis: `aioredis.Redis`
+    :type origin: str
+    :type exc_type: str
+    :type limit: int
+    :type chunk: int
+
+    """
+
+    script = (release_unique_lock + release_blobs + release_traceback +
+              expire_job + cancel_dependents + forget_failed_job + """
+        local index, count, ended_at = ARGV[1], ARGV[2], ARGV[3]
+        local ids = redis.call("zrange", index, 0, count - 1)
+        local deleted = 0
+        for _, id in ipairs(ids) do
+            local job = "rq:job:"..id
+            redis.call("zrem", index, id)
+            forget_failed_job(id)
+            release_blobs(job)
+            cancel_dependents(job, ended_at)
+            deleted = deleted + redis.call("del", job)
+        end
+        return {#ids, deleted}
+    """)
+    return (yield from failed_batches(
+        redis, script, origin, exc_type, limit, chunk, utcformat(utcnow())))
+
+
+@asyncio.coroutine
+def failed_batches(redis, script, origin, exc_type, limit, chunk, *args):
+    """Run failed jobs batch ``script`` until the index is exhausted
+    or ``limit`` jobs were seen.  Script takes index key and batch
+    size followed by ``args`` and replies with number of seen and
+    processed jobs.
+    """
+
+    index = failed_index(origin, exc_type)
+    seen = processed = 0
+    while limit is None or seen < limit:
+        count = chunk if limit is None else min(chunk, limit - seen)
+        reply = yield from redis.eval(script, args=[index, count] + list(args))
+        seen += reply[0]
+        processed += reply[1]
+        if reply[0] < count:
+            break
+    return processed
 
 
 @asyncio.coroutine
@@ -418,6 +1987,34 @@ def worker_death(redis, id):
     yield from multi.execute()
 
 
+@asyncio.coroutine
+def worker_heartbeat(redis, id, ttl, *, jobs=(), lease=unset, stats=unset):
+    """Send worker heartbeat.  Extend worker TTL, renew leases of its
+    running ``jobs`` and store worker ``stats`` in one transaction.
+
+    :type redis: `aioredis.Redis`
+    :type id: str
+    :type ttl: int
+    :type jobs: iterable of (queue, id) pairs
+    :type lease: int
+    :type stats: dict
+
+    """
+
+    fields = ['last_heartbeat', utcformat(utcnow())]
+    if stats is not unset:
+        for field, value in stats.items():
+            fields.extend((field, value))
+    multi = redis.multi_exec()
+    multi.hmset(worker_key(id), *fields)
+    multi.expire(worker_key(id), ttl)
+    if lease is not unset:
+        keys, args = lease_renewal(jobs, lease)
+        if keys:
+            multi.eval(renew_leases, keys=keys, args=args)
+    yield from multi.execute()
+
+
 @asyncio.coroutine
 def worker_shutdown_requested(redis, id):
     """Set worker shutdown requested date.
@@ -16,10 +16,15 @@ import pickle
 import uuid
 
 from . import protocol
+from .blobs import Broadcast, content_hash, offload_args
+from .compression import compress
 from .exceptions import (NoSuchJobError, UnpickleError,
-                         DequeueTimeout, InvalidJobOperationError)
+                         DequeueTimeout, InvalidJobOperationError,
+                         InvalidOperationError)
 from .job import Job, create_job
-from .utils import (function_name, utcnow, utcformat,
+from .serializers import get_serializer, buffer_data
+from .specs import JobStatus
+from .utils import (function_name, utcnow, utcformat, unset,
                     make_description, import_attribute)
 
 
@@ -36,6 +41,11 @@ class Queue:
     job_class = Job
     protocol = protocol
     default_timeout = 180
+    default_hash_ttl = None
+    serializer = 'pickle'
+    compression = None
+    compression_threshold = 1024
+    blob_threshold = None
 
     @classmethod
     @asyncio.coroutine
@@ -47,14 +57,31 @@ class Queue:
                 for key in keys]
 
     def __init__(self, connection, name='default', default_timeout=None,
-                 job_class=None):
+                 job_class=None, default_hash_ttl=None, serializer=None,
+                 compression=None, compression_threshold=None,
+                 blob_threshold=None):
 
         self.connection = connection
         self.name = name
 
+        if serializer is not None:
+            self.serializer = serializer
+
+        if compression is not None:
+            self.compression = compression
+
+        if compression_threshold is not None:
+            self.compression_threshold = compression_threshold
+
+        if blob_threshold is not None:
+            self.blob_threshold = blob_threshold
+
         if default_timeout:
             self.default_timeout = default_timeout
 
+        if default_hash_ttl:
+            self.default_hash_ttl = default_hash_ttl
+
         if job_class is not None:
             if isinstance(job_class, str):
                 job_class = import_attribute(job_class)
@@ -72,6 +99,45 @@ class Queue:
 
         return (yield from self.protocol.queue_length(self.connection, self.name)) == 0
 
+    @asyncio.coroutine
+    def pause(self):
+        """Stops workers from taking jobs from this queue."""
+
+        yield from self.protocol.pause_queue(self.connection, self.name)
+
+    @asyncio.coroutine
+    def resume(self):
+        """Lets workers take jobs from this queue again."""
+
+        yield from self.protocol.resume_queue(self.connection, self.name)
+
+    @property
+    @asyncio.coroutine
+    def is_paused(self):
+        """Returns whether the queue is paused."""
+
+        return (yield from self.protocol.queue_paused(self.connection, self.name))
+
+    @asyncio.coroutine
+    def broadcast(self, obj, ttl=None):
+        """Store ``obj`` once and return its handle.  Pass the handle
+        as job argument, workers replace it with the object.  Stored
+        object expires after ``ttl`` seconds if given.
+        """
+
+        data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        handle = Broadcast(content_hash(data))
+        yield from self.protocol.store_broadcast(
+            self.connection, handle.hash, data,
+            ttl=unset if ttl is None else ttl)
+        return handle
+
+    @asyncio.coroutine
+    def delete_broadcast(self, handle):
+        """Delete object stored with `broadcast`."""
+
+        yield from self.protocol.delete_broadcast(self.connection, handle.hash)
+
     @asyncio.coroutine
     def fetch_job(self, job_id):
         spec = yield from self.protocol.job(self.connection, job_id)
@@ -91,7 +157,8 @@ class Queue:
             end = offset + (length - 1)
         else:
             end = length
-        jobs = yield from self.protocol.jobs(self.connection, self.name, start, end)
+        jobs = yield from self.protocol.queued_jobs(
+            self.connection, self.name, start, end)
         return [job_id.decode() for job_id in jobs]
 
     @asyncio.coroutine
@@ -102,7 +169,8 @@ class Queue:
         jobs = []
         for job_id in job_ids:
             job = yield from self.protocol.job(self.connection, job_id)
-            jobs.append(create_job(self.connection, job_id, job))
+            if job:
+                jobs.append(create_job(self.connection, job_id, job))
         return jobs
 
     @property
@@ -126,6 +194,13 @@ class Queue:
 
         return (yield from self.protocol.queue_length(self.connection, self.name))
 
+    @property
+    @asyncio.coroutine
+    def expired_count(self):
+        """Returns a count of jobs discarded because of expired TTL."""
+
+        return (yield from self.protocol.expired_count(self.connection, self.name))
+
     @asyncio.coroutine
     def remove(self, job_or_id):
         """Removes Job from queue, accepts either a Job instance or ID."""
@@ -141,15 +216,13 @@ class Queue:
         guaranteeing FIFO semantics.
         """
 
-        COMPACT_QUEUE = 'rq:queue:_compact:{0}'.format(uuid.uuid4())
-
-        yield from self.connection.rename(self.key, COMPACT_QUEUE)
-        while True:
-            job_id = as_text((yield from self.connection.lpop(COMPACT_QUEUE)))
-            if job_id is None:
-                break
-            if (yield from self.job_class.exists(job_id, self.connection)):
-                (yield from self.connection.rpush(self.key, job_id))
+        offset, removed = yield from self.protocol.compact_queue(
+            self.connection, self.name)
+        while offset:
+            offset, count = yield from self.protocol.compact_queue(
+                self.connection, self.name, offset)
+            removed += count
+        return removed
 
     @asyncio.coroutine
     def enqueue(self, f, *args, **kwargs):
@@ -172,21 +245,44 @@ class Queue:
     @asyncio.coroutine
     def enqueue_call(self, func, args=None, kwargs=None, timeout=None,
                      result_ttl=None, ttl=None, description=None,
-                     depends_on=None, job_id=None, at_front=False, meta=None):
+                     depends_on=None, job_id=None, at_front=False, meta=None,
+                     unique_key=None, unique_ttl=None, coalesce_key=None,
+                     retry=None):
         """Creates a job to represent the delayed function call and enqueues
         it.
 
         It is much like `.enqueue()`, except that it takes the function's args
         and kwargs as explicit arguments.  Any kwargs passed to this function
         contain options for RQ itself.
+
+        If `unique_key` is given and another job holding the same key
+        is not finished or failed yet, nothing is enqueued and that
+        job is returned instead.
+
+        If `coalesce_key` is given and the job enqueued with the same
+        key into this queue is not started yet, its arguments are
+        replaced with the given ones and that job is returned.
+
+        Failed job is retried according to `retry` policy before it
+        goes to the failed queue.
+
+        Job which wasn't started within `ttl` seconds is discarded.
         """
 
         id = job_id or str(uuid.uuid4())
         args = args or ()
         kwargs = kwargs or {}
         func_name, instance = function_name(func)
-        job_tuple = func_name, instance, args, kwargs
-        data = pickle.dumps(job_tuple, protocol=pickle.HIGHEST_PROTOCOL)
+        serializer = get_serializer(self.serializer)
+        stored_args, stored_kwargs, blobs = args, kwargs, None
+        if self.blob_threshold and serializer.name == 'pickle':
+            stored_args, stored_kwargs, blobs = offload_args(
+                args, kwargs, self.blob_threshold)
+        job_tuple = func_name, instance, stored_args, stored_kwargs
+        buffers = []
+        data, codec, compression_ratio = compress(
+            self.compression, serializer.dumps(job_tuple, buffers),
+            self.compression_threshold)
         description = description or make_description(func_name, args, kwargs)
         timeout = timeout or self.default_timeout
         created_at = utcnow()
@@ -202,16 +298,37 @@ class Queue:
         }
         if result_ttl:
             spec['result_ttl'] = result_ttl
+        if serializer.name != 'pickle':
+            spec['serializer'] = serializer.name
+        if codec:
+            spec['codec'] = codec
+        if blobs:
+            spec['blobs'] = blobs
+        if buffers:
+            spec['buffers'] = [buffer_data(buffer) for buffer in buffers]
         if ttl:
-            pass     # TODO: process ttl
+            spec['ttl'] = ttl
+        if self.default_hash_ttl:
+            spec['hash_ttl'] = self.default_hash_ttl
         if depends_on:
             # TODO: can we use None instead of unset in the protocol?
             if isinstance(depends_on, self.job_class):
                 spec['dependency_id'] = depends_on.id
             else:
                 spec['dependency_id'] = depends_on
+        if unique_key:
+            spec['unique_key'] = unique_key
+        if unique_ttl:
+            spec['unique_ttl'] = unique_ttl
+        if coalesce_key:
+            spec['coalesce_key'] = coalesce_key
+        if retry:
+            spec['retry'] = (retry.max_attempts, retry.backoff, retry.jitter)
         # TODO: pass meta argument after rq 0.5.7 release
-        status, enqueued_at = yield from self.protocol.enqueue_job(**spec)
+        stored_id, status, enqueued_at = yield from self.protocol.enqueue_job(
+            **spec)
+        if stored_id != id:
+            return (yield from self.fetch_job(stored_id))
         job_spec = {
             'connection': self.connection,
             'id': id,
@@ -227,6 +344,7 @@ class Queue:
             'enqueued_at': enqueued_at,
         }
         job = self.job_class(**job_spec)
+        job.compression_ratio = compression_ratio
         return job
 
     def __eq__(self, other):
@@ -248,32 +366,59 @@ class Queue:
 
 
 class FailedQueue(Queue):
-    """Special queue for failed asynchronous jobs."""
+    """Special queue for failed asynchronous jobs.
+
+    Failed jobs live in the registry ordered by failure time and
+    indexed by origin queue and exception type.
+    """
 
     def __init__(self, connection=None):
 
-        super().__init__(JobStatus.FAILED, connection=connection)
+        super().__init__(connection, JobStatus.FAILED)
 
     @asyncio.coroutine
-    def quarantine(self, job, exc_info):
-        """Puts the given Job in quarantine (i.e. put it on the failed queue).
+    def get_job_ids(self, offset=0, length=-1, *, origin=None,
+                    exc_type=None):
+        """Returns a slice of failed job IDs.  Jobs can be filtered
+        either by ``origin`` queue or by ``exc_type``.
         """
 
-        # Add Queue key set
-        yield from self.connection.sadd(self.redis_queues_keys, self.key)
+        start = offset
+        if length >= 0:
+            end = offset + (length - 1)
+        else:
+            end = length
+        jobs = yield from self.protocol.failed_jobs(
+            self.connection, start, end, origin=origin, exc_type=exc_type)
+        return [job_id.decode() for job_id in jobs]
+
+    @property
+    @asyncio.coroutine
+    def count(self):
+        """Returns a count of all failed jobs."""
+
+        return (yield from self.protocol.failed_count(self.connection))
 
-        job.ended_at = utcnow()
-        # NOTE: we can't pass exception instance directly to aioredis
-        # command execution as we can with StrictRedis.  StrictRedis
-        # client make internal cast all non string values to the
-        # string.  So we need to do it explicitly.
-        job.exc_info = str(exc_info)
-        pipe = self.connection.multi_exec()
-        yield from job.save(pipeline=pipe)
+    @asyncio.coroutine
+    def empty(self):
+        """Removes all failed jobs."""
+
+        return (yield from self.purge())
 
-        yield from self.push_job_id(job.id, pipeline=pipe)
-        yield from pipe.execute()
+    @asyncio.coroutine
+    def is_empty(self):
+        """Returns whether there are no failed jobs."""
 
+        return (yield from self.count) == 0
+
+    @asyncio.coroutine
+    def quarantine(self, job, exc_info):
+        """Puts the given Job in quarantine (i.e. put it on the failed queue).
+        Retry policy of the job isn't applied.
+        """
+
+        yield from self.protocol.quarantine_job(
+            self.connection, job.origin, job.id, str(exc_info))
         return job
 
     @asyncio.coroutine
@@ -281,18 +426,38 @@ class FailedQueue(Queue):
         """Requeues the job with the given job ID."""
 
         try:
-            job = yield from self.job_class.fetch(
-                job_id, connection=self.connection)
-        except NoSuchJobError:
-            # Silently ignore/remove this job and return (i.e. do nothing)
-            yield from self.remove(job_id)
-            return
-
-        # Delete it from the failed queue (raise an error if that failed)
-        if not (yield from self.remove(job)):
+            yield from self.protocol.requeue_job(self.connection, job_id)
+        except InvalidOperationError:
             raise InvalidJobOperationError('Cannot requeue non-failed jobs')
 
-        yield from job.set_status(JobStatus.QUEUED)
-        job.exc_info = None
-        q = Queue(job.origin, connection=self.connection)
-        yield from q.enqueue_job(job)
+    @asyncio.coroutine
+    def requeue_all(self, *, origin=None, exc_type=None, limit=None):
+        """Requeues failed jobs.  Jobs can be filtered either by
+        ``origin`` queue or by ``exc_type``.  Returns number of
+        requeued jobs.
+        """
+
+        return (yield from self.protocol.requeue_failed(
+            self.connection, origin=origin, exc_type=exc_type, limit=limit))
+
+    @asyncio.coroutine
+    def purge(self, *, origin=None, exc_type=None, limit=None):
+        """Deletes failed jobs.  Jobs can be filtered either by
+        ``origin`` queue or by ``exc_type``.  Returns number of
+        deleted jobs.
+        """
+
+        return (yield from self.protocol.purge_failed(
+            self.connection, origin=origin, exc_type=exc_type, limit=limit))
+
+    @asyncio.coroutine
+    def remove(self, job_or_id):
+        """Removes failed Job, accepts either a Job instance or ID."""
+
+        job_id = (job_or_id.id
+                  if isinstance(job_or_id, self.job_class)
+                  else job_or_id)
+        try:
+            yield from self.protocol.delete_failed_job(self.connection, job_id)
+        except InvalidOperationError:
+            raise InvalidJobOperationError('Cannot remove non-failed jobs')
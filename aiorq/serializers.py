@@ -0,0 +1,152 @@
+"""
+    aiorq.serializers
+    ~~~~~~~~~~~~~~~~~
+
+    Job data serializers.
+
+    :copyright: (c) 2015-2016 by Artem Malyshev.
+    :license: LGPL-3, see LICENSE for more details.
+"""
+
+import json
+import pickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class PickleSerializer:
+    """Serialize job data with pickle.  Any picklable arguments and
+    bound methods are supported.
+
+    With pickle protocol 5 large ``bytes`` arguments and objects
+    supporting out-of-band pickling like NumPy arrays are not copied
+    into the pickle stream.  Their buffers are collected separately
+    if ``buffers`` list is given.  Arrays restored from such buffers
+    are read-only.
+    """
+
+    name = 'pickle'
+    out_of_band_threshold = 64 * 1024
+
+    def dumps(self, job_tuple, buffers=None):
+
+        if buffers is None or not hasattr(pickle, 'PickleBuffer'):
+            return pickle.dumps(job_tuple, protocol=pickle.HIGHEST_PROTOCOL)
+        func_name, instance, args, kwargs = job_tuple
+        args = tuple(self.wrap(value) for value in args)
+        kwargs = {key: self.wrap(value) for key, value in kwargs.items()}
+        return pickle.dumps((func_name, instance, args, kwargs), protocol=5,
+                            buffer_callback=buffers.append)
+
+    def loads(self, data, buffers=None):
+
+        if buffers:
+            return pickle.loads(data, buffers=buffers)
+        return pickle.loads(data)
+
+    def wrap(self, value):
+        """Pickle large bytes argument out-of-band."""
+
+        if (isinstance(value, bytes) and
+                len(value) >= self.out_of_band_threshold):
+            return pickle.PickleBuffer(value)
+        return value
+
+
+class JSONSerializer:
+    """Serialize job data with JSON.  Only plain functions with JSON
+    compatible arguments are supported.  Tuples are restored as
+    lists."""
+
+    name = 'json'
+
+    def dumps(self, job_tuple, buffers=None):
+
+        func_name, instance, args, kwargs = job_tuple
+        if instance is not None:
+            raise TypeError('{} can not serialize bound methods'.format(
+                self.name))
+        return json.dumps([func_name, args, kwargs],
+                          separators=(',', ':')).encode()
+
+    def loads(self, data, buffers=None):
+
+        func_name, args, kwargs = json.loads(data.decode())
+        return func_name, None, tuple(args), kwargs
+
+
+class MsgpackSerializer:
+    """Serialize job data with msgpack.  Same restrictions as for
+    JSON serializer apply.  Requires msgpack package."""
+
+    name = 'msgpack'
+
+    def dumps(self, job_tuple, buffers=None):
+
+        func_name, instance, args, kwargs = job_tuple
+        if instance is not None:
+            raise TypeError('{} can not serialize bound methods'.format(
+                self.name))
+        return msgpack.packb([func_name, args, kwargs], use_bin_type=True)
+
+    def loads(self, data, buffers=None):
+
+        func_name, args, kwargs = msgpack.unpackb(data, raw=False)
+        return func_name, None, tuple(args), kwargs
+
+
+def buffer_data(buffer):
+    """Bytes-like object of the out-of-band pickle buffer suitable for
+    Redis command.  Underlying bytes and bytearray objects are used
+    without copy."""
+
+    view = buffer.raw()
+    if isinstance(view.obj, (bytes, bytearray)) and \
+       view.nbytes == len(view.obj):
+        return view.obj
+    return view.tobytes()
+
+
+serializers = {
+    PickleSerializer.name: PickleSerializer(),
+    JSONSerializer.name: JSONSerializer(),
+}
+
+if msgpack is not None:
+    serializers[MsgpackSerializer.name] = MsgpackSerializer()
+
+
+def register_serializer(serializer):
+    """Make serializer instance available by its name.  Workers
+    decode job data with the serializer registered under the name
+    stored in the job, so custom serializer must be registered on
+    both sides.
+
+    :type serializer: serializer instance
+
+    """
+
+    serializers[serializer.name] = serializer
+    return serializer
+
+
+def get_serializer(serializer):
+    """Serializer instance by its name.  Serializer instances are
+    returned as is if their name is registered.
+
+    :type serializer: str or serializer instance
+
+    """
+
+    if not isinstance(serializer, str):
+        if serializer.name not in serializers:
+            raise ValueError('Serializer is not registered: {}'.format(
+                serializer.name))
+        return serializer
+    try:
+        return serializers[serializer]
+    except KeyError:
+        raise ValueError('Unknown serializer: {}'.format(serializer))
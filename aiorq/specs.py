@@ -16,6 +16,8 @@ class JobStatus:
     FAILED = 'failed'
     STARTED = 'started'
     DEFERRED = 'deferred'
+    SCHEDULED = 'scheduled'
+    CANCELED = 'canceled'
 
 
 class WorkerStatus:
@@ -12,14 +12,14 @@
 
 import asyncio
 
-from rq.suspension import WORKERS_SUSPENDED
+from .keys import workers_suspended, resume_channel
 
 
 @asyncio.coroutine
 def is_suspended(connection):
     """Check if rq workers are suspended."""
 
-    return (yield from connection.exists(WORKERS_SUSPENDED))
+    return (yield from connection.exists(workers_suspended()))
 
 
 @asyncio.coroutine
@@ -32,13 +32,17 @@ def suspend(connection, ttl=None):
     If you pass in 0 for ``ttl`` value it will invalidate right away.
     """
 
-    yield from connection.set(WORKERS_SUSPENDED, 1)
+    yield from connection.set(workers_suspended(), 1)
     if ttl is not None:
-        yield from connection.expire(WORKERS_SUSPENDED, ttl)
+        yield from connection.expire(workers_suspended(), ttl)
 
 
 @asyncio.coroutine
 def resume(connection):
-    """Resume RQ workers execution."""
+    """Resume RQ workers execution.  Waiting workers are woken up
+    immediately.
+    """
 
-    return (yield from connection.delete(WORKERS_SUSPENDED))
+    deleted = yield from connection.delete(workers_suspended())
+    yield from connection.publish(resume_channel(), 1)
+    return deleted
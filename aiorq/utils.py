@@ -8,14 +8,20 @@
     :license: LGPL-3, see LICENSE for more details.
 """
 
+import hashlib
+import re
 from calendar import timegm
 from datetime import datetime
+from functools import lru_cache
 from importlib import import_module
-from inspect import ismethod, isfunction, isbuiltin
+from inspect import ismethod, isfunction, isbuiltin, getmembers
+from weakref import WeakKeyDictionary
 
 
 unset = object()
 
+function_names = WeakKeyDictionary()
+
 
 def current_timestamp():
     """Current UTC timestamp."""
@@ -43,9 +49,33 @@ def import_attribute(name):
     return getattr(module, attribute)
 
 
+@lru_cache(maxsize=1024)
+def resolve_function(name):
+    """Cached `import_attribute` for job functions."""
+
+    return import_attribute(name)
+
+
+def preload_module(name):
+    """Import module and resolve all its functions in advance.
+    Returns number of resolved functions."""
+
+    module = import_module(name)
+    functions = [attribute for attribute, value in getmembers(module)
+                 if isfunction(value) and value.__module__ == name]
+    for attribute in functions:
+        resolve_function('{}.{}'.format(name, attribute))
+    return len(functions)
+
+
 def function_name(function):
-    """Calculate function name."""
+    """Calculate function name.  Names of functions are cached by
+    function object, cache doesn't keep lambdas and closures alive."""
 
+    try:
+        return function_names[function], None
+    except (KeyError, TypeError):
+        pass
     instance = None
     if ismethod(function):
         func_name = function.__name__
@@ -56,6 +86,10 @@ def function_name(function):
         func_name = function.decode()
     elif isfunction(function) or isbuiltin(function):
         func_name = '{}.{}'.format(function.__module__, function.__name__)
+        try:
+            function_names[function] = func_name
+        except TypeError:
+            pass
     elif hasattr(function, '__call__'):
         func_name = '__call__'
         instance = function
@@ -72,3 +106,11 @@ def make_description(func_name, args, kwargs):
     args_name += ['{}={!r}'.format(k, v) for k, v in kwargs.items()]
     args_name = ', '.join(args_name)
     return '{}({})'.format(func_name, args_name)
+
+
+def traceback_hash(exc_string):
+    """Hash of the formatted traceback.  Object addresses are ignored
+    so the same failure gives the same hash across processes."""
+
+    normalized = re.sub(r'0x[0-9a-fA-F]+', '0x', exc_string.strip())
+    return hashlib.sha1(normalized.encode()).hexdigest()
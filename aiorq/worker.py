@@ -11,8 +11,10 @@
 # Driessen and released under 2-clause BSD license.
 
 import asyncio
+import functools
 import logging
 import os
+import pickle
 import signal
 import socket
 import sys
@@ -21,16 +23,20 @@ from datetime import timedelta
 
 from rq.compat import text_type, string_types
 from rq.defaults import DEFAULT_RESULT_TTL, DEFAULT_WORKER_TTL
-from rq.job import JobStatus
 from rq.worker import WorkerStatus, green, blue, yellow
 from rq.utils import (ensure_list, import_attribute, utcformat, utcnow,
                       as_text, utcparse)
 
+from . import protocol
+from .blobs import BlobCache, broadcast_hashes, resolve_broadcasts
+from .coalescer import WriteCoalescer
 from .compat import ensure_future
-from .exceptions import DequeueTimeout, JobTimeoutException
-from .job import Job
+from .exceptions import JobTimeoutException, WorkersSuspendedError
+from .job import Job, create_job
 from .queue import Queue, get_failed_queue
-from .suspension import is_suspended
+from .specs import JobStatus
+from .keys import resume_channel, cancel_channel
+from .utils import unset, function_name, traceback_hash, preload_module
 
 
 logger = logging.getLogger(__name__)
@@ -43,11 +49,26 @@ class Worker:
     redis_workers_keys = 'rq:workers'
     queue_class = Queue
     job_class = Job
+    protocol = protocol
+    sweep_slices = 10
+    maintenance_interval = 60
+    maintenance_lease_ttl = 3600
+    maintenance_batch = 100
+    job_lease = 30
+    heartbeat_interval = 10
+    default_concurrency = 100
+    poll_interval = 1
+    blob_cache_size = 64 * 1024 * 1024
+    broadcast_cache_size = 256 * 1024 * 1024
 
     def __init__(self, queues, name=None, default_result_ttl=None,
                  connection=None, exception_handlers=None,
-                 default_worker_ttl=None, job_class=None):
+                 default_worker_ttl=None, job_class=None, concurrency=None,
+                 pubsub_connection=None, preload=(), executor=None):
         self.connection = connection
+        self.pubsub_connection = pubsub_connection
+        self.resume_channel = None
+        self.coalescer = WriteCoalescer(connection)
 
         # TODO: assert against empty queues.
         # TODO: test worker creation without global connection.
@@ -68,10 +89,24 @@ class Worker:
             default_worker_ttl = DEFAULT_WORKER_TTL
         self.default_worker_ttl = default_worker_ttl
 
+        if concurrency is None:
+            concurrency = self.default_concurrency
+        self.concurrency = concurrency
+        self.preload = preload
+        self.executor = executor
+
         self._state = 'starting'
         self._stop_requested = False
         self.failed_queue = get_failed_queue(connection=self.connection)
         self.last_cleaned_at = None
+        self.sweep_cursor = 0
+        self.blob_sweep_cursor = 0
+        self.running_jobs = set()
+        self.job_tasks = {}
+        self.blob_cache = BlobCache(self.blob_cache_size)
+        self.broadcast_cache = BlobCache(self.broadcast_cache_size)
+        self.processed_jobs = 0
+        self.failed_jobs = 0
 
         # By default, push the "move-to-failed-queue" exception handler onto
         # the stack
@@ -115,12 +150,36 @@ class Worker:
     def move_to_failed_queue(self, job, *exc_info):
         """Default exception handler.
 
-        Move the job to the failed queue.
+        Move the job to the failed queue or schedule its retry.  The
+        job is moved by the single `complete_job` call made after all
+        handlers are walked.
         """
 
-        exc_string = ''.join(traceback.format_exception(*exc_info))
         logger.warning('Moving job to "%s" queue', self.failed_queue)
-        yield from self.failed_queue.quarantine(job, exc_info=exc_string)
+
+    @asyncio.coroutine
+    def fail_job(self, job, *exc_info, failed_queue=True):
+        """Moves the job to the failed queue or schedules its retry
+        according to the job retry policy.  Without ``failed_queue``
+        the job only leaves the started registry with failed status.
+        """
+
+        exc_string = ''.join(traceback.format_exception(*exc_info))
+        try:
+            function = function_name(job.func)[0]
+        except Exception:
+            # Job function can't be resolved.
+            function = job.description
+        job.status = yield from self.protocol.complete_job(
+            self.connection, job.origin, job.id, exc_info=exc_string,
+            exc_type=exc_info[0].__name__,
+            exc_hash=traceback_hash(exc_string), function=function,
+            failed_queue=failed_queue)
+        if job.status is None:
+            logger.warning('Job %s lease is lost, its failure is dropped',
+                           job.id)
+        elif job.status == JobStatus.SCHEDULED:
+            logger.warning('Job %s is scheduled for another attempt', job.id)
 
     @asyncio.coroutine
     def register_birth(self):
@@ -180,36 +239,43 @@ class Worker:
     def set_state(self, state, pipeline=None):
 
         self._state = state
-        pipe = pipeline if pipeline else self.connection
-        coroutine = pipe.hset(self.key, 'state', state)
-        if not pipeline:
-            yield from coroutine
+        if pipeline:
+            pipeline.hset(self.key, 'state', state)
+        else:
+            yield from self.coalescer.write('hset', self.key, 'state', state)
 
     @asyncio.coroutine
-    def check_for_suspension(self, burst, *, loop=None):
-        """Check to see if workers have been suspended by `rq suspend`"""
-
-        before_state = None
-        notified = False
+    def wait_for_resume(self, *, loop=None):
+        """Waits until workers are resumed with `rq resume`.
 
-        while not self._stop_requested and \
-                (yield from is_suspended(self.connection)):
+        Without `pubsub_connection` or if suspension expires by itself
+        worker checks it again in `poll_interval` seconds.
+        """
 
-            if burst:
-                logger.info('Suspended in burst mode, exiting')
-                logger.info(
-                    'Note: There could still be unfinished jobs on the queue')
-                return True
+        if self.resume_channel is None:
+            yield from asyncio.sleep(self.poll_interval, loop=loop)
+            return
+        try:
+            yield from asyncio.wait_for(
+                self.resume_channel.get(), self.poll_interval, loop=loop)
+        except asyncio.TimeoutError:
+            pass
 
-            if not notified:
-                logger.info('Worker suspended, run `rq resume` to resume')
-                before_state = self.get_state()
-                yield from self.set_state(WorkerStatus.SUSPENDED)
-                notified = True
-            yield from asyncio.sleep(1)
+    @asyncio.coroutine
+    def listen_cancels(self, channel):
+        """Stops running jobs canceled with `cancel_job`.  Canceled
+        job frees its concurrency slot immediately, blocking job run
+        in the executor frees it when its thread returns.
+        """
 
-        if before_state:
-            yield from self.set_state(before_state)
+        while True:
+            message = yield from channel.get()
+            if message is None:
+                break
+            task = self.job_tasks.get(message.decode())
+            if task is not None:
+                logger.info('Canceling job %s', message.decode())
+                task.cancel()
 
     @asyncio.coroutine
     def work(self, burst=False, *, loop=None):
@@ -220,51 +286,98 @@ class Worker:
         arrive on any of the queues, unless `burst` mode is enabled.
 
         The return value indicates whether any jobs were processed.
+
+        Each job costs two Redis round trips: `claim_job` and
+        `complete_job` scripts.  Job with offloaded arguments or
+        broadcast values missing from the worker caches costs one
+        more for each kind.  Suspension is checked by the claim
+        script itself.  Heartbeats, lease renewal and worker
+        counters are sent in the background and don't depend on the
+        number of processed jobs.
         """
 
         did_perform_work = False
         jobs = set()
+        slots = asyncio.Semaphore(self.concurrency, loop=loop)
+        self.coalescer = WriteCoalescer(self.connection, loop=loop)
+        self.preload_modules()
         yield from self.register_birth()
         logger.info("RQ worker %s started", self.key)
         yield from self.set_state(WorkerStatus.STARTED)
+        maintenance = ensure_future(self.maintenance(loop=loop), loop=loop)
+        heartbeats = ensure_future(self.heartbeats(loop=loop), loop=loop)
+        cancels = None
+        if self.pubsub_connection is not None:
+            self.resume_channel, channel = yield from (
+                self.pubsub_connection.subscribe(
+                    resume_channel(), cancel_channel()))
+            cancels = ensure_future(
+                self.listen_cancels(channel), loop=loop)
+        suspended = False
 
         try:
             while True:
-                if (yield from self.check_for_suspension(burst, loop=loop)):
-                    break
-
-                if self.should_run_maintenance_tasks:
-                    yield from self.clean_registries()
-
                 if self._stop_requested:
                     logger.info('Stopping on request')
+                    # Running jobs need heartbeats to keep their
+                    # leases until they finish.
+                    if jobs:
+                        yield from asyncio.gather(*jobs)
                     break
 
-                if burst:
-                    timeout = None
-                else:
-                    timeout = max(1, self.default_worker_ttl - 60)
-
-                result = yield from self.dequeue_job_and_maintain_ttl(
-                    timeout)
-
-                if result is None:
+                yield from slots.acquire()
+                try:
+                    job = yield from self.claim_job()
+                except WorkersSuspendedError:
+                    slots.release()
+                    if burst:
+                        logger.info('Suspended in burst mode, exiting')
+                        logger.info('Note: There could still be '
+                                    'unfinished jobs on the queue')
+                        break
+                    if not suspended:
+                        logger.info(
+                            'Worker suspended, run `rq resume` to resume')
+                        yield from self.set_state(WorkerStatus.SUSPENDED)
+                        suspended = True
+                    yield from self.wait_for_resume(loop=loop)
+                    continue
+
+                if suspended:
+                    yield from self.set_state(WorkerStatus.STARTED)
+                    suspended = False
+
+                if job is None:
+                    slots.release()
                     if burst:
                         logger.info(
                             'RQ worker %s done, quitting', self.key)
                         if jobs:
                             yield from asyncio.gather(*jobs)
-                    break  # TODO: do we need to use break for burst mode only?
+                        break
+                    yield from asyncio.sleep(self.poll_interval, loop=loop)
+                    continue
 
-                job, queue = result
-                job_coroutine = self.execute_job(job, queue, loop=loop)
+                job_coroutine = self.execute_job(job, loop=loop)
                 # TODO: remove this task from set when it will be finished
-                jobs.add(ensure_future(job_coroutine, loop=loop))
+                task = ensure_future(job_coroutine, loop=loop)
+                task.add_done_callback(lambda task: slots.release())
+                self.job_tasks[job.id] = task
+                task.add_done_callback(
+                    lambda task, id=job.id: self.job_tasks.pop(id, None))
+                jobs.add(task)
 
                 # TODO: should be set after first coroutine ends
                 did_perform_work = True
 
         finally:
+            maintenance.cancel()
+            heartbeats.cancel()
+            if cancels is not None:
+                cancels.cancel()
+                yield from self.pubsub_connection.unsubscribe(
+                    resume_channel(), cancel_channel())
+                self.resume_channel = None
             yield from self.register_death()
         return did_perform_work
 
@@ -284,7 +397,7 @@ class Worker:
 
         # If shutdown is requested in the middle of a job, wait until
         # finish before shutting down
-        if self.get_state() == 'busy':
+        if self.running_jobs:
             self._stop_requested = True
             logger.debug('Stopping after running coroutines are finished.  '
                          'Press Ctrl+C again for a cold shutdown.')
@@ -325,7 +438,12 @@ class Worker:
 
     @property
     def should_run_maintenance_tasks(self):
-        """Maintenance tasks should run on first startup or every hour."""
+        """Maintenance tasks should run on first startup or every hour.
+
+        Only the worker holding the maintenance lease actually runs
+        them.  Others just try to take the lease every
+        `maintenance_interval` seconds, single command per try.
+        """
 
         if self.last_cleaned_at is None:
             return True
@@ -334,128 +452,320 @@ class Worker:
         return False
 
     @asyncio.coroutine
-    def clean_registries(self):
-        """Runs maintenance jobs on each Queue's registries."""
+    def maintenance(self, *, loop=None):
+        """Runs maintenance tasks in the background of the work loop so
+        they never delay dequeuing.
+        """
+
+        while True:
+            try:
+                yield from self.reclaim_jobs()
+                if self.should_run_maintenance_tasks:
+                    lease = yield from (
+                        self.protocol.acquire_maintenance_lease(
+                            self.connection, self.name,
+                            self.maintenance_lease_ttl))
+                    if lease:
+                        yield from self.clean_registries(lease)
+                        yield from self.sweep_jobs(lease)
+                        yield from self.sweep_blobs(lease)
+            except Exception:
+                logger.exception('Maintenance tasks failed')
+            yield from asyncio.sleep(self.maintenance_interval, loop=loop)
+
+    @asyncio.coroutine
+    def heartbeats(self, *, loop=None):
+        """Sends heartbeat every `heartbeat_interval` seconds in the
+        background, so job processing never waits for it.
+        """
+
+        while True:
+            yield from asyncio.sleep(self.heartbeat_interval, loop=loop)
+            try:
+                yield from self.heartbeat()
+            except Exception:
+                logger.exception('Heartbeat failed')
+
+    @asyncio.coroutine
+    def reclaim_jobs(self):
+        """Fails or retries jobs of this worker queues with expired
+        lease.  Their workers are most likely dead.
+
+        Unlike other maintenance tasks reclaim runs on every worker
+        each `maintenance_interval` seconds, so lost jobs are detected
+        quickly.  Reclaim script is atomic, concurrent runs are safe.
+        """
+
+        redis, limit = self.connection, self.maintenance_batch
+        for queue in self.queues:
+            while (yield from self.protocol.clean_started_jobs(
+                    redis, queue.name, limit=limit)) == limit:
+                pass
+
+    @asyncio.coroutine
+    def clean_registries(self, lease=unset):
+        """Runs maintenance jobs on each Queue's registries.
+
+        Each registry is processed in batches of `maintenance_batch`
+        jobs, one script call per batch.  Cleanup stops as soon as
+        given maintenance `lease` is lost.
+        """
 
         for queue in self.queues:
             logger.info('Cleaning registries for queue: %s', queue.name)
-            yield from clean_registries(queue)
+            yield from self.clean_queue_registries(queue.name, lease)
         self.last_cleaned_at = utcnow()
 
     @asyncio.coroutine
-    def dequeue_job_and_maintain_ttl(self, timeout):
-
-        result = None
-        qnames = self.queue_names()
+    def clean_queue_registries(self, name, lease=unset):
+        """Cleans started, finished and deferred registries of the
+        queue with given name and compacts the queue itself.
+        """
 
-        yield from self.set_state(WorkerStatus.IDLE)
-        logger.info('')
-        logger.info('*** Listening on %s...', green(', '.join(qnames)))
+        redis, limit = self.connection, self.maintenance_batch
+        while (yield from self.protocol.clean_started_jobs(
+                redis, name, limit=limit, lease=lease)) == limit:
+            pass
+        while (yield from self.protocol.clean_finished_jobs(
+                redis, name, limit=limit, lease=lease)) == limit:
+            pass
+        offset, _ = yield from self.protocol.clean_deferred_jobs(
+            redis, name, limit=limit, lease=lease)
+        while offset:
+            offset, _ = yield from self.protocol.clean_deferred_jobs(
+                redis, name, offset, limit=limit, lease=lease)
+        offset, _ = yield from self.protocol.compact_queue(
+            redis, name, limit=limit, lease=lease)
+        while offset:
+            offset, _ = yield from self.protocol.compact_queue(
+                redis, name, offset, limit=limit, lease=lease)
 
-        while True:
-            yield from self.heartbeat()
+    @asyncio.coroutine
+    def sweep_jobs(self, lease=unset):
+        """Deletes orphan job hashes.
 
-            try:
-                result = yield from self.queue_class.dequeue_any(
-                    self.queues, timeout, connection=self.connection)
-                if result is not None:
-                    job, queue = result
-                    logger.info('%s: %s (%s)', green(queue.name),
-                                blue(job.description), job.id)
+        Each run examines at most `sweep_slices` SCAN slices and
+        continues from the place where previous run stops.
+        """
 
+        deleted = 0
+        for _ in range(self.sweep_slices):
+            self.sweep_cursor, count = yield from self.protocol.sweep_jobs(
+                self.connection, self.sweep_cursor, lease=lease)
+            deleted += count
+            if not self.sweep_cursor:
                 break
-            except DequeueTimeout:
-                pass
-
-        yield from self.heartbeat()
-        return result
+        logger.info('Deleted %s orphan job hashes', deleted)
 
     @asyncio.coroutine
-    def heartbeat(self, timeout=0, pipeline=None):
-        """Specifies a new worker timeout, typically by extending the
-        expiration time of the worker, effectively making this a
-        "heartbeat" to not expire the worker until the timeout passes.
+    def sweep_blobs(self, lease=unset):
+        """Deletes blobs no longer referenced by any job.
+
+        Each run examines at most `sweep_slices` SCAN slices same as
+        `sweep_jobs`.
+        """
+
+        deleted = 0
+        for _ in range(self.sweep_slices):
+            self.blob_sweep_cursor, count = (
+                yield from self.protocol.sweep_blobs(
+                    self.connection, self.blob_sweep_cursor, lease=lease))
+            deleted += count
+            if not self.blob_sweep_cursor:
+                break
+        logger.info('Deleted %s orphan blobs', deleted)
 
-        The next heartbeat should come before this time, or the worker
-        will die (at least from the monitoring dashboards).
+    @asyncio.coroutine
+    def claim_job(self):
+        """Dequeues and starts the front-most job of this worker queues
+        in one call.  Returns None if all queues are empty.
 
-        The effective timeout can never be shorter than
-        default_worker_ttl, only larger.
+        Job which can't be loaded is failed right away without calling
+        exception handlers and the next job is claimed instead.
         """
 
-        timeout = max(timeout, self.default_worker_ttl)
-        pipe = pipeline if pipeline else self.connection
-        logger.debug('Sent heartbeat to prevent worker timeout.  '
-                     'Next one should arrive within %s seconds.', timeout)
-        coroutine = pipe.expire(self.key, timeout)
-        if not pipeline:
-            yield from coroutine
+        while True:
+            queue, job_id, spec = yield from self.protocol.claim_job(
+                self.connection, self.queue_names(), lease=self.job_lease)
+            if job_id is None:
+                return None
+            try:
+                job = yield from self.load_job(job_id, spec)
+            except Exception:
+                exc_info = sys.exc_info()
+                logger.exception('Job %s can not be loaded', job_id)
+                yield from self.fail_job(
+                    create_job(self.connection, job_id, spec), *exc_info)
+                continue
+            logger.info('%s: %s (%s)', green(queue), blue(job.description),
+                        job.id)
+            return job
 
     @asyncio.coroutine
-    def execute_job(self, job, queue, *, loop=None):
-        """Send a job into asyncio event loop."""
+    def load_job(self, job_id, spec):
+        """Creates claimed job with its function resolved and its
+        offloaded arguments and broadcast values in place.
 
-        yield from self.set_state('busy')
-        yield from self.perform_job(job, loop=loop)
-        # TODO: set this status only if there are no running coroutines
-        yield from self.set_state('idle')
-        yield from self.heartbeat()
+        Raises if job function can't be imported, job serializer or
+        codec is unknown or job arguments or broadcast values are gone.
+        """
 
-        if (yield from job.get_status()) == JobStatus.FINISHED:
-            yield from queue.enqueue_dependents(job)
+        blobs = None
+        if b'blobs' in spec:
+            blobs = yield from self.fetch_blobs(
+                spec[b'blobs'].decode().split())
+        job = create_job(self.connection, job_id, spec, blobs)
+        hashes = broadcast_hashes(job.args, job.kwargs)
+        if hashes:
+            values = yield from self.fetch_broadcasts(hashes)
+            job.args, job.kwargs = resolve_broadcasts(
+                job.args, job.kwargs, values)
+        return job
+
+    def preload_modules(self):
+        """Import job modules and resolve their functions before the
+        first job is taken."""
+
+        for name in self.preload:
+            count = preload_module(name)
+            logger.info('Preloaded %s functions from %s', count, name)
 
     @asyncio.coroutine
-    def perform_job(self, job, *, loop=None):
-        """Performs the actual work of a job."""
+    def fetch_blobs(self, hashes):
+        """Payloads of offloaded job arguments.  Recently used blobs
+        are served from the worker cache without Redis round trip.
+        """
 
-        yield from self.prepare_job_execution(job)
+        blobs = {hash: self.blob_cache.get(hash) for hash in hashes}
+        missing = [hash for hash, data in blobs.items() if data is None]
+        if missing:
+            fetched = yield from self.protocol.fetch_blobs(
+                self.connection, missing)
+            for hash, data in fetched.items():
+                if data is not None:
+                    self.blob_cache.put(hash, data)
+            blobs.update(fetched)
+        return blobs
 
-        pipe = self.connection.multi_exec()
-        started_job_registry = StartedJobRegistry(job.origin, self.connection)
+    @asyncio.coroutine
+    def fetch_broadcasts(self, hashes):
+        """Broadcast values passed to the job.  Each value is fetched
+        and unpickled once while it stays in the worker cache.  Missing
+        values are left out.
+        """
 
-        try:
-            timeout = job.timeout or self.queue_class.DEFAULT_TIMEOUT
-            try:
-                rv = yield from asyncio.wait_for(
-                    job.perform(), timeout, loop=loop)
-            except asyncio.TimeoutError as error:
-                raise JobTimeoutException from error
+        values = {hash: self.broadcast_cache.get(hash) for hash in hashes
+                  if hash in self.broadcast_cache}
+        missing = [hash for hash in hashes if hash not in values]
+        if missing:
+            fetched = yield from self.protocol.fetch_broadcasts(
+                self.connection, missing)
+            for hash, data in fetched.items():
+                if data is not None:
+                    values[hash] = pickle.loads(data)
+                    self.broadcast_cache.put(hash, values[hash], len(data))
+        return values
 
-            # Pickle the result in the same try-except block since we
-            # need to use the same exc handling when pickling fails
-            yield from self.set_current_job_id(None, pipeline=pipe)
+    @asyncio.coroutine
+    def heartbeat(self):
+        """Extends worker TTL, renews leases of the running jobs and
+        publishes worker stats in one transaction.
 
-            result_ttl = job.get_result_ttl(self.default_result_ttl)
-            if result_ttl != 0:
-                job.ended_at = utcnow()
-                job._status = JobStatus.FINISHED
-                yield from job.save(pipeline=pipe)
+        The next heartbeat should come before default_worker_ttl
+        expires, or the worker will die (at least from the monitoring
+        dashboards).
+        """
 
-                finished_job_registry = FinishedJobRegistry(
-                    job.origin, self.connection)
-                yield from finished_job_registry.add(job, result_ttl, pipe)
+        logger.debug('Sent heartbeat to prevent worker timeout.  '
+                     'Next one should arrive within %s seconds.',
+                     self.default_worker_ttl)
+        running = len(self.running_jobs)
+        stats = {'running': running,
+                 'idle_slots': max(self.concurrency - running, 0),
+                 'processed': self.processed_jobs,
+                 'failed': self.failed_jobs}
+        yield from self.protocol.worker_heartbeat(
+            self.connection, self.name, self.default_worker_ttl,
+            jobs=self.running_jobs, lease=self.job_lease, stats=stats)
 
-            yield from job.cleanup(result_ttl, pipeline=pipe)
-            yield from started_job_registry.remove(job, pipeline=pipe)
+    @asyncio.coroutine
+    def execute_job(self, job, *, loop=None):
+        """Send a job into asyncio event loop."""
+
+        try:
+            self.running_jobs.add((job.origin, job.id))
+            if (yield from self.perform_job(job, loop=loop)):
+                self.processed_jobs += 1
+            else:
+                self.failed_jobs += 1
+        finally:
+            self.running_jobs.discard((job.origin, job.id))
 
-            yield from pipe.execute()
+    @asyncio.coroutine
+    def perform_job(self, job, *, loop=None):
+        """Performs the actual work of a job."""
 
+        timeout = job.timeout or self.queue_class.default_timeout
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        thread = None
+        try:
+            if (self.executor is None or
+                    asyncio.iscoroutinefunction(job.func)):
+                rv = job.func(*job.args, **job.kwargs)
+            else:
+                # Blocking function runs in the worker executor so
+                # heartbeats keep renewing job leases meanwhile.
+                # Its thread can't be interrupted, so the job is
+                # completed and its slot is released only after the
+                # thread returns.
+                thread = loop.run_in_executor(
+                    self.executor,
+                    functools.partial(job.func, *job.args, **job.kwargs))
+                rv = asyncio.shield(thread, loop=loop)
+            if asyncio.iscoroutine(rv) or isinstance(rv, asyncio.Future):
+                try:
+                    rv = yield from asyncio.wait_for(rv, timeout, loop=loop)
+                except asyncio.TimeoutError as error:
+                    raise JobTimeoutException from error
+            # Pickle the result in the same try-except block since we
+            # need to use the same exc handling when pickling fails
+            result = pickle.dumps(rv)
+        except asyncio.CancelledError:
+            if thread is not None:
+                yield from asyncio.wait([thread], loop=loop)
+            exc_string = ''.join(traceback.format_exception(*sys.exc_info()))
+            status = yield from self.protocol.complete_job(
+                self.connection, job.origin, job.id, exc_info=exc_string,
+                exc_type='CancelledError',
+                exc_hash=traceback_hash(exc_string),
+                function=function_name(job.func)[0])
+            logger.info('%s: %s (%s)', green(job.origin),
+                        blue('Job {}'.format(status)), job.id)
+            return False
         except Exception:
-            # TODO: if `pipe.execute()` throws exception
-            # `ConnectionClosedError` and we try to add actions to the
-            # pipeline which was already executed then line below will
-            # throw "AssertionError: Pipeline already executed. Create
-            # new one."
-            yield from job.set_status(JobStatus.FAILED, pipeline=pipe)
-            yield from started_job_registry.remove(job, pipeline=pipe)
-            yield from self.set_current_job_id(None, pipeline=pipe)
-            try:
-                yield from pipe.execute()
-            except Exception:
-                # Ensure that custom exception handlers are called
-                # even if Redis is down
-                pass
-            yield from self.handle_exception(job, *sys.exc_info())
+            exc_info = sys.exc_info()
+            if thread is not None:
+                yield from asyncio.wait([thread], loop=loop)
+            failed_queue = yield from self.handle_exception(job, *exc_info)
+            yield from self.fail_job(job, *exc_info,
+                                     failed_queue=failed_queue)
+            return False
+
+        if job.result_ttl is None:
+            result_ttl = self.default_result_ttl
+        else:
+            result_ttl = job.result_ttl
+        status = yield from self.protocol.complete_job(
+            self.connection, job.origin, job.id, result=result,
+            result_ttl=result_ttl)
+        if status is None:
+            logger.warning('Job %s lease is lost, its result is dropped',
+                           job.id)
+            return False
+        if status == JobStatus.CANCELED:
+            logger.info('%s: %s (%s)', green(job.origin),
+                        blue('Job canceled'), job.id)
             return False
 
         logger.info('%s: %s (%s)', green(job.origin), blue('Job OK'), job.id)
@@ -473,24 +783,6 @@ class Worker:
 
         return True
 
-    @asyncio.coroutine
-    def prepare_job_execution(self, job):
-        """Performs misc bookkeeping like updating states prior to job
-        execution.
-        """
-
-        timeout = (job.timeout or 180) + 60
-
-        pipe = self.connection.multi_exec()
-        yield from self.set_state(WorkerStatus.BUSY, pipeline=pipe)
-        yield from self.set_current_job_id(job.id, pipeline=pipe)
-        yield from self.heartbeat(timeout, pipeline=pipe)
-        registry = StartedJobRegistry(job.origin, self.connection)
-        yield from registry.add(job, timeout, pipeline=pipe)
-        yield from job.set_status(JobStatus.STARTED, pipeline=pipe)
-        pipe.hset(job.key, 'started_at', utcformat(utcnow()))
-        yield from pipe.execute()
-
     @asyncio.coroutine
     def set_current_job_id(self, job_id, pipeline=None):
 
@@ -523,17 +815,25 @@ class Worker:
 
     @asyncio.coroutine
     def handle_exception(self, job, *exc_info):
-        """Walks the exception handler stack to delegate exception handling."""
+        """Walks the exception handler stack to delegate exception handling.
+
+        Returns whether the walk reached default `move_to_failed_queue`
+        handler.  Handler returning False stops the walk, so the job
+        isn't moved to the failed queue.
+        """
 
         logger.exception('Coroutine error', extra={
-            'func': job.func_name,  # FIXME: we can fuckup with UnpickleError
+            'func': job.description,
             'arguments': job.args,
             'kwargs': job.kwargs,
             'queue': job.origin,
         })
 
+        failed_queue = False
         for handler in reversed(self._exc_handlers):
             logger.debug('Invoking exception handler %s', handler)
+            if handler == self.move_to_failed_queue:
+                failed_queue = True
             fallthrough = yield from handler(job, *exc_info)
 
             # Only handlers with explicit return values should disable
@@ -544,3 +844,5 @@ class Worker:
 
             if not fallthrough:
                 break
+
+        return failed_queue
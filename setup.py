@@ -13,6 +13,7 @@ setup(
     author_email='proofit404@gmail.com',
     packages=find_packages(),
     install_requires=['rq>=0.5', 'aioredis>=0.2', 'click>=3.0'],
+    extras_require={'msgpack': ['msgpack>=0.5.2']},
     entry_points={
         'console_scripts': [
             'aiorq = aiorq.cli:cli',
@@ -1,4 +1,5 @@
 import asyncio
+import time
 from unittest.mock import Mock
 
 from aiorq import get_current_job
@@ -18,6 +19,11 @@ def some_calculation(x, y, z=1):
     return x * y / z
 
 
+def blocking_sleep(timeout):
+
+    time.sleep(timeout)
+
+
 class Number:
 
     def __init__(self, value):
@@ -0,0 +1,105 @@
+import pickle
+
+import pytest
+
+from aiorq.blobs import (BlobRef, BlobCache, Broadcast, offload_args,
+                         resolve_args, broadcast_hashes, resolve_broadcasts)
+from aiorq.exceptions import MissingArgumentError
+
+
+# Offload arguments.
+
+
+def test_offload_args():
+    """Large arguments are replaced with blob references."""
+
+    args, kwargs, blobs = offload_args((1, 'x' * 1000), {'y': 'y' * 1000,
+                                                         'z': 2}, 100)
+    assert args[0] == 1
+    assert isinstance(args[1], BlobRef)
+    assert isinstance(kwargs['y'], BlobRef)
+    assert kwargs['z'] == 2
+    assert pickle.loads(blobs[args[1].hash]) == 'x' * 1000
+    assert resolve_args(args, kwargs, blobs) == (
+        (1, 'x' * 1000), {'y': 'y' * 1000, 'z': 2})
+
+
+def test_offload_args_same_content():
+    """Equal arguments share single blob."""
+
+    args, kwargs, blobs = offload_args(('x' * 1000,), {'y': 'x' * 1000}, 100)
+    assert args[0] == kwargs['y']
+    assert len(blobs) == 1
+
+
+def test_offload_args_string_length():
+    """Strings and bytes are offloaded by their length."""
+
+    args, kwargs, blobs = offload_args(('x' * 99, b'x' * 100), {}, 100)
+    assert args[0] == 'x' * 99
+    assert isinstance(args[1], BlobRef)
+    assert len(blobs) == 1
+
+
+# Broadcast values.
+
+
+def test_resolve_broadcasts():
+    """Broadcast handles are replaced with known values."""
+
+    args = (Broadcast('foo'), 1)
+    kwargs = {'y': Broadcast('bar'), 'z': Broadcast('foo')}
+    assert broadcast_hashes(args, kwargs) == ['bar', 'foo']
+    args, kwargs = resolve_broadcasts(args, kwargs, {'foo': [1, 2],
+                                                     'bar': 3})
+    assert args == ([1, 2], 1)
+    assert kwargs == {'y': 3, 'z': [1, 2]}
+
+
+def test_resolve_broadcasts_missing():
+    """Missing broadcast value is an error."""
+
+    with pytest.raises(MissingArgumentError):
+        resolve_broadcasts((Broadcast('foo'),), {}, {})
+
+
+def test_resolve_args_missing():
+    """Missing blob is an error."""
+
+    with pytest.raises(MissingArgumentError):
+        resolve_args((BlobRef('foo'),), {}, {'foo': None})
+
+
+# Blob cache.
+
+
+def test_blob_cache_evicts_least_recently_used():
+    """Cache drops least recently used blobs above its size."""
+
+    cache = BlobCache(10)
+    cache.put('a', b'aaaa')
+    cache.put('b', b'bbbb')
+    assert cache.get('a') == b'aaaa'
+    cache.put('c', b'cccc')
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.size == 8
+
+
+def test_blob_cache_skips_huge_blobs():
+    """Blob larger than the whole cache isn't cached."""
+
+    cache = BlobCache(10)
+    cache.put('a', b'a' * 11)
+    assert cache.get('a') is None
+    assert not cache.size
+
+
+def test_blob_cache_value_size():
+    """Cached value can be weighted by its payload size."""
+
+    cache = BlobCache(10)
+    cache.put('a', object(), 6)
+    cache.put('b', object(), 6)
+    assert 'a' not in cache
+    assert cache.size == 6
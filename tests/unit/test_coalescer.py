@@ -0,0 +1,28 @@
+from aiorq.coalescer import WriteCoalescer
+
+
+# Write coalescer.
+
+
+def test_write_coalescer_same_tick(redis, loop):
+    """Writes issued during the same loop tick share transaction."""
+
+    coalescer = WriteCoalescer(redis, loop=loop)
+    foo = coalescer.write('set', 'foo', 'bar')
+    baz = coalescer.write('hset', 'baz', 'x', 'y')
+    assert foo is baz
+    yield from foo
+    assert (yield from redis.get('foo')) == b'bar'
+    assert (yield from redis.hget('baz', 'x')) == b'y'
+
+
+def test_write_coalescer_next_tick(redis, loop):
+    """Writes issued after flush go into next transaction."""
+
+    coalescer = WriteCoalescer(redis, loop=loop)
+    foo = coalescer.write('set', 'foo', 'bar')
+    yield from foo
+    baz = coalescer.write('set', 'baz', 'x')
+    assert foo is not baz
+    yield from baz
+    assert (yield from redis.get('baz')) == b'x'
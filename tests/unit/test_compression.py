@@ -0,0 +1,79 @@
+import pytest
+
+from aiorq.compression import (codecs, get_codec, register_codec, compress,
+                               ZlibCodec)
+
+
+# Get codec.
+
+
+def test_get_codec_by_name():
+    """Find registered codec by its name."""
+
+    assert isinstance(get_codec('zlib'), ZlibCodec)
+
+
+def test_get_codec_unknown():
+    """Unknown codec name is an error."""
+
+    with pytest.raises(ValueError):
+        get_codec('snappy')
+
+
+def test_get_codec_unregistered_instance():
+    """Codec instance with unknown name is an error even if data
+    isn't compressed."""
+
+    class SnappyCodec(ZlibCodec):
+        name = 'snappy'
+
+    with pytest.raises(ValueError):
+        get_codec(SnappyCodec())
+    with pytest.raises(ValueError):
+        compress(SnappyCodec(), b'x', 1024)
+
+
+def test_register_codec():
+    """Registered codec is available by its name."""
+
+    class SnappyCodec(ZlibCodec):
+        name = 'snappy'
+
+    codec = register_codec(SnappyCodec())
+    try:
+        assert get_codec('snappy') is codec
+        assert get_codec(codec) is codec
+    finally:
+        del codecs['snappy']
+
+
+# Compress.
+
+
+@pytest.mark.parametrize('name', sorted(codecs))
+def test_compress_round_trip(name):
+    """Compressed data is restored by its codec."""
+
+    data, codec, ratio = compress(name, b'x' * 4096, 1024)
+    assert codec == name
+    assert ratio < 1
+    assert codecs[codec].decompress(data) == b'x' * 4096
+
+
+def test_compress_below_threshold():
+    """Small data is kept as is."""
+
+    assert compress('zlib', b'x' * 100, 1024) == (b'x' * 100, None, None)
+
+
+def test_compress_incompressible():
+    """Data is kept as is if compression doesn't pay off."""
+
+    data = bytes(range(256))
+    assert compress('zlib', data, 0) == (data, None, None)
+
+
+def test_compress_disabled():
+    """No codec means no compression."""
+
+    assert compress(None, b'x' * 4096, 0) == (b'x' * 4096, None, None)
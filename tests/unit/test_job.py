@@ -1,10 +1,12 @@
 import asyncio
 import time
+import zlib
 from datetime import datetime
 from pickle import UnpicklingError
 
 import pytest
 
+import stubs
 from aiorq import (cancel_job, get_current_job, requeue_job, Queue,
                    get_failed_queue, Worker)
 from aiorq.exceptions import NoSuchJobError
@@ -81,8 +83,51 @@ def test_create_job_instance_method(redis):
     assert job.enqueued_at == datetime(2016, 5, 3, 12, 10, 11)
 
 
+def test_create_job_json_serializer(redis):
+    """Create job from data encoded with the serializer named in the
+    job spec."""
+
+    id = b'2a5079e7-387b-492f-a81c-68aa55c194c8'
+    spec = {
+        b'created_at': b'2016-04-05T22:40:35Z',
+        b'data': b'["fixtures.some_calculation",[3,4],{"z":2}]',
+        b'serializer': b'json',
+        b'description': b'fixtures.some_calculation(3, 4, z=2)',
+        b'timeout': 180,
+        b'result_ttl': 5000,
+        b'status': JobStatus.QUEUED.encode(),
+        b'origin': b'default',
+        b'enqueued_at': b'2016-05-03T12:10:11Z',
+    }
+    job = create_job(redis, id, spec)
+    assert job.func == some_calculation
+    assert job.args == (3, 4)
+    assert job.kwargs == {'z': 2}
+
+
+def test_create_job_compressed_data(redis):
+    """Create job from data compressed with the codec named in the job
+    spec."""
+
+    id = b'2a5079e7-387b-492f-a81c-68aa55c194c8'
+    spec = {
+        b'created_at': b'2016-04-05T22:40:35Z',
+        b'data': zlib.compress(stubs.job_data),
+        b'codec': b'zlib',
+        b'description': b'fixtures.some_calculation(3, 4, z=2)',
+        b'timeout': 180,
+        b'result_ttl': 5000,
+        b'status': JobStatus.QUEUED.encode(),
+        b'origin': b'default',
+        b'enqueued_at': b'2016-05-03T12:10:11Z',
+    }
+    job = create_job(redis, id, spec)
+    assert job.func == some_calculation
+    assert job.args == (3, 4)
+
+
 def test_create_job_unreadable_data(redis):
-    """Create job unreadable pickle string will raise UnpickleError."""
+    """Access unreadable pickle string will raise UnpickleError."""
 
     id = b'2a5079e7-387b-492f-a81c-68aa55c194c8'
     spec = {
@@ -95,12 +140,13 @@ def test_create_job_unreadable_data(redis):
         b'origin': b'default',
         b'enqueued_at': b'2016-05-03T12:10:11Z',
     }
+    job = create_job(redis, id, spec)
     with pytest.raises(UnpicklingError):
-        create_job(redis, id, spec)
+        job.args
 
 
 def test_create_job_unimportable_data(redis):
-    """Create job unimportable data will raise attribute error."""
+    """Access unimportable data will raise attribute error."""
 
     id = b'2a5079e7-387b-492f-a81c-68aa55c194c8'
     spec = {
@@ -114,8 +160,36 @@ def test_create_job_unimportable_data(redis):
         b'origin': b'default',
         b'enqueued_at': b'2016-05-03T12:10:11Z',
     }
+    job = create_job(redis, id, spec)
     with pytest.raises(AttributeError):
-        create_job(redis, id, spec)
+        job.func
+
+
+def test_create_job_lazy_data(redis):
+    """Job data is unpickled on first access of job function or
+    arguments only."""
+
+    id = b'2a5079e7-387b-492f-a81c-68aa55c194c8'
+    spec = {
+        b'created_at': b'2016-04-05T22:40:35Z',
+        b'data': b'this is no pickle string',
+        b'description': b'fixtures.some_calculation(3, 4, z=2)',
+        b'timeout': 180,
+        b'result_ttl': 5000,
+        b'status': JobStatus.QUEUED.encode(),
+        b'origin': b'default',
+    }
+    del spec[b'result_ttl']
+    job = create_job(redis, id, spec)
+    assert job.description == 'fixtures.some_calculation(3, 4, z=2)'
+    assert job.status == 'queued'
+    assert job.enqueued_at is None
+    assert job.result_ttl is None
+    spec[b'data'] = stubs.job_data
+    assert job.args == (3, 4)
+    job.args = (5, 6)
+    assert job.args == (5, 6)
+    assert job.kwargs == {'z': 2}
 
 
 def test_create_job_str_id():
@@ -154,8 +228,8 @@ def test_create_job_str_id():
 def test_job_status(redis):
     """Access job status checkers like is_started."""
 
-    results = [b'queued', b'started', b'finished', b'failed', b'deferred',
-               b'deferred']
+    results = [b'queued', b'started', b'finished', b'failed', b'canceled',
+               b'deferred', b'deferred']
 
     class Protocol:
         @staticmethod
@@ -184,6 +258,7 @@ def test_job_status(redis):
     assert (yield from job.is_started)
     assert (yield from job.is_finished)
     assert (yield from job.is_failed)
+    assert (yield from job.is_canceled)
     assert (yield from job.is_deferred)
     assert (yield from job.get_status()) == JobStatus.DEFERRED
 
@@ -3,18 +3,35 @@ import itertools
 import pytest
 
 import stubs
-from aiorq.exceptions import InvalidOperationError
-from aiorq.keys import (queues_key, queue_key, failed_queue_key,
+from aiorq.exceptions import InvalidOperationError, WorkersSuspendedError
+from aiorq.keys import (queues_key, queue_key, failed_registry,
                         job_key, started_registry, finished_registry,
-                        deferred_registry, workers_key, worker_key,
-                        dependents)
-from aiorq.protocol import (queues, jobs, job, job_status,
+                        deferred_registry, scheduled_registry,
+                        expired_counter, workers_key, worker_key,
+                        dependents, unique_lock, coalesced_job,
+                        maintenance_lease, workers_suspended,
+                        canceled_jobs, traceback_key, blob_key,
+                        compacted_entries)
+from aiorq.protocol import (queues, jobs, queued_jobs, job, job_status,
                             started_jobs, finished_jobs,
-                            deferred_jobs, empty_queue, queue_length,
-                            enqueue_job, dequeue_job, cancel_job,
-                            start_job, finish_job, fail_job,
-                            requeue_job, workers, worker_birth,
-                            worker_death, worker_shutdown_requested)
+                            deferred_jobs, scheduled_jobs, empty_queue,
+                            queue_length, compact_queue, pause_queue,
+                            resume_queue, queue_paused,
+                            enqueue_job, dequeue_job, claim_job,
+                            complete_job, expired_count,
+                            cancel_job, sweep_jobs, sweep_blobs,
+                            start_job, renew_job_leases,
+                            finish_job, fail_job, quarantine_job,
+                            clean_started_jobs, clean_finished_jobs,
+                            clean_deferred_jobs, acquire_maintenance_lease,
+                            failed_jobs, failed_count, requeue_job,
+                            delete_failed_job, requeue_failed,
+                            purge_failed, job_exc_info, traceback_entry,
+                            failure_summary, fetch_blobs, store_broadcast,
+                            fetch_broadcasts, delete_broadcast, workers,
+                            worker_birth,
+                            worker_death, worker_heartbeat,
+                            worker_shutdown_requested)
 from aiorq.specs import JobStatus, WorkerStatus
 from aiorq.utils import current_timestamp, utcparse, utcformat, utcnow
 
@@ -48,6 +65,16 @@ def test_jobs_args(redis):
     assert set((yield from jobs(redis, stubs.queue, 0, 0))) == {b'foo'}
 
 
+def test_queued_jobs(redis):
+    """Queued jobs skip canceled jobs and jobs without hash."""
+
+    for id in ['foo', 'bar', 'baz']:
+        yield from enqueue_job(redis=redis, **dict(stubs.job, id=id))
+    yield from cancel_job(redis, stubs.queue, 'foo')
+    yield from redis.delete(job_key('baz'))
+    assert (yield from queued_jobs(redis, stubs.queue)) == [b'bar']
+
+
 # Job.
 
 
@@ -129,6 +156,25 @@ def test_deferred_jobs_args(redis):
     assert set((yield from deferred_jobs(redis, stubs.queue, 0, 0))) == {b'foo'}
 
 
+# Scheduled jobs.
+
+
+def test_scheduled_jobs(redis):
+    """All jobs waiting for another attempt."""
+
+    yield from redis.zadd(scheduled_registry(stubs.queue), 1, 'foo')
+    yield from redis.zadd(scheduled_registry(stubs.queue), 2, 'bar')
+    assert set((yield from scheduled_jobs(redis, stubs.queue))) == {b'foo', b'bar'}
+
+
+def test_scheduled_jobs_args(redis):
+    """All scheduled jobs from this queue limited by arguments."""
+
+    yield from redis.zadd(scheduled_registry(stubs.queue), 1, 'foo')
+    yield from redis.zadd(scheduled_registry(stubs.queue), 2, 'bar')
+    assert set((yield from scheduled_jobs(redis, stubs.queue, 0, 0))) == {b'foo'}
+
+
 # Queue length.
 
 
@@ -153,6 +199,16 @@ def test_empty_queue(redis):
     assert not (yield from queue_length(redis, stubs.queue))
 
 
+def test_empty_queue_removes_tombstones(redis):
+    """Emptying queue removes canceled job ids as well."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from cancel_job(redis, stubs.queue, stubs.job_id)
+    yield from empty_queue(redis, stubs.queue)
+    assert (yield from queue_length(redis, stubs.queue)) == 0
+    assert not (yield from redis.exists(canceled_jobs(stubs.queue)))
+
+
 def test_empty_removes_jobs(redis):
     """Emptying a queue deletes the associated job objects."""
 
@@ -161,6 +217,16 @@ def test_empty_removes_jobs(redis):
     assert not (yield from redis.exists(job_key(stubs.job_id)))
 
 
+def test_empty_queue_releases_job_resources(redis):
+    """Emptying a queue releases unique locks and blobs of its jobs."""
+
+    yield from enqueue_job(redis=redis, unique_key='foo',
+                           blobs={'bar': b'baz'}, **stubs.job)
+    yield from empty_queue(redis, stubs.queue)
+    assert not (yield from redis.exists(unique_lock('foo')))
+    assert not (yield from redis.keys(blob_key('*')))
+
+
 def test_empty_queue_removes_dependents(redis):
     """Remove dependent jobs for jobs from cleaned queue."""
 
@@ -283,11 +349,231 @@ def test_enqueue_job_defer_without_date(redis):
     assert not (yield from redis.hexists(job_key(stubs.child_job_id), 'enqueued_at'))
 
 
+def test_enqueue_job_returns_calculated_fields(redis):
+    """Enqueue job returns job id, status and enqueued_at date."""
+
+    result = yield from enqueue_job(redis=redis, **stubs.job)
+    assert result == (stubs.job_id, JobStatus.QUEUED,
+                      utcparse(utcformat(utcnow())))
+
+
+def test_enqueue_job_deferred_calculated_fields(redis):
+    """Deferred job has no enqueued_at date."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    result = yield from enqueue_job(redis=redis, **stubs.child_job)
+    assert result == (stubs.child_job_id, JobStatus.DEFERRED, None)
+
+
+def test_enqueue_job_unique_key(redis):
+    """Enqueue job holds unique key until job is done."""
+
+    yield from enqueue_job(redis=redis, unique_key='foo', **stubs.job)
+    assert (yield from redis.get(unique_lock('foo'))) == stubs.job_id.encode()
+    assert (yield from redis.ttl(unique_lock('foo'))) == -1
+
+
+def test_enqueue_job_unique_key_duplicate(redis):
+    """Enqueue job with the held unique key returns holder job."""
+
+    yield from enqueue_job(redis=redis, unique_key='foo', **stubs.job)
+    duplicate = dict(stubs.job, id=stubs.child_job_id)
+    result = yield from enqueue_job(redis=redis, unique_key='foo', **duplicate)
+    assert result[:2] == (stubs.job_id, JobStatus.QUEUED)
+    assert not (yield from redis.exists(job_key(stubs.child_job_id)))
+    assert (yield from jobs(redis, stubs.queue)) == [stubs.job_id.encode()]
+
+
+def test_enqueue_job_unique_ttl(redis):
+    """Unique key expires after given amount of seconds."""
+
+    yield from enqueue_job(redis=redis, unique_key='foo', unique_ttl=60,
+                           **stubs.job)
+    assert (yield from redis.ttl(unique_lock('foo'))) == 60
+
+
+def test_enqueue_job_unique_key_stale(redis):
+    """Take unique key over if holder job doesn't exist anymore."""
+
+    yield from redis.set(unique_lock('foo'), 'bar')
+    yield from enqueue_job(redis=redis, unique_key='foo', **stubs.job)
+    assert (yield from redis.get(unique_lock('foo'))) == stubs.job_id.encode()
+    assert (yield from jobs(redis, stubs.queue)) == [stubs.job_id.encode()]
+
+
+def test_enqueue_job_coalesce_key(redis):
+    """Enqueue job remember coalesced job id."""
+
+    yield from enqueue_job(redis=redis, coalesce_key='foo', **stubs.job)
+    coalesced = yield from redis.get(coalesced_job(stubs.queue, 'foo'))
+    assert coalesced == stubs.job_id.encode()
+
+
+def test_enqueue_job_coalesce_queued_job(redis):
+    """Replace data of the queued job with the same coalesce key."""
+
+    yield from enqueue_job(redis=redis, coalesce_key='foo', **stubs.job)
+    duplicate = dict(stubs.job, id=stubs.child_job_id, data=b'bar',
+                     description='baz')
+    result = yield from enqueue_job(redis=redis, coalesce_key='foo',
+                                    **duplicate)
+    assert result[:2] == (stubs.job_id, JobStatus.QUEUED)
+    assert (yield from jobs(redis, stubs.queue)) == [stubs.job_id.encode()]
+    assert not (yield from redis.exists(job_key(stubs.child_job_id)))
+    data, description = yield from redis.hmget(
+        job_key(stubs.job_id), 'data', 'description')
+    assert data == b'bar'
+    assert description == b'baz'
+
+
+def test_enqueue_job_coalesce_data_format(redis):
+    """Replace serializer and codec of the coalesced job data."""
+
+    yield from enqueue_job(redis=redis, coalesce_key='foo', codec='zlib',
+                           **stubs.job)
+    duplicate = dict(stubs.job, id=stubs.child_job_id, data=b'[]')
+    yield from enqueue_job(redis=redis, coalesce_key='foo',
+                           serializer='json', **duplicate)
+    serializer, codec = yield from redis.hmget(
+        job_key(stubs.job_id), 'serializer', 'codec')
+    assert serializer == b'json'
+    assert codec is None
+
+
+def test_enqueue_job_blobs(redis):
+    """Jobs share reference counted blobs of offloaded arguments."""
+
+    yield from enqueue_job(redis=redis, blobs={'foo': b'bar'}, **stubs.job)
+    yield from enqueue_job(redis=redis, blobs={'foo': b'bar'},
+                           **dict(stubs.job, id=stubs.child_job_id))
+    blob = yield from redis.hgetall(blob_key('foo'))
+    assert blob == {b'data': b'bar', b'refcount': b'2'}
+    assert (yield from redis.hget(job_key(stubs.job_id), 'blobs')) == b'foo'
+    assert (yield from fetch_blobs(redis, ['foo', 'baz'])) == {
+        'foo': b'bar', 'baz': None}
+
+
+def test_enqueue_job_blobs_unique_holder(redis):
+    """Blob reference isn't taken if the job isn't stored."""
+
+    yield from enqueue_job(redis=redis, unique_key='x', blobs={'foo': b'bar'},
+                           **stubs.job)
+    yield from enqueue_job(redis=redis, unique_key='x', blobs={'foo': b'bar'},
+                           **dict(stubs.job, id=stubs.child_job_id))
+    assert (yield from redis.hget(blob_key('foo'), 'refcount')) == b'1'
+
+
+def test_finish_job_releases_blobs(redis):
+    """Blob is deleted with the last finished job referring to it."""
+
+    yield from enqueue_job(redis=redis, blobs={'foo': b'bar'}, **stubs.job)
+    yield from enqueue_job(redis=redis, blobs={'foo': b'bar'},
+                           **dict(stubs.job, id=stubs.child_job_id))
+    yield from claim_job(redis, [stubs.queue])
+    yield from complete_job(redis, stubs.queue, stubs.job_id)
+    assert (yield from redis.hget(blob_key('foo'), 'refcount')) == b'1'
+    yield from cancel_job(redis, stubs.queue, stubs.child_job_id)
+    assert not (yield from redis.exists(blob_key('foo')))
+
+
+def test_enqueue_job_buffers(redis):
+    """Out-of-band buffers are stored in separate fields."""
+
+    yield from enqueue_job(redis=redis, buffers=[b'foo', b'bar'],
+                           **stubs.job)
+    fields = yield from redis.hmget(
+        job_key(stubs.job_id), 'buffers', 'buffer:0', 'buffer:1')
+    assert fields == [b'2', b'foo', b'bar']
+
+
+def test_enqueue_job_coalesce_buffers(redis):
+    """Replace out-of-band buffers of the coalesced job."""
+
+    yield from enqueue_job(redis=redis, coalesce_key='foo',
+                           buffers=[b'foo', b'bar'], **stubs.job)
+    duplicate = dict(stubs.job, id=stubs.child_job_id)
+    yield from enqueue_job(redis=redis, coalesce_key='foo', buffers=[b'baz'],
+                           **duplicate)
+    fields = yield from redis.hmget(
+        job_key(stubs.job_id), 'buffers', 'buffer:0', 'buffer:1')
+    assert fields == [b'1', b'baz', None]
+
+
+def test_enqueue_job_coalesce_started_job(redis):
+    """Enqueue new job if coalesced one was already dequeued."""
+
+    yield from enqueue_job(redis=redis, coalesce_key='foo', **stubs.job)
+    yield from dequeue_job(redis, stubs.queue)
+    duplicate = dict(stubs.job, id=stubs.child_job_id)
+    result = yield from enqueue_job(redis=redis, coalesce_key='foo',
+                                    **duplicate)
+    assert result[:2] == (stubs.child_job_id, JobStatus.QUEUED)
+    assert (yield from jobs(redis, stubs.queue)) == [stubs.child_job_id.encode()]
+
+
+def test_enqueue_job_coalesce_per_queue(redis):
+    """Coalesce keys are separate for different queues."""
+
+    yield from enqueue_job(redis=redis, coalesce_key='foo', **stubs.job)
+    duplicate = dict(stubs.job, id=stubs.child_job_id, queue='other')
+    result = yield from enqueue_job(redis=redis, coalesce_key='foo',
+                                    **duplicate)
+    assert result[0] == stubs.child_job_id
+    assert (yield from jobs(redis, 'other')) == [stubs.child_job_id.encode()]
+
+
+def test_enqueue_job_retry(redis):
+    """Enqueue job stores its retry policy."""
+
+    yield from enqueue_job(redis=redis, retry=(3, 10, 0.5), **stubs.job)
+    retry = yield from redis.hmget(job_key(stubs.job_id), 'retry_max',
+                                   'retry_backoff', 'retry_jitter')
+    assert retry == [b'3', b'10', b'0.5']
+
+
+def test_enqueue_job_ttl(redis):
+    """Enqueue job calculates expiration time from its TTL."""
+
+    yield from enqueue_job(redis=redis, ttl=43, **stubs.job)
+    ttl, expires_at = yield from redis.hmget(job_key(stubs.job_id), 'ttl',
+                                             'expires_at')
+    assert ttl == b'43'
+    assert int(expires_at) == current_timestamp() + 43
+
+
+def test_enqueue_job_hash_ttl(redis):
+    """Enqueue job sets expiration of the job hash."""
+
+    yield from enqueue_job(redis=redis, hash_ttl=100, **stubs.job)
+    assert (yield from redis.ttl(job_key(stubs.job_id))) == 100
+
+
+def test_enqueue_job_without_hash_ttl(redis):
+    """Job hash doesn't expire by default."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    assert (yield from redis.ttl(job_key(stubs.job_id))) == -1
+
+
 # TODO: enqueue_job checks dependency status, it isn't finished, then
 # another worker set it status to finished, then we defer job with
 # already finished dependency.  It will never be executed.
 
 
+# Broadcast values.
+
+
+def test_broadcast_values(redis):
+    """Store, fetch and delete broadcast values."""
+
+    yield from store_broadcast(redis, 'foo', b'bar')
+    yield from store_broadcast(redis, 'baz', b'quux', ttl=10)
+    assert (yield from fetch_broadcasts(redis, ['foo', 'baz', 'x'])) == {
+        'foo': b'bar', 'baz': b'quux', 'x': None}
+    yield from delete_broadcast(redis, 'foo')
+    assert (yield from fetch_broadcasts(redis, ['foo'])) == {'foo': None}
+
+
 # Dequeue job.
 
 
@@ -325,6 +611,384 @@ def test_dequeue_job_no_such_job(redis):
     assert stored_id == stubs.job_id.encode()
 
 
+def test_dequeue_job_promotes_scheduled_jobs(redis):
+    """Move due scheduled jobs into the queue."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from dequeue_job(redis, stubs.queue)
+    yield from redis.zadd(scheduled_registry(stubs.queue),
+                          current_timestamp() - 1, stubs.job_id)
+    stored_id, stored_spec = yield from dequeue_job(redis, stubs.queue)
+    assert stored_id == stubs.job_id.encode()
+    assert stored_spec[b'status'] == JobStatus.QUEUED.encode()
+    assert not (yield from scheduled_jobs(redis, stubs.queue))
+
+
+def test_dequeue_job_keeps_future_scheduled_jobs(redis):
+    """Scheduled job stays in the registry until its time comes."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from dequeue_job(redis, stubs.queue)
+    yield from redis.zadd(scheduled_registry(stubs.queue),
+                          current_timestamp() + 100, stubs.job_id)
+    assert (yield from dequeue_job(redis, stubs.queue)) == (None, {})
+    assert (yield from scheduled_jobs(redis, stubs.queue)) == [stubs.job_id.encode()]
+
+
+def test_dequeue_job_promote_limit(redis):
+    """Promote limited number of scheduled jobs at once."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from enqueue_job(redis=redis, **dict(stubs.job, id=stubs.child_job_id))
+    yield from dequeue_job(redis, stubs.queue)
+    yield from dequeue_job(redis, stubs.queue)
+    score = current_timestamp() - 1
+    yield from redis.zadd(scheduled_registry(stubs.queue), score, stubs.job_id)
+    yield from redis.zadd(scheduled_registry(stubs.queue), score, stubs.child_job_id)
+    yield from dequeue_job(redis, stubs.queue, promote=1)
+    assert (yield from queue_length(redis, stubs.queue)) == 0
+    assert len((yield from scheduled_jobs(redis, stubs.queue))) == 1
+
+
+def test_dequeue_job_skip_expired_jobs(redis):
+    """Skip and remove jobs with expired TTL."""
+
+    yield from enqueue_job(redis=redis, ttl=43, **stubs.job)
+    yield from redis.hset(job_key(stubs.job_id), 'expires_at',
+                          current_timestamp() - 1)
+    yield from enqueue_job(redis=redis, **dict(stubs.job, id=stubs.child_job_id))
+    stored_id, stored_spec = yield from dequeue_job(redis, stubs.queue)
+    assert stored_id == stubs.child_job_id.encode()
+    assert not (yield from redis.exists(job_key(stubs.job_id)))
+
+
+def test_dequeue_job_keeps_alive_jobs(redis):
+    """Job with TTL left is dequeued as usual."""
+
+    yield from enqueue_job(redis=redis, ttl=43, **stubs.job)
+    stored_id, stored_spec = yield from dequeue_job(redis, stubs.queue)
+    assert stored_id == stubs.job_id.encode()
+
+
+def test_dequeue_job_counts_expired_jobs(redis):
+    """Count jobs discarded because of expired TTL."""
+
+    for id in [stubs.job_id, stubs.child_job_id]:
+        yield from enqueue_job(redis=redis, ttl=43, **dict(stubs.job, id=id))
+        yield from redis.hset(job_key(id), 'expires_at',
+                              current_timestamp() - 1)
+    assert (yield from dequeue_job(redis, stubs.queue)) == (None, {})
+    assert (yield from expired_count(redis, stubs.queue)) == 2
+    assert (yield from redis.get(expired_counter(stubs.queue))) == b'2'
+
+
+def test_dequeue_job_discard_limit(redis):
+    """Discard expired jobs in batches until alive job is found."""
+
+    for id in [stubs.job_id, stubs.child_job_id]:
+        yield from enqueue_job(redis=redis, ttl=43, **dict(stubs.job, id=id))
+        yield from redis.hset(job_key(id), 'expires_at',
+                              current_timestamp() - 1)
+    yield from enqueue_job(redis=redis, **dict(stubs.job, id='foo'))
+    stored_id, stored_spec = yield from dequeue_job(redis, stubs.queue,
+                                                    discard=1)
+    assert stored_id == b'foo'
+    assert (yield from expired_count(redis, stubs.queue)) == 2
+
+
+def test_dequeue_job_expired_releases_unique_key(redis):
+    """Expired job releases its unique key."""
+
+    yield from enqueue_job(redis=redis, ttl=43, unique_key='foo', **stubs.job)
+    yield from redis.hset(job_key(stubs.job_id), 'expires_at',
+                          current_timestamp() - 1)
+    yield from dequeue_job(redis, stubs.queue)
+    assert not (yield from redis.exists(unique_lock('foo')))
+
+
+def test_dequeue_job_expired_cancels_dependents(redis):
+    """Dependents of expired job are canceled."""
+
+    yield from enqueue_job(redis=redis, ttl=43, **stubs.job)
+    yield from enqueue_job(redis=redis, **stubs.child_job)
+    yield from redis.hset(job_key(stubs.job_id), 'expires_at',
+                          current_timestamp() - 1)
+    yield from dequeue_job(redis, stubs.queue)
+    assert (yield from job_status(redis, stubs.child_job_id)) == JobStatus.CANCELED.encode()
+    assert not (yield from deferred_jobs(redis, stubs.queue))
+
+
+def test_dequeue_job_expired_releases_traceback(redis):
+    """Expired retried job releases its traceback."""
+
+    yield from enqueue_job(redis=redis, ttl=43, **stubs.job)
+    yield from redis.hmset(job_key(stubs.job_id), 'exc_hash', 'foo',
+                           'expires_at', current_timestamp() - 1)
+    yield from redis.hmset(traceback_key('foo'), 'exc_info', 'bar',
+                           'refcount', 1)
+    yield from dequeue_job(redis, stubs.queue)
+    assert not (yield from redis.exists(traceback_key('foo')))
+
+
+def test_dequeue_job_release_coalesce_key(redis):
+    """Dequeued job doesn't absorb coalesced enqueues anymore."""
+
+    yield from enqueue_job(redis=redis, coalesce_key='foo', **stubs.job)
+    yield from dequeue_job(redis, stubs.queue)
+    assert not (yield from redis.exists(coalesced_job(stubs.queue, 'foo')))
+
+
+def test_dequeue_job_paused_queue(redis):
+    """Nothing is dequeued from paused queue."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from pause_queue(redis, stubs.queue)
+    assert (yield from dequeue_job(redis, stubs.queue)) == (None, {})
+    assert (yield from jobs(redis, stubs.queue)) == [stubs.job_id.encode()]
+
+
+# Compact queue.
+
+
+def test_compact_queue(redis):
+    """Remove canceled and missing jobs keeping order of others."""
+
+    for id in ['foo', 'bar', 'baz', 'qux']:
+        yield from enqueue_job(redis=redis, **dict(stubs.job, id=id))
+    yield from cancel_job(redis, stubs.queue, 'bar')
+    yield from redis.delete(job_key('baz'))
+    assert (yield from compact_queue(redis, stubs.queue)) == (0, 2)
+    assert (yield from queued_jobs(redis, stubs.queue)) == [b'foo', b'qux']
+    assert (yield from queue_length(redis, stubs.queue)) == 2
+    assert not (yield from redis.exists(canceled_jobs(stubs.queue)))
+
+
+def test_compact_queue_dequeue(redis):
+    """Dequeue skips compacted entries."""
+
+    for id in ['foo', 'bar', 'baz']:
+        yield from enqueue_job(redis=redis, **dict(stubs.job, id=id))
+    yield from cancel_job(redis, stubs.queue, 'bar')
+    yield from compact_queue(redis, stubs.queue)
+    stored_id, stored_spec = yield from dequeue_job(redis, stubs.queue)
+    assert stored_id == b'foo'
+    stored_id, stored_spec = yield from dequeue_job(redis, stubs.queue)
+    assert stored_id == b'baz'
+    assert not (yield from queue_length(redis, stubs.queue))
+    assert not (yield from redis.exists(compacted_entries(stubs.queue)))
+
+
+def test_compact_queue_drop_ends(redis):
+    """Compacted entries at the queue ends are dropped."""
+
+    for id in ['foo', 'bar', 'baz']:
+        yield from enqueue_job(redis=redis, **dict(stubs.job, id=id))
+    yield from cancel_job(redis, stubs.queue, 'foo')
+    yield from cancel_job(redis, stubs.queue, 'baz')
+    assert (yield from compact_queue(redis, stubs.queue)) == (0, 2)
+    assert (yield from jobs(redis, stubs.queue)) == [b'bar']
+    assert not (yield from redis.exists(compacted_entries(stubs.queue)))
+
+
+def test_compact_queue_offset(redis):
+    """Continue compaction from returned offset."""
+
+    for id in ['foo', 'bar', 'baz', 'qux']:
+        yield from enqueue_job(redis=redis, **dict(stubs.job, id=id))
+    yield from cancel_job(redis, stubs.queue, 'bar')
+    yield from cancel_job(redis, stubs.queue, 'qux')
+    offset, removed = yield from compact_queue(redis, stubs.queue, limit=2)
+    assert (offset, removed) == (2, 1)
+    offset, removed = yield from compact_queue(redis, stubs.queue, offset,
+                                               limit=2)
+    assert (offset, removed) == (4, 1)
+    offset, removed = yield from compact_queue(redis, stubs.queue, offset,
+                                               limit=2)
+    assert (offset, removed) == (0, 0)
+    assert (yield from queued_jobs(redis, stubs.queue)) == [b'foo', b'baz']
+
+
+# Pause queue.
+
+
+def test_pause_queue(redis):
+    """Pause and resume queue."""
+
+    assert not (yield from queue_paused(redis, stubs.queue))
+    yield from pause_queue(redis, stubs.queue)
+    assert (yield from queue_paused(redis, stubs.queue))
+    yield from resume_queue(redis, stubs.queue)
+    assert not (yield from queue_paused(redis, stubs.queue))
+
+
+# Claim job.
+
+
+def test_claim_job_from_empty_queues(redis):
+    """Claim nothing from empty queues."""
+
+    assert (yield from claim_job(redis, ['foo', 'bar'])) == (None, None, {})
+
+
+def test_claim_job(redis):
+    """Claim job from the first non empty queue and start it."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    queue, job_id, spec = yield from claim_job(redis, ['foo', stubs.queue])
+    assert queue == stubs.queue
+    assert job_id == stubs.job_id
+    assert spec[b'status'] == JobStatus.STARTED.encode()
+    assert spec[b'started_at'] == utcformat(utcnow()).encode()
+    assert spec[b'attempts'] == b'1'
+    assert not (yield from jobs(redis, stubs.queue))
+    score = current_timestamp() + stubs.job['timeout'] + 60
+    started = yield from redis.zrange(started_registry(stubs.queue),
+                                      withscores=True)
+    assert started == [stubs.job_id.encode(), score]
+
+
+def test_claim_job_with_lease(redis):
+    """Claimed job stays in started registry until its lease expires."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from claim_job(redis, [stubs.queue], lease=30)
+    score = yield from redis.zscore(started_registry(stubs.queue),
+                                    stubs.job_id)
+    assert score == current_timestamp() + 30
+
+
+def test_claim_job_persist_job(redis):
+    """Claimed job hash doesn't expire during execution."""
+
+    yield from enqueue_job(redis=redis, hash_ttl=100, **stubs.job)
+    yield from claim_job(redis, [stubs.queue])
+    assert (yield from redis.ttl(job_key(stubs.job_id))) == -1
+
+
+def test_claim_job_skip_expired_jobs(redis):
+    """Expired jobs are discarded as in dequeue."""
+
+    yield from enqueue_job(redis=redis, ttl=43, **stubs.job)
+    yield from redis.hset(job_key(stubs.job_id), 'expires_at',
+                          current_timestamp() - 1)
+    assert (yield from claim_job(redis, [stubs.queue])) == (None, None, {})
+    assert (yield from expired_count(redis, stubs.queue)) == 1
+
+
+def test_claim_job_skip_paused_queues(redis):
+    """Claim job from the next queue if the first one is paused."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from enqueue_job(redis=redis, **dict(stubs.job, queue='foo',
+                                               id='bar'))
+    yield from pause_queue(redis, 'foo')
+    queue, job_id, spec = yield from claim_job(redis, ['foo', stubs.queue])
+    assert (queue, job_id) == (stubs.queue, stubs.job_id)
+
+
+def test_claim_job_suspended(redis):
+    """Suspended workers can't claim jobs."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from redis.set(workers_suspended(), 1)
+    with pytest.raises(WorkersSuspendedError):
+        yield from claim_job(redis, [stubs.queue])
+    assert (yield from jobs(redis, stubs.queue)) == [stubs.job_id.encode()]
+
+
+# Complete job.
+
+
+def test_complete_job_finished(redis):
+    """Complete job with result."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from claim_job(redis, [stubs.queue])
+    status = yield from complete_job(redis, stubs.queue, stubs.job_id,
+                                     result=b'foo')
+    assert status == JobStatus.FINISHED
+    assert not (yield from started_jobs(redis, stubs.queue))
+    assert (yield from finished_jobs(redis, stubs.queue)) == [stubs.job_id.encode()]
+    assert (yield from redis.hget(job_key(stubs.job_id), 'result')) == b'foo'
+    assert (yield from redis.ttl(job_key(stubs.job_id))) == 500
+
+
+def test_complete_job_zero_result_ttl(redis):
+    """Job without result TTL is removed along with its started
+    registry entry.
+    """
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from claim_job(redis, [stubs.queue])
+    yield from complete_job(redis, stubs.queue, stubs.job_id,
+                            result=b'foo', result_ttl=0)
+    assert not (yield from redis.exists(job_key(stubs.job_id)))
+    assert not (yield from started_jobs(redis, stubs.queue))
+
+
+def test_complete_job_enqueue_dependents(redis):
+    """Completed job enqueues its dependents."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from enqueue_job(redis=redis, **stubs.child_job)
+    yield from claim_job(redis, [stubs.queue])
+    yield from complete_job(redis, stubs.queue, stubs.job_id, result=b'foo')
+    assert (yield from jobs(redis, stubs.queue)) == [stubs.child_job_id.encode()]
+    assert not (yield from deferred_jobs(redis, stubs.queue))
+    assert not (yield from redis.exists(dependents(stubs.job_id)))
+
+
+def test_complete_job_failed(redis):
+    """Complete job with exception information."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from claim_job(redis, [stubs.queue])
+    status = yield from complete_job(redis, stubs.queue, stubs.job_id,
+                                     exc_info=stubs.job_exc_info)
+    assert status == JobStatus.FAILED
+    assert not (yield from started_jobs(redis, stubs.queue))
+    assert (yield from failed_jobs(redis)) == [stubs.job_id.encode()]
+
+
+def test_complete_job_failed_without_failed_queue(redis):
+    """Complete failed job kept out of the failed queue by exception
+    handlers."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from claim_job(redis, [stubs.queue])
+    status = yield from complete_job(redis, stubs.queue, stubs.job_id,
+                                     exc_info=stubs.job_exc_info,
+                                     failed_queue=False)
+    assert status == JobStatus.FAILED
+    assert (yield from job_status(redis, stubs.job_id)) == JobStatus.FAILED.encode()
+    assert not (yield from started_jobs(redis, stubs.queue))
+    assert not (yield from failed_jobs(redis))
+
+
+def test_complete_job_lost_lease(redis):
+    """Job reclaimed after its lease expired isn't completed by its
+    late worker."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from claim_job(redis, [stubs.queue], lease=-1)
+    yield from clean_started_jobs(redis, stubs.queue)
+    status = yield from complete_job(redis, stubs.queue, stubs.job_id,
+                                     result=b'foo')
+    assert status is None
+    assert (yield from job_status(redis, stubs.job_id)) == JobStatus.FAILED.encode()
+    assert (yield from failed_jobs(redis)) == [stubs.job_id.encode()]
+    assert not (yield from finished_jobs(redis, stubs.queue))
+
+
+# Expired count.
+
+
+def test_expired_count_empty(redis):
+    """Expired count is zero if nothing has expired yet."""
+
+    assert (yield from expired_count(redis, stubs.queue)) == 0
+
+
 # Cancel job.
 
 
@@ -336,6 +1000,289 @@ def test_cancel_job(redis):
     assert not (yield from queue_length(redis, stubs.queue))
 
 
+def test_cancel_failed_job(redis):
+    """Cancel failed job removes it from the failed job indexes."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info,
+                        exc_type='ValueError', exc_hash='foo')
+    yield from cancel_job(redis, stubs.queue, stubs.job_id)
+    assert not (yield from failed_count(redis))
+    assert not (yield from failed_count(redis, exc_type='ValueError'))
+    assert not (yield from failure_summary(redis))
+    assert not (yield from redis.exists(traceback_key('foo')))
+
+
+def test_cancel_job_removes_job_hash(redis):
+    """Cancel job removes job hash."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from cancel_job(redis, stubs.queue, stubs.job_id)
+    assert not (yield from redis.exists(job_key(stubs.job_id)))
+
+
+def test_cancel_job_removes_dependents(redis):
+    """Cancel job removes its dependents set."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from enqueue_job(redis=redis, **stubs.child_job)
+    yield from cancel_job(redis, stubs.queue, stubs.job_id)
+    assert not (yield from redis.exists(dependents(stubs.job_id)))
+
+
+def test_cancel_job_cancels_dependents(redis):
+    """Deferred dependents of canceled job and their own dependents
+    are canceled."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from enqueue_job(redis=redis, **stubs.child_job)
+    yield from enqueue_job(redis=redis, **dict(
+        stubs.child_job, id='foo', dependency_id=stubs.child_job_id))
+    yield from cancel_job(redis, stubs.queue, stubs.job_id)
+    for id in [stubs.child_job_id, 'foo']:
+        assert (yield from job_status(redis, id)) == JobStatus.CANCELED.encode()
+        assert (yield from redis.ttl(job_key(id))) > 0
+    assert not (yield from deferred_jobs(redis, stubs.queue))
+    assert not (yield from redis.exists(dependents(stubs.child_job_id)))
+
+
+def test_cancel_job_releases_unique_key(redis):
+    """Cancel job releases its unique key."""
+
+    yield from enqueue_job(redis=redis, unique_key='foo', **stubs.job)
+    yield from cancel_job(redis, stubs.queue, stubs.job_id)
+    assert not (yield from redis.exists(unique_lock('foo')))
+
+
+def test_cancel_job_marks_queued_job(redis):
+    """Canceled job id is left in the queue list as a tombstone."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from cancel_job(redis, stubs.queue, stubs.job_id)
+    assert (yield from jobs(redis, stubs.queue)) == [stubs.job_id.encode()]
+    assert (yield from redis.smembers(canceled_jobs(stubs.queue))) == [stubs.job_id.encode()]
+    assert not (yield from queued_jobs(redis, stubs.queue))
+
+
+def test_cancel_job_dequeue_discards_tombstone(redis):
+    """Canceled job is never dequeued, even if enqueued again."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from cancel_job(redis, stubs.queue, stubs.job_id)
+    yield from enqueue_job(redis=redis, **stubs.job)
+    stored_id, stored_spec = yield from dequeue_job(redis, stubs.queue)
+    assert stored_id == stubs.job_id.encode()
+    assert not (yield from jobs(redis, stubs.queue))
+    assert not (yield from redis.exists(canceled_jobs(stubs.queue)))
+
+
+def test_cancel_job_uses_job_origin(redis):
+    """Canceled job tombstone goes to its origin queue regardless of
+    queue name given."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from cancel_job(redis, 'other', stubs.job_id)
+    assert not (yield from queue_length(redis, stubs.queue))
+    assert (yield from redis.smembers(canceled_jobs(stubs.queue))) == [stubs.job_id.encode()]
+    assert not (yield from redis.exists(canceled_jobs('other')))
+
+
+def test_cancel_deferred_job(redis):
+    """Cancel job removes it from the deferred registry."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from enqueue_job(redis=redis, **stubs.child_job)
+    yield from cancel_job(redis, stubs.queue, stubs.child_job_id)
+    assert not (yield from deferred_jobs(redis, stubs.queue))
+    assert not (yield from redis.exists(canceled_jobs(stubs.queue)))
+
+
+def test_cancel_running_job(redis):
+    """Running job is marked as canceled and stays in the started
+    registry until its worker stops it.
+    """
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from claim_job(redis, [stubs.queue])
+    yield from cancel_job(redis, stubs.queue, stubs.job_id)
+    assert (yield from job_status(redis, stubs.job_id)) == JobStatus.CANCELED.encode()
+    assert (yield from started_jobs(redis, stubs.queue)) == [stubs.job_id.encode()]
+
+
+def test_cancel_canceled_running_job(redis):
+    """Repeated cancellation of running job keeps its hash."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from claim_job(redis, [stubs.queue])
+    yield from cancel_job(redis, stubs.queue, stubs.job_id)
+    yield from cancel_job(redis, stubs.queue, stubs.job_id)
+    assert (yield from job_status(redis, stubs.job_id)) == JobStatus.CANCELED.encode()
+    assert (yield from started_jobs(redis, stubs.queue)) == [stubs.job_id.encode()]
+
+
+def test_complete_canceled_job(redis):
+    """Stopped canceled job isn't retried or moved to failed queue."""
+
+    yield from enqueue_job(redis=redis, retry=(3, 10, 0), unique_key='foo',
+                           **stubs.job)
+    yield from claim_job(redis, [stubs.queue])
+    yield from cancel_job(redis, stubs.queue, stubs.job_id)
+    status = yield from complete_job(redis, stubs.queue, stubs.job_id,
+                                     exc_info=stubs.job_exc_info)
+    assert status == JobStatus.CANCELED
+    assert not (yield from started_jobs(redis, stubs.queue))
+    assert not (yield from scheduled_jobs(redis, stubs.queue))
+    assert not (yield from failed_jobs(redis))
+    assert not (yield from redis.exists(unique_lock('foo')))
+    assert (yield from redis.ttl(job_key(stubs.job_id))) == 500
+
+
+def test_finish_canceled_job(redis):
+    """Canceled job finished by its worker keeps canceled status and
+    its dependents aren't enqueued."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from enqueue_job(redis=redis, **stubs.child_job)
+    yield from claim_job(redis, [stubs.queue])
+    yield from cancel_job(redis, stubs.queue, stubs.job_id)
+    status = yield from complete_job(redis, stubs.queue, stubs.job_id,
+                                     result=b'foo')
+    assert status == JobStatus.CANCELED
+    assert (yield from job_status(redis, stubs.job_id)) == JobStatus.CANCELED.encode()
+    assert not (yield from started_jobs(redis, stubs.queue))
+    assert not (yield from finished_jobs(redis, stubs.queue))
+    assert not (yield from jobs(redis, stubs.queue))
+    assert (yield from job_status(redis, stubs.child_job_id)) == JobStatus.CANCELED.encode()
+
+
+# Sweep jobs.
+
+
+def test_sweep_jobs_without_status(redis):
+    """Sweep job hashes without status."""
+
+    yield from redis.hset(job_key(stubs.job_id), 'foo', 'bar')
+    cursor, deleted = yield from sweep_jobs(redis)
+    assert cursor == 0
+    assert deleted == 1
+    assert not (yield from redis.exists(job_key(stubs.job_id)))
+
+
+def test_sweep_jobs_missing_from_registry(redis):
+    """Sweep started job missing from the started registry."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    yield from redis.zrem(started_registry(stubs.queue), stubs.job_id)
+    yield from sweep_jobs(redis)
+    assert not (yield from redis.exists(job_key(stubs.job_id)))
+
+
+def test_sweep_jobs_keeps_registered_jobs(redis):
+    """Jobs present in their registry are kept."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    yield from sweep_jobs(redis)
+    assert (yield from redis.exists(job_key(stubs.job_id)))
+
+
+def test_sweep_jobs_failed(redis):
+    """Sweep failed job missing from the failed registry."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info)
+    yield from sweep_jobs(redis)
+    assert (yield from redis.exists(job_key(stubs.job_id)))
+    yield from redis.zrem(failed_registry(), stubs.job_id)
+    yield from sweep_jobs(redis)
+    assert not (yield from redis.exists(job_key(stubs.job_id)))
+
+
+def test_sweep_jobs_keeps_queued_jobs(redis):
+    """Queued jobs are never swept."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from redis.lrem(queue_key(stubs.queue), 1, stubs.job_id)
+    cursor, deleted = yield from sweep_jobs(redis)
+    assert not deleted
+    assert (yield from redis.exists(job_key(stubs.job_id)))
+
+
+def test_sweep_jobs_keeps_expiring_hashes(redis):
+    """Hashes with TTL will expire by themselves."""
+
+    yield from redis.hset(job_key(stubs.job_id), 'foo', 'bar')
+    yield from redis.expire(job_key(stubs.job_id), 100)
+    yield from sweep_jobs(redis)
+    assert (yield from redis.exists(job_key(stubs.job_id)))
+
+
+def test_sweep_jobs_releases_traceback(redis):
+    """Swept job hash releases its traceback."""
+
+    yield from redis.hmset(job_key(stubs.job_id), 'status', 'scheduled',
+                           'origin', stubs.queue, 'exc_hash', 'foo')
+    yield from redis.hmset(traceback_key('foo'), 'exc_info', 'bar',
+                           'refcount', 1)
+    yield from sweep_jobs(redis)
+    assert not (yield from redis.exists(traceback_key('foo')))
+
+
+def test_sweep_jobs_orphan_dependents(redis):
+    """Sweep dependents sets of the missing jobs."""
+
+    yield from redis.sadd(dependents(stubs.job_id), stubs.child_job_id)
+    yield from sweep_jobs(redis)
+    assert not (yield from redis.exists(dependents(stubs.job_id)))
+
+
+def test_sweep_jobs_orphan_dependents_canceled(redis):
+    """Deferred dependents of the missing jobs are canceled."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from enqueue_job(redis=redis, **stubs.child_job)
+    yield from redis.delete(job_key(stubs.job_id))
+    yield from sweep_jobs(redis)
+    assert (yield from job_status(redis, stubs.child_job_id)) == JobStatus.CANCELED.encode()
+    assert not (yield from deferred_jobs(redis, stubs.queue))
+
+
+def test_sweep_jobs_keeps_foreign_keys(redis):
+    """Sweep touches job hashes only."""
+
+    yield from redis.set('foo', 'bar')
+    yield from sweep_jobs(redis)
+    assert (yield from redis.exists('foo'))
+
+
+# Sweep blobs.
+
+
+def test_sweep_blobs(redis):
+    """Blob references of vanished jobs are dropped."""
+
+    yield from enqueue_job(redis=redis, blobs={'foo': b'bar'}, **stubs.job)
+    yield from enqueue_job(redis=redis, blobs={'foo': b'bar'},
+                           **dict(stubs.job, id=stubs.child_job_id))
+    yield from redis.delete(job_key(stubs.job_id))
+    cursor, deleted = yield from sweep_blobs(redis)
+    assert (cursor, deleted) == (0, 0)
+    assert (yield from redis.hget(blob_key('foo'), 'refcount')) == b'1'
+    yield from redis.delete(job_key(stubs.child_job_id))
+    cursor, deleted = yield from sweep_blobs(redis)
+    assert (cursor, deleted) == (0, 1)
+    assert not (yield from redis.keys(blob_key('*')))
+
+
+def test_sweep_blobs_with_lost_maintenance_lease(redis):
+    """Blobs aren't swept without maintenance lease."""
+
+    yield from enqueue_job(redis=redis, blobs={'foo': b'bar'}, **stubs.job)
+    with pytest.raises(InvalidOperationError):
+        yield from sweep_blobs(redis, lease='foo')
+
+
 # Start job.
 
 
@@ -378,6 +1325,15 @@ def test_start_job_add_job_to_registry(redis):
     assert started == [stubs.job_id.encode(), score]
 
 
+def test_start_job_counts_attempts(redis):
+    """Start job increments job attempts counter."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    assert (yield from redis.hget(job_key(stubs.job_id), 'attempts')) == b'2'
+
+
 def test_start_job_persist_job(redis):
     """Start job set persistence to the job hash during job execution."""
 
@@ -391,6 +1347,47 @@ def test_start_job_persist_job(redis):
     assert (yield from redis.ttl(job_key(stubs.job_id))) == -1
 
 
+def test_start_job_with_lease(redis):
+    """Leased job stays in started registry until its lease expires."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 3600, lease=30)
+    score = current_timestamp() + 30
+    started = yield from redis.zrange(started_registry(stubs.queue),
+                                      withscores=True)
+    assert started == [stubs.job_id.encode(), score]
+
+
+# Renew job leases.
+
+
+def test_renew_job_leases(redis):
+    """Renew leases of the jobs from different queues at once."""
+
+    yield from redis.zadd(started_registry('foo'), 1, 'x')
+    yield from redis.zadd(started_registry('bar'), 1, 'y')
+    yield from renew_job_leases(redis, [('foo', 'x'), ('bar', 'y')], 30)
+    score = current_timestamp() + 30
+    assert (yield from redis.zscore(started_registry('foo'), 'x')) == score
+    assert (yield from redis.zscore(started_registry('bar'), 'y')) == score
+
+
+def test_renew_job_leases_reclaimed(redis):
+    """Reclaimed jobs aren't returned to the started registry."""
+
+    yield from renew_job_leases(redis, [(stubs.queue, stubs.job_id)], 30)
+    assert not (yield from started_jobs(redis, stubs.queue))
+
+
+def test_clean_started_jobs_expired_lease(redis):
+    """Jobs with expired lease are reclaimed regardless of timeout."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 3600, lease=-1)
+    assert (yield from clean_started_jobs(redis, stubs.queue)) == 1
+    assert (yield from job_status(redis, stubs.job_id)) == JobStatus.FAILED.encode()
+
+
 # Finish job.
 
 
@@ -532,6 +1529,16 @@ def test_finish_job_enqueue_dependents(redis):
     assert (yield from redis.lrange(queue_key(stubs.queue), 0, -1)) == [stubs.child_job_id.encode()]
 
 
+def test_finish_job_dependents_register_queue(redis):
+    """Dependents origin queue is registered by its name."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from enqueue_job(redis=redis, **dict(stubs.child_job, queue='foo'))
+    yield from claim_job(redis, [stubs.queue])
+    yield from complete_job(redis, stubs.queue, stubs.job_id)
+    assert set((yield from queues(redis))) == {stubs.queue.encode(), b'foo'}
+
+
 def test_finish_job_enqueue_dependents_status(redis):
     """Finish job will set dependents status to QUEUED."""
 
@@ -589,21 +1596,67 @@ def test_finish_job_dependents_defered_registry(redis):
     assert not (yield from deferred_jobs(redis, queue))
 
 
+def test_finish_job_releases_unique_key(redis):
+    """Finish job releases its unique key."""
+
+    yield from enqueue_job(redis=redis, unique_key='foo', **stubs.job)
+    stored_id, stored_spec = yield from dequeue_job(redis, stubs.queue)
+    stored_id = stored_id.decode()
+    queue = stored_spec[b'origin'].decode()
+    timeout = stored_spec[b'timeout']
+    yield from start_job(redis, queue, stored_id, timeout)
+    yield from finish_job(redis, queue, stored_id)
+    assert not (yield from redis.exists(unique_lock('foo')))
+
+
+def test_finish_job_keeps_foreign_unique_key(redis):
+    """Finish job doesn't release unique key taken by another job."""
+
+    yield from enqueue_job(redis=redis, unique_key='foo', **stubs.job)
+    yield from redis.set(unique_lock('foo'), 'bar')
+    yield from finish_job(redis, stubs.queue, stubs.job_id)
+    assert (yield from redis.get(unique_lock('foo'))) == b'bar'
+
+
 # Fail job.
 
 
-def test_fail_job_registers_failed_queue(redis):
-    """Register failed queue on quarantine job."""
+def test_fail_job_doesnt_register_failed_queue(redis):
+    """Failed jobs aren't stored in the queue."""
 
     yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info)
-    assert (yield from queues(redis)) == [failed_queue_key().encode()]
+    assert not (yield from queues(redis))
 
 
 def test_fail_job_enqueue_into_faileld_queue(redis):
-    """Failed job appears in the failed queue."""
+    """Failed job appears in the failed registry."""
+
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info)
+    assert stubs.job_id.encode() in (yield from failed_jobs(redis))
+
+
+def test_fail_job_indexes(redis):
+    """Failed job is indexed by origin and exception type."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info,
+                        exc_type='ValueError')
+    assert (yield from failed_jobs(redis, origin=stubs.queue)) == [
+        stubs.job_id.encode()]
+    assert (yield from failed_jobs(redis, exc_type='ValueError')) == [
+        stubs.job_id.encode()]
+    assert not (yield from failed_jobs(redis, exc_type='KeyError'))
+    assert (yield from redis.hget(job_key(stubs.job_id), 'exc_type')) == b'ValueError'
 
+
+def test_fail_job_without_exc_type(redis):
+    """Failed job without exception type is indexed by origin only."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
     yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info)
-    assert stubs.job_id.encode() in (yield from jobs(redis, 'failed'))
+    assert (yield from failed_count(redis)) == 1
+    assert (yield from failed_count(redis, origin=stubs.queue)) == 1
+    assert not (yield from failed_count(redis, exc_type=''))
 
 
 def test_fail_job_set_status(redis):
@@ -643,6 +1696,375 @@ def test_fail_job_removes_from_started_registry(redis):
     assert stubs.job_id.encode() not in (yield from started_jobs(redis, queue))
 
 
+def test_fail_job_releases_unique_key(redis):
+    """Failed job releases its unique key."""
+
+    yield from enqueue_job(redis=redis, unique_key='foo', **stubs.job)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info)
+    assert not (yield from redis.exists(unique_lock('foo')))
+
+
+def test_fail_job_returns_status(redis):
+    """Fail job returns resulting job status."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    status = yield from fail_job(redis, stubs.queue, stubs.job_id,
+                                 stubs.job_exc_info)
+    assert status == JobStatus.FAILED
+
+
+def test_fail_job_schedule_retry(redis):
+    """Failed job with attempts left is scheduled for retry."""
+
+    yield from enqueue_job(redis=redis, retry=(3, 10, 0), **stubs.job)
+    yield from dequeue_job(redis, stubs.queue)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    status = yield from fail_job(redis, stubs.queue, stubs.job_id,
+                                 stubs.job_exc_info)
+    assert status == JobStatus.SCHEDULED
+    assert (yield from job_status(redis, stubs.job_id)) == JobStatus.SCHEDULED.encode()
+    assert not (yield from failed_jobs(redis))
+    assert not (yield from started_jobs(redis, stubs.queue))
+    scheduled = yield from redis.zrange(scheduled_registry(stubs.queue),
+                                        withscores=True)
+    assert scheduled == [stubs.job_id.encode(), current_timestamp() + 10]
+
+
+def test_fail_job_retry_backoff(redis):
+    """Retry delay doubles after each failed attempt."""
+
+    yield from enqueue_job(redis=redis, retry=(3, 10, 0), **stubs.job)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info)
+    scheduled = yield from redis.zrange(scheduled_registry(stubs.queue),
+                                        withscores=True)
+    assert scheduled == [stubs.job_id.encode(), current_timestamp() + 20]
+
+
+def test_fail_job_retry_jitter(redis):
+    """Retry delay is increased by random jitter."""
+
+    yield from enqueue_job(redis=redis, retry=(3, 10, 1), **stubs.job)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info)
+    _, score = yield from redis.zrange(scheduled_registry(stubs.queue),
+                                       withscores=True)
+    assert current_timestamp() + 10 <= score <= current_timestamp() + 20
+
+
+def test_fail_job_retries_exhausted(redis):
+    """Job goes to the failed queue after last attempt."""
+
+    yield from enqueue_job(redis=redis, retry=(2, 10, 0), **stubs.job)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    status = yield from fail_job(redis, stubs.queue, stubs.job_id,
+                                 stubs.job_exc_info)
+    assert status == JobStatus.FAILED
+    assert stubs.job_id.encode() in (yield from failed_jobs(redis))
+    assert not (yield from scheduled_jobs(redis, stubs.queue))
+
+
+def test_fail_job_retry_keeps_unique_key(redis):
+    """Unique key is held by the job while it has attempts left."""
+
+    yield from enqueue_job(redis=redis, unique_key='foo', retry=(3, 10, 0),
+                           **stubs.job)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info)
+    assert (yield from redis.get(unique_lock('foo'))) == stubs.job_id.encode()
+
+
+# Quarantine job.
+
+
+def test_quarantine_job_ignores_retry(redis):
+    """Quarantined job goes to failed queue with attempts left."""
+
+    yield from enqueue_job(redis=redis, retry=(3, 10, 0), **stubs.job)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    assert (yield from quarantine_job(redis, stubs.queue, stubs.job_id,
+                                      stubs.job_exc_info))
+    assert (yield from job_status(redis, stubs.job_id)) == JobStatus.FAILED.encode()
+    assert (yield from failed_jobs(redis)) == [stubs.job_id.encode()]
+    assert not (yield from scheduled_jobs(redis, stubs.queue))
+    assert not (yield from started_jobs(redis, stubs.queue))
+
+
+def test_quarantine_queued_job(redis):
+    """Quarantined queued job is never dequeued."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from quarantine_job(redis, stubs.queue, stubs.job_id,
+                              stubs.job_exc_info)
+    assert not (yield from queue_length(redis, stubs.queue))
+    assert (yield from dequeue_job(redis, stubs.queue)) == (None, {})
+    assert (yield from failed_count(redis)) == 1
+
+
+def test_quarantine_missing_job(redis):
+    """Quarantine of missing job does nothing."""
+
+    assert not (yield from quarantine_job(redis, stubs.queue, stubs.job_id,
+                                          stubs.job_exc_info))
+    assert not (yield from failed_count(redis))
+
+
+# Clean started jobs.
+
+
+def test_clean_started_jobs(redis):
+    """Move jobs with expired score from started registry to failed
+    queue.
+    """
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from redis.zadd(started_registry(stubs.queue),
+                          current_timestamp() - 1, stubs.job_id)
+    assert (yield from clean_started_jobs(redis, stubs.queue)) == 1
+    assert not (yield from started_jobs(redis, stubs.queue))
+    assert stubs.job_id.encode() in (yield from failed_jobs(redis))
+    assert (yield from job_status(redis, stubs.job_id)) == JobStatus.FAILED.encode()
+
+
+def test_clean_started_jobs_reason(redis):
+    """Reclaimed job is failed with lease expiration reason."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from redis.zadd(started_registry(stubs.queue),
+                          current_timestamp() - 1, stubs.job_id)
+    yield from clean_started_jobs(redis, stubs.queue)
+    assert (yield from failed_jobs(redis, exc_type='LeaseExpired')) == [
+        stubs.job_id.encode()]
+    assert (yield from failure_summary(redis)) == {
+        ('LeaseExpired', 'fixtures.some_calculation', stubs.queue): 1}
+
+
+def test_clean_started_jobs_keeps_running_jobs(redis):
+    """Jobs with score in the future stay in the started registry."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    assert (yield from clean_started_jobs(redis, stubs.queue)) == 0
+    assert (yield from started_jobs(redis, stubs.queue)) == [stubs.job_id.encode()]
+
+
+def test_clean_started_jobs_retry(redis):
+    """Timed out jobs with attempts left are scheduled for retry."""
+
+    yield from enqueue_job(redis=redis, retry=(3, 10, 0), **stubs.job)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    yield from redis.zadd(started_registry(stubs.queue),
+                          current_timestamp() - 1, stubs.job_id)
+    yield from clean_started_jobs(redis, stubs.queue)
+    assert (yield from scheduled_jobs(redis, stubs.queue)) == [stubs.job_id.encode()]
+
+
+def test_clean_started_jobs_limit(redis):
+    """Clean at most limit started jobs at once."""
+
+    yield from redis.zadd(started_registry(stubs.queue), 1, 'foo')
+    yield from redis.zadd(started_registry(stubs.queue), 2, 'bar')
+    assert (yield from clean_started_jobs(redis, stubs.queue, limit=1)) == 1
+    assert (yield from started_jobs(redis, stubs.queue)) == [b'bar']
+
+
+# Clean finished jobs.
+
+
+def test_clean_finished_jobs(redis):
+    """Remove expired jobs from finished registry."""
+
+    yield from redis.zadd(finished_registry(stubs.queue), 1, 'foo')
+    yield from redis.zadd(finished_registry(stubs.queue),
+                          current_timestamp() + 100, 'bar')
+    assert (yield from clean_finished_jobs(redis, stubs.queue)) == 1
+    assert (yield from finished_jobs(redis, stubs.queue)) == [b'bar']
+
+
+def test_clean_finished_jobs_non_expired(redis):
+    """Jobs with negative result TTL are never removed."""
+
+    yield from redis.zadd(finished_registry(stubs.queue), -1, 'foo')
+    assert (yield from clean_finished_jobs(redis, stubs.queue)) == 0
+    assert (yield from finished_jobs(redis, stubs.queue)) == [b'foo']
+
+
+def test_clean_finished_jobs_limit(redis):
+    """Clean at most limit finished jobs at once."""
+
+    yield from redis.zadd(finished_registry(stubs.queue), 1, 'foo')
+    yield from redis.zadd(finished_registry(stubs.queue), 2, 'bar')
+    assert (yield from clean_finished_jobs(redis, stubs.queue, limit=1)) == 1
+    assert (yield from finished_jobs(redis, stubs.queue)) == [b'bar']
+
+
+# Clean deferred jobs.
+
+
+def test_clean_deferred_jobs(redis):
+    """Remove jobs without hash from deferred registry."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from enqueue_job(redis=redis, **stubs.child_job)
+    yield from redis.zadd(deferred_registry(stubs.queue), 1, 'foo')
+    offset, removed = yield from clean_deferred_jobs(redis, stubs.queue)
+    assert offset == 0
+    assert removed == 1
+    assert (yield from deferred_jobs(redis, stubs.queue)) == [stubs.child_job_id.encode()]
+
+
+def test_clean_deferred_jobs_offset(redis):
+    """Continue deferred registry cleanup from returned offset."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from enqueue_job(redis=redis, **stubs.child_job)
+    yield from redis.zadd(deferred_registry(stubs.queue), 0, 'foo')
+    yield from redis.zadd(deferred_registry(stubs.queue),
+                          current_timestamp() + 1, 'bar')
+    offset, removed = yield from clean_deferred_jobs(redis, stubs.queue,
+                                                     limit=2)
+    assert (offset, removed) == (1, 1)
+    offset, removed = yield from clean_deferred_jobs(redis, stubs.queue,
+                                                     offset, limit=2)
+    assert (offset, removed) == (0, 1)
+    assert (yield from deferred_jobs(redis, stubs.queue)) == [stubs.child_job_id.encode()]
+
+
+# Maintenance lease.
+
+
+def test_acquire_maintenance_lease(redis):
+    """Only one holder gets maintenance lease."""
+
+    lease = yield from acquire_maintenance_lease(redis, 'foo', 60)
+    assert lease == '1:foo'
+    assert not (yield from acquire_maintenance_lease(redis, 'bar', 60))
+    assert 59000 < (yield from redis.pttl(maintenance_lease())) <= 60000
+
+
+def test_acquire_maintenance_lease_expired(redis):
+    """Lease passes to another holder with greater token after it
+    expires.
+    """
+
+    yield from acquire_maintenance_lease(redis, 'foo', 60)
+    yield from redis.delete(maintenance_lease())
+    lease = yield from acquire_maintenance_lease(redis, 'bar', 60)
+    assert lease == '2:bar'
+
+
+def test_clean_with_lost_maintenance_lease(redis):
+    """Cleanup with stale lease token does nothing."""
+
+    lease = yield from acquire_maintenance_lease(redis, 'foo', 60)
+    yield from redis.delete(maintenance_lease())
+    yield from acquire_maintenance_lease(redis, 'bar', 60)
+    yield from redis.zadd(finished_registry(stubs.queue), 1, 'foo')
+    with pytest.raises(InvalidOperationError):
+        yield from clean_finished_jobs(redis, stubs.queue, lease=lease)
+    with pytest.raises(InvalidOperationError):
+        yield from clean_started_jobs(redis, stubs.queue, lease=lease)
+    with pytest.raises(InvalidOperationError):
+        yield from clean_deferred_jobs(redis, stubs.queue, lease=lease)
+    assert (yield from finished_jobs(redis, stubs.queue)) == [b'foo']
+
+
+def test_clean_with_maintenance_lease(redis):
+    """Lease holder cleans registries."""
+
+    lease = yield from acquire_maintenance_lease(redis, 'foo', 60)
+    yield from redis.zadd(finished_registry(stubs.queue), 1, 'foo')
+    assert (yield from clean_finished_jobs(
+        redis, stubs.queue, lease=lease)) == 1
+
+
+def test_sweep_jobs_with_lost_maintenance_lease(redis):
+    """Sweep with stale lease token does nothing."""
+
+    yield from redis.hset(job_key(stubs.job_id), 'foo', 'bar')
+    with pytest.raises(InvalidOperationError):
+        yield from sweep_jobs(redis, lease='1:foo')
+    assert (yield from redis.exists(job_key(stubs.job_id)))
+
+
+# Traceback deduplication.
+
+
+def test_fail_job_deduplicates_traceback(redis):
+    """Jobs failed with the same traceback hash share single copy."""
+
+    for id in [stubs.job_id, stubs.child_job_id]:
+        yield from enqueue_job(redis=redis, **dict(stubs.job, id=id))
+        yield from fail_job(redis, stubs.queue, id, stubs.job_exc_info,
+                            exc_hash='foo')
+    assert not (yield from redis.hget(job_key(stubs.job_id), 'exc_info'))
+    assert (yield from redis.hget(job_key(stubs.job_id), 'exc_hash')) == b'foo'
+    entry = yield from traceback_entry(redis, 'foo')
+    assert entry[b'exc_info'] == stubs.job_exc_info.encode()
+    assert entry[b'refcount'] == 2
+    assert entry[b'first_seen'] and entry[b'last_seen']
+    exc_info = yield from job_exc_info(redis, stubs.child_job_id)
+    assert exc_info == stubs.job_exc_info.encode()
+
+
+def test_job_exc_info_without_hash(redis):
+    """Traceback without hash is stored in the job hash."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info)
+    exc_info = yield from job_exc_info(redis, stubs.job_id)
+    assert exc_info == stubs.job_exc_info.encode()
+
+
+def test_traceback_released_with_last_job(redis):
+    """Traceback is deleted when no failed job refers to it."""
+
+    for id in [stubs.job_id, stubs.child_job_id]:
+        yield from enqueue_job(redis=redis, **dict(stubs.job, id=id))
+        yield from fail_job(redis, stubs.queue, id, stubs.job_exc_info,
+                            exc_hash='foo')
+    yield from requeue_job(redis, stubs.job_id)
+    assert (yield from traceback_entry(redis, 'foo'))[b'refcount'] == 1
+    assert not (yield from redis.hget(job_key(stubs.job_id), 'exc_hash'))
+    yield from delete_failed_job(redis, stubs.child_job_id)
+    assert not (yield from redis.exists(traceback_key('foo')))
+
+
+def test_retry_replaces_traceback(redis):
+    """Scheduled job refers to the traceback of its last attempt."""
+
+    yield from enqueue_job(redis=redis, retry=(3, 10, 0), **stubs.job)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, 'foo',
+                        exc_hash='foo')
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, 'bar',
+                        exc_hash='bar')
+    assert not (yield from redis.exists(traceback_key('foo')))
+    assert (yield from job_exc_info(redis, stubs.job_id)) == b'bar'
+
+
+# Failure summary.
+
+
+def test_failure_summary(redis):
+    """Failed jobs are counted by exception type, function and origin."""
+
+    for id in [stubs.job_id, stubs.child_job_id]:
+        yield from enqueue_job(redis=redis, **dict(stubs.job, id=id))
+        yield from fail_job(redis, stubs.queue, id, stubs.job_exc_info,
+                            exc_type='ValueError',
+                            function='fixtures.some_calculation')
+    summary = yield from failure_summary(redis)
+    assert summary == {
+        ('ValueError', 'fixtures.some_calculation', stubs.queue): 2}
+    yield from requeue_job(redis, stubs.job_id)
+    yield from purge_failed(redis)
+    assert not (yield from failure_summary(redis))
+
+
 # Requeue job.
 
 
@@ -666,6 +2088,22 @@ def test_requeue_job_clean_exc_info(redis):
     assert not (yield from redis.hget(job_key(stubs.job_id), 'exc_info'))
 
 
+def test_requeue_job_resets_attempts(redis):
+    """Requeued job gets its retry attempts back and drops traceback
+    reference.
+    """
+
+    yield from enqueue_job(redis=redis, retry=(1, 10, 0), **stubs.job)
+    yield from start_job(redis, stubs.queue, stubs.job_id, 180)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info,
+                        exc_hash='foo')
+    yield from requeue_job(redis, stubs.job_id)
+    job_hash = job_key(stubs.job_id)
+    assert not (yield from redis.hget(job_hash, 'attempts'))
+    assert not (yield from redis.hget(job_hash, 'exc_hash'))
+    assert not (yield from redis.exists(traceback_key('foo')))
+
+
 def test_requeue_job_enqueue_into_origin(redis):
     """Requeue existing job puts it into jobs origin queue."""
 
@@ -676,14 +2114,39 @@ def test_requeue_job_enqueue_into_origin(redis):
     assert stubs.job_id.encode() in (yield from jobs(redis, stubs.queue))
 
 
+def test_requeue_job_register_queue(redis):
+    """Requeue job registers its origin queue by name."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from redis.delete(queues_key())
+    yield from claim_job(redis, [stubs.queue])
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info)
+    yield from requeue_job(redis, stubs.job_id)
+    assert (yield from queues(redis)) == [stubs.queue.encode()]
+
+
 def test_requeue_job_removes_non_existing_job(redis):
     """Requeue job removes job id from the failed queue if job doesn't
     exists anymore.
     """
 
-    yield from redis.rpush(failed_queue_key(), stubs.job_id)
+    yield from redis.zadd(failed_registry(), 1, stubs.job_id)
+    yield from requeue_job(redis, stubs.job_id)
+    assert not (yield from failed_jobs(redis))
+
+
+def test_requeue_job_removes_indexes(redis):
+    """Requeue job removes it from all failed job indexes."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from dequeue_job(redis, stubs.queue)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info,
+                        exc_type='ValueError')
     yield from requeue_job(redis, stubs.job_id)
-    assert not (yield from jobs(redis, 'failed'))
+    assert not (yield from failed_count(redis))
+    assert not (yield from failed_count(redis, origin=stubs.queue))
+    assert not (yield from failed_count(redis, exc_type='ValueError'))
+    assert not (yield from redis.hget(job_key(stubs.job_id), 'exc_type'))
 
 
 def test_requeue_job_error_on_non_failed_job(redis):
@@ -694,6 +2157,137 @@ def test_requeue_job_error_on_non_failed_job(redis):
         yield from requeue_job(redis, stubs.job_id)
 
 
+# Failed jobs.
+
+
+def test_failed_jobs_order(redis):
+    """Failed jobs are ordered by failure time."""
+
+    yield from redis.zadd(failed_registry(), 2, 'foo')
+    yield from redis.zadd(failed_registry(), 1, 'bar')
+    assert (yield from failed_jobs(redis)) == [b'bar', b'foo']
+    assert (yield from failed_jobs(redis, 0, 0)) == [b'bar']
+
+
+def test_failed_jobs_single_filter(redis):
+    """Failed jobs can't be filtered by origin and type at once."""
+
+    with pytest.raises(InvalidOperationError):
+        yield from failed_jobs(redis, origin='foo', exc_type='ValueError')
+
+
+# Delete failed job.
+
+
+def test_delete_failed_job(redis):
+    """Delete failed job with its indexes."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info,
+                        exc_type='ValueError')
+    yield from delete_failed_job(redis, stubs.job_id)
+    assert not (yield from failed_count(redis))
+    assert not (yield from failed_count(redis, origin=stubs.queue))
+    assert not (yield from failed_count(redis, exc_type='ValueError'))
+    assert not (yield from redis.exists(job_key(stubs.job_id)))
+
+
+def test_delete_failed_job_error_on_non_failed_job(redis):
+    """Throw error if anyone tries to delete non failed job."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    with pytest.raises(InvalidOperationError):
+        yield from delete_failed_job(redis, stubs.job_id)
+    assert (yield from redis.exists(job_key(stubs.job_id)))
+
+
+# Requeue failed.
+
+
+def test_requeue_failed(redis):
+    """Requeue all failed jobs in chunks."""
+
+    for i in range(5):
+        yield from enqueue_job(redis=redis, **dict(stubs.job, id=str(i)))
+        yield from dequeue_job(redis, stubs.queue)
+        yield from fail_job(redis, stubs.queue, str(i), stubs.job_exc_info)
+    assert (yield from requeue_failed(redis, chunk=2)) == 5
+    assert not (yield from failed_count(redis))
+    assert (yield from jobs(redis, stubs.queue)) == [
+        str(i).encode() for i in range(5)]
+    assert (yield from job_status(redis, '0')) == JobStatus.QUEUED.encode()
+    assert not (yield from redis.hget(job_key('0'), 'exc_info'))
+
+
+def test_requeue_failed_filter_and_limit(redis):
+    """Requeue at most ``limit`` failed jobs matching the filter."""
+
+    for i in range(3):
+        yield from enqueue_job(redis=redis, **dict(stubs.job, id=str(i)))
+        yield from fail_job(redis, stubs.queue, str(i), stubs.job_exc_info,
+                            exc_type='ValueError')
+    yield from enqueue_job(redis=redis, **dict(stubs.job, id='3'))
+    yield from fail_job(redis, stubs.queue, '3', stubs.job_exc_info,
+                        exc_type='KeyError')
+    assert (yield from requeue_failed(
+        redis, exc_type='ValueError', limit=2, chunk=1)) == 2
+    assert (yield from failed_jobs(redis)) == [b'2', b'3']
+
+
+def test_requeue_failed_none_filters(redis):
+    """None filters and limit mean all failed jobs."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info)
+    assert (yield from failed_count(redis, origin=None, exc_type=None)) == 1
+    assert (yield from requeue_failed(
+        redis, origin=None, exc_type=None, limit=None)) == 1
+    assert not (yield from failed_count(redis))
+
+
+def test_requeue_failed_missing_jobs(redis):
+    """Ids of non existing jobs are dropped from the index."""
+
+    yield from redis.zadd(failed_registry(), 1, 'foo')
+    assert not (yield from requeue_failed(redis))
+    assert not (yield from failed_count(redis))
+
+
+# Purge failed.
+
+
+def test_purge_failed(redis):
+    """Delete failed jobs of the origin queue."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info,
+                        exc_type='ValueError')
+    yield from fail_job(redis, 'foo', 'bar', stubs.job_exc_info)
+    assert (yield from purge_failed(redis, origin=stubs.queue)) == 1
+    assert not (yield from redis.exists(job_key(stubs.job_id)))
+    assert not (yield from failed_count(redis, exc_type='ValueError'))
+    assert (yield from failed_jobs(redis)) == [b'bar']
+
+
+def test_purge_failed_cancels_dependents(redis):
+    """Dependents of deleted failed jobs are canceled."""
+
+    yield from enqueue_job(redis=redis, **stubs.job)
+    yield from enqueue_job(redis=redis, **stubs.child_job)
+    yield from fail_job(redis, stubs.queue, stubs.job_id, stubs.job_exc_info)
+    yield from purge_failed(redis)
+    assert (yield from job_status(redis, stubs.child_job_id)) == JobStatus.CANCELED.encode()
+    assert not (yield from deferred_jobs(redis, stubs.queue))
+
+
+def test_purge_failed_none_filters(redis):
+    """None filters and limit mean all failed jobs."""
+
+    yield from fail_job(redis, 'foo', 'bar', stubs.job_exc_info)
+    assert (yield from purge_failed(
+        redis, origin=None, exc_type=None, limit=None)) == 1
+
+
 # Workers.
 
 
@@ -813,6 +2407,41 @@ def test_worker_death_sets_status(redis):
     assert status == WorkerStatus.IDLE.encode()
 
 
+# Worker heartbeat.
+
+
+def test_worker_heartbeat_sets_worker_ttl(redis):
+    """Extend worker hash ttl."""
+
+    yield from worker_birth(redis, 'foo', ['bar', 'baz'])
+    yield from worker_heartbeat(redis, 'foo', 1000)
+    assert (yield from redis.ttl(worker_key('foo'))) == 1000
+    last_heartbeat = yield from redis.hget(worker_key('foo'), 'last_heartbeat')
+    assert last_heartbeat == utcformat(utcnow()).encode()
+
+
+def test_worker_heartbeat_renews_leases(redis):
+    """Renew leases of the running jobs."""
+
+    yield from worker_birth(redis, 'foo', ['bar', 'baz'])
+    yield from redis.zadd(started_registry('bar'), 1, 'x')
+    yield from worker_heartbeat(redis, 'foo', 1000,
+                                jobs=[('bar', 'x'), ('baz', 'y')], lease=30)
+    score = current_timestamp() + 30
+    assert (yield from redis.zscore(started_registry('bar'), 'x')) == score
+    assert not (yield from started_jobs(redis, 'baz'))
+
+
+def test_worker_heartbeat_stats(redis):
+    """Publish worker stats."""
+
+    yield from worker_birth(redis, 'foo', ['bar', 'baz'])
+    yield from worker_heartbeat(redis, 'foo', 1000,
+                                stats={'running': 2, 'processed': 10})
+    stats = yield from redis.hmget(worker_key('foo'), 'running', 'processed')
+    assert stats == [b'2', b'10']
+
+
 # Worker shutdown requested.
 
 
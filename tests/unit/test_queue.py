@@ -1,14 +1,17 @@
 import asyncio
 import pickle
+import zlib
 from datetime import datetime
 
 import pytest
 
 import stubs
 import helpers
-from aiorq import Queue, get_failed_queue, Worker
-from aiorq.exceptions import InvalidJobOperationError, DequeueTimeout
+from aiorq import Queue, get_failed_queue, Worker, Retry
+from aiorq.exceptions import (InvalidJobOperationError, DequeueTimeout,
+                              InvalidOperationError)
 from aiorq.job import Job
+from aiorq.queue import FailedQueue
 from aiorq.specs import JobStatus
 from aiorq.utils import unset, utcformat, utcnow
 from fixtures import say_hello, Number, echo, div_by_zero, CustomJob
@@ -58,6 +61,16 @@ def test_custom_default_timeout():
     assert q.default_timeout == 500
 
 
+def test_custom_default_hash_ttl():
+    """Override default job hash TTL."""
+
+    connection = object()
+    q = Queue(connection)
+    assert q.default_hash_ttl is None
+    q = Queue(connection, default_hash_ttl=500)
+    assert q.default_hash_ttl == 500
+
+
 def test_custom_job_class():
     """Ensure custom job class assignment works as expected."""
 
@@ -165,6 +178,43 @@ def test_queue_is_empty():
     assert (yield from q.is_empty())
 
 
+def test_queue_pause():
+    """Pause and resume queues."""
+
+    connection = object()
+    paused = set()
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def pause_queue(redis, name):
+            assert redis is connection
+            paused.add(name)
+
+        @staticmethod
+        @asyncio.coroutine
+        def resume_queue(redis, name):
+            assert redis is connection
+            paused.discard(name)
+
+        @staticmethod
+        @asyncio.coroutine
+        def queue_paused(redis, name):
+            assert redis is connection
+            return name in paused
+
+    class TestQueue(Queue):
+        protocol = Protocol()
+
+    q = TestQueue(connection, 'example')
+    assert not (yield from q.is_paused)
+    yield from q.pause()
+    assert paused == {'example'}
+    assert (yield from q.is_paused)
+    yield from q.resume()
+    assert not (yield from q.is_paused)
+
+
 def test_queue_count():
     """Count all messages in the queue."""
 
@@ -292,7 +342,7 @@ def test_jobs():
     class Protocol:
         @staticmethod
         @asyncio.coroutine
-        def jobs(redis, queue, start, end):
+        def queued_jobs(redis, queue, start, end):
             assert redis is connection
             assert queue == 'example'
             assert start == 0
@@ -325,14 +375,52 @@ def test_jobs():
     assert job.description == stubs.job['description']
 
 
-# TODO: test q.jobs and empty hash from protocol.job
+def test_jobs_skip_removed():
+    """Job removed while queue is listed isn't returned."""
+
+    connection = object()
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def queued_jobs(redis, queue, start, end):
+            return [stubs.job_id.encode()]
+
+        @staticmethod
+        @asyncio.coroutine
+        def job(redis, id):
+            return {}
+
+    class TestQueue(Queue):
+        protocol = Protocol()
+
+    q = TestQueue(connection, 'example')
+    assert not (yield from q.jobs)
+
+
 # TODO: test get_job_ids offset and length behavior.
 
 
 def test_compact():
     """Queue.compact() removes non-existing jobs."""
 
-    pass                        # TODO: write actual test
+    connection = object()
+    replies = [(1000, 2), (0, 1)]
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def compact_queue(redis, name, offset=0):
+            assert redis is connection
+            assert name == 'example'
+            assert offset == (0 if len(replies) == 2 else 1000)
+            return replies.pop(0)
+
+    class TestQueue(Queue):
+        protocol = Protocol()
+
+    q = TestQueue(connection, 'example')
+    assert (yield from q.compact()) == 3
 
 
 def test_enqueue():
@@ -358,7 +446,7 @@ def test_enqueue():
             assert dependency_id is unset
             assert at_front is False
             uuids.append(id)
-            return JobStatus.QUEUED, utcnow()
+            return id, JobStatus.QUEUED, utcnow()
 
     class TestQueue(Queue):
         protocol = Protocol()
@@ -405,7 +493,7 @@ def test_enqueue_call():
             assert dependency_id is unset
             assert at_front is False
             uuids.append(id)
-            return JobStatus.QUEUED, utcnow()
+            return id, JobStatus.QUEUED, utcnow()
 
     class TestQueue(Queue):
         protocol = Protocol()
@@ -439,7 +527,7 @@ def test_enqueue_call_custom_job_id():
                         created_at, *, result_ttl=unset, dependency_id=unset,
                         at_front=False):
             assert id == 'my_id'
-            return JobStatus.QUEUED, utcnow()
+            return id, JobStatus.QUEUED, utcnow()
 
     class TestQueue(Queue):
         protocol = Protocol()
@@ -460,7 +548,7 @@ def test_enqueue_call_no_args():
                         at_front=False):
             _, _, args, _ = pickle.loads(data)
             assert args == ()
-            return JobStatus.QUEUED, utcnow()
+            return id, JobStatus.QUEUED, utcnow()
 
     class TestQueue(Queue):
         protocol = Protocol()
@@ -470,6 +558,75 @@ def test_enqueue_call_no_args():
     assert job.args == ()
 
 
+def test_enqueue_call_serializer():
+    """Queue encodes job data with its serializer and passes its name
+    to the protocol."""
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def enqueue_job(redis, queue, id, data, description, timeout,
+                        created_at, *, at_front=False, serializer=unset):
+            assert serializer == 'json'
+            assert data == b'["fixtures.say_hello",["Lionel"],{}]'
+            return id, JobStatus.QUEUED, utcnow()
+
+    class TestQueue(Queue):
+        protocol = Protocol()
+
+    q = TestQueue(None, serializer='json')
+    yield from q.enqueue_call(say_hello, args=('Lionel',))
+
+
+def test_enqueue_call_json_bound_method():
+    """JSON serializer refuses bound methods."""
+
+    q = Queue(None, serializer='json')
+    with pytest.raises(TypeError):
+        yield from q.enqueue_call(Number(2).div, args=(4,))
+
+
+def test_enqueue_call_compression():
+    """Queue compresses large job data and measures the ratio."""
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def enqueue_job(redis, queue, id, data, description, timeout,
+                        created_at, *, at_front=False, codec=unset):
+            assert codec == 'zlib'
+            _, _, args, _ = pickle.loads(zlib.decompress(data))
+            assert args == ('x' * 4096,)
+            return id, JobStatus.QUEUED, utcnow()
+
+    class TestQueue(Queue):
+        protocol = Protocol()
+
+    q = TestQueue(None, compression='zlib', compression_threshold=1024)
+    job = yield from q.enqueue_call(say_hello, args=('x' * 4096,))
+    assert job.compression_ratio < 0.1
+
+
+def test_enqueue_call_blobs():
+    """Queue offloads large arguments into blobs."""
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def enqueue_job(redis, queue, id, data, description, timeout,
+                        created_at, *, at_front=False, blobs=unset):
+            _, _, args, _ = pickle.loads(data)
+            assert pickle.loads(blobs[args[0].hash]) == 'x' * 4096
+            return id, JobStatus.QUEUED, utcnow()
+
+    class TestQueue(Queue):
+        protocol = Protocol()
+
+    q = TestQueue(None, blob_threshold=1024)
+    job = yield from q.enqueue_call(say_hello, args=('x' * 4096,))
+    assert job.args == ('x' * 4096,)
+
+
 def test_enqueue_call_no_kwargs():
     """Pass empty dict in the case keyword arguments were not
     provided.
@@ -483,7 +640,7 @@ def test_enqueue_call_no_kwargs():
                         at_front=False):
             _, _, _, kwargs = pickle.loads(data)
             assert kwargs == {}
-            return JobStatus.QUEUED, utcnow()
+            return id, JobStatus.QUEUED, utcnow()
 
     class TestQueue(Queue):
         protocol = Protocol()
@@ -503,7 +660,7 @@ def test_enqueue_call_preserve_desctiption():
                         created_at, *, result_ttl=unset, dependency_id=unset,
                         at_front=False):
             assert description == 'My Job'
-            return JobStatus.QUEUED, utcnow()
+            return id, JobStatus.QUEUED, utcnow()
 
     class TestQueue(Queue):
         protocol = Protocol()
@@ -523,7 +680,7 @@ def test_enqueue_call_preserve_timeout():
                         created_at, *, result_ttl=unset, dependency_id=unset,
                         at_front=False):
             assert timeout == 7
-            return JobStatus.QUEUED, utcnow()
+            return id, JobStatus.QUEUED, utcnow()
 
     class TestQueue(Queue):
         protocol = Protocol()
@@ -543,7 +700,7 @@ def test_enqueue_call_preserve_result_ttl():
                         created_at, *, result_ttl=unset, dependency_id=unset,
                         at_front=False):
             assert result_ttl == 7
-            return JobStatus.QUEUED, utcnow()
+            return id, JobStatus.QUEUED, utcnow()
 
     class TestQueue(Queue):
         protocol = Protocol()
@@ -567,7 +724,7 @@ def test_enqueue_call_dependency_id():
                         created_at, *, result_ttl=unset, dependency_id=unset,
                         at_front=False):
             assert dependency_id == dependencies.pop(0)
-            return replies.pop(0)
+            return (id,) + replies.pop(0)
 
     class TestQueue(Queue):
         protocol = Protocol()
@@ -593,7 +750,7 @@ def test_enqueue_call_dependency_job():
                         created_at, *, result_ttl=unset, dependency_id=unset,
                         at_front=False):
             assert dependency_id == dependencies.pop(0)
-            return replies.pop(0)
+            return (id,) + replies.pop(0)
 
     class TestQueue(Queue):
         protocol = Protocol()
@@ -605,14 +762,318 @@ def test_enqueue_call_dependency_job():
     assert not job_bar.enqueued_at
 
 
+def test_enqueue_call_unique_key():
+    """Pass unique key and its ttl to the protocol."""
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def enqueue_job(redis, queue, id, data, description, timeout,
+                        created_at, *, result_ttl=unset, dependency_id=unset,
+                        at_front=False, unique_key=unset, unique_ttl=unset):
+            assert unique_key == 'foo'
+            assert unique_ttl == 60
+            return id, JobStatus.QUEUED, utcnow()
+
+    class TestQueue(Queue):
+        protocol = Protocol()
+
+    q = TestQueue(None)
+    job = yield from q.enqueue_call(say_hello, job_id='bar', unique_key='foo',
+                                    unique_ttl=60)
+    assert job.id == 'bar'
+
+
+def test_enqueue_call_unique_key_duplicate():
+    """Return already enqueued job if unique key is held by it."""
+
+    connection = object()
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def enqueue_job(redis, queue, id, data, description, timeout,
+                        created_at, *, result_ttl=unset, dependency_id=unset,
+                        at_front=False, unique_key=unset, unique_ttl=unset):
+            return stubs.job_id, JobStatus.QUEUED, utcnow()
+
+        @staticmethod
+        @asyncio.coroutine
+        def job(redis, id):
+            assert id == stubs.job_id
+            return {
+                b'created_at': b'2016-04-05T22:40:35Z',
+                b'data': stubs.job_data,
+                b'description': b'fixtures.some_calculation(3, 4, z=2)',
+                b'timeout': 180,
+                b'result_ttl': 5000,
+                b'status': JobStatus.QUEUED.encode(),
+                b'origin': stubs.queue.encode(),
+                b'enqueued_at': utcformat(utcnow()).encode(),
+            }
+
+    class TestQueue(Queue):
+        protocol = Protocol()
+
+    q = TestQueue(connection)
+    job = yield from q.enqueue_call(say_hello, unique_key='foo')
+    assert job.id == stubs.job_id
+    assert job.description == stubs.job['description']
+
+
+def test_enqueue_call_coalesce_key():
+    """Pass coalesce key to the protocol."""
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def enqueue_job(redis, queue, id, data, description, timeout,
+                        created_at, *, result_ttl=unset, dependency_id=unset,
+                        at_front=False, coalesce_key=unset):
+            assert coalesce_key == 'foo'
+            return id, JobStatus.QUEUED, utcnow()
+
+    class TestQueue(Queue):
+        protocol = Protocol()
+
+    q = TestQueue(None)
+    job = yield from q.enqueue_call(say_hello, job_id='bar',
+                                    coalesce_key='foo')
+    assert job.id == 'bar'
+
+
+def test_enqueue_call_retry():
+    """Pass retry policy to the protocol."""
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def enqueue_job(redis, queue, id, data, description, timeout,
+                        created_at, *, result_ttl=unset, dependency_id=unset,
+                        at_front=False, retry=unset):
+            assert retry == (3, 10, 0.5)
+            return id, JobStatus.QUEUED, utcnow()
+
+    class TestQueue(Queue):
+        protocol = Protocol()
+
+    q = TestQueue(None)
+    yield from q.enqueue_call(say_hello, retry=Retry(3, backoff=10, jitter=0.5))
+
+
+def test_enqueue_call_ttl():
+    """Pass job TTL to the protocol."""
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def enqueue_job(redis, queue, id, data, description, timeout,
+                        created_at, *, result_ttl=unset, dependency_id=unset,
+                        at_front=False, ttl=unset):
+            assert ttl == 43
+            return id, JobStatus.QUEUED, utcnow()
+
+    class TestQueue(Queue):
+        protocol = Protocol()
+
+    q = TestQueue(None)
+    yield from q.enqueue_call(say_hello, ttl=43)
+
+
+def test_expired_count():
+    """Count jobs discarded because of expired TTL."""
+
+    connection = object()
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def expired_count(redis, name):
+            assert redis is connection
+            assert name == 'example'
+            return 3
+
+    class TestQueue(Queue):
+        protocol = Protocol()
+
+    q = TestQueue(connection, 'example')
+    assert (yield from q.expired_count) == 3
+
+
+def test_enqueue_call_hash_ttl():
+    """Pass default job hash TTL to the protocol."""
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def enqueue_job(redis, queue, id, data, description, timeout,
+                        created_at, *, result_ttl=unset, dependency_id=unset,
+                        at_front=False, hash_ttl=unset):
+            assert hash_ttl == 500
+            return id, JobStatus.QUEUED, utcnow()
+
+    class TestQueue(Queue):
+        protocol = Protocol()
+
+    q = TestQueue(None, default_hash_ttl=500)
+    yield from q.enqueue_call(say_hello)
+
+
 # TODO: meta field
 
 
 # Failed queue tests.
 
 
+def test_failed_queue_get_job_ids():
+    """Failed queue filters jobs by origin or exception type."""
+
+    connection = object()
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def failed_jobs(redis, start, end, *, origin, exc_type):
+            assert redis is connection
+            assert (start, end) == (2, 6)
+            assert origin is None
+            assert exc_type == 'ValueError'
+            return [b'foo', b'bar']
+
+        @staticmethod
+        @asyncio.coroutine
+        def failed_count(redis):
+            assert redis is connection
+            return 2
+
+    class TestFailedQueue(FailedQueue):
+        protocol = Protocol()
+
+    q = TestFailedQueue(connection)
+    assert q.name == JobStatus.FAILED
+    assert (yield from q.get_job_ids(2, 5, exc_type='ValueError')) == [
+        'foo', 'bar']
+    assert (yield from q.count) == 2
+
+
+def test_requeue_nonfailed_job_fails():
+    """Requeue and removal of non failed job raise an error."""
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def requeue_job(redis, id):
+            raise InvalidOperationError
+
+        @staticmethod
+        @asyncio.coroutine
+        def delete_failed_job(redis, id):
+            raise InvalidOperationError
+
+    class TestFailedQueue(FailedQueue):
+        protocol = Protocol()
+
+    q = TestFailedQueue(None)
+    with pytest.raises(InvalidJobOperationError):
+        yield from q.requeue(stubs.job_id)
+    with pytest.raises(InvalidJobOperationError):
+        yield from q.remove(stubs.job_id)
+
+
+def test_failed_queue_bulk_operations():
+    """Failed queue requeue and purge jobs in bulk."""
+
+    connection = object()
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def requeue_failed(redis, *, origin, exc_type, limit):
+            assert redis is connection
+            assert (origin, exc_type, limit) == ('example', None, 10)
+            return 10
+
+        @staticmethod
+        @asyncio.coroutine
+        def purge_failed(redis, *, origin, exc_type, limit):
+            assert redis is connection
+            assert (origin, exc_type, limit) == (None, 'ValueError', None)
+            return 3
+
+    class TestFailedQueue(FailedQueue):
+        protocol = Protocol()
+
+    q = TestFailedQueue(connection)
+    assert (yield from q.requeue_all(origin='example', limit=10)) == 10
+    assert (yield from q.purge(exc_type='ValueError')) == 3
+
+
+def test_failed_queue_empty():
+    """Empty failed queue purges failed jobs."""
+
+    connection = object()
+    failed = [b'foo', b'bar']
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def failed_count(redis):
+            assert redis is connection
+            return len(failed)
+
+        @staticmethod
+        @asyncio.coroutine
+        def purge_failed(redis, *, origin, exc_type, limit):
+            assert redis is connection
+            count = len(failed)
+            failed.clear()
+            return count
+
+    class TestFailedQueue(FailedQueue):
+        protocol = Protocol()
+
+    q = TestFailedQueue(connection)
+    assert not (yield from q.is_empty())
+    assert (yield from q.empty()) == 2
+    assert (yield from q.is_empty())
+
+
+def test_quarantine():
+    """Quarantine job bypassing its retry policy."""
+
+    connection = object()
+    sentinel = []
+
+    class Protocol:
+        @staticmethod
+        @asyncio.coroutine
+        def quarantine_job(redis, queue, id, exc_info):
+            assert redis is connection
+            assert (queue, id) == ('default', stubs.job_id)
+            assert exc_info == 'Exception'
+            sentinel.append(1)
+            return True
+
+    class TestFailedQueue(FailedQueue):
+        protocol = Protocol()
+
+    q = TestFailedQueue(connection)
+    job = Job(
+        connection=connection,
+        id=stubs.job_id,
+        func=say_hello,
+        args=(),
+        kwargs={},
+        description='fixtures.say_hello()',
+        timeout=180,
+        result_ttl=5000,
+        origin='default',
+        created_at=datetime(2016, 4, 5, 22, 40, 35))
+    assert (yield from q.quarantine(job, 'Exception')) is job
+    assert sentinel
+
+
 # TODO: test_requeue_job
-# TODO: test_requeue_nonfailed_job_fails
 # TODO: test_quarantine_preserves_timeout
 # TODO: test_requeueing_preserves_timeout
 # TODO: test_requeue_sets_status_to_queued
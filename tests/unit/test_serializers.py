@@ -0,0 +1,101 @@
+import pickle
+
+import pytest
+
+from aiorq.serializers import (get_serializer, register_serializer,
+                               serializers,
+                               PickleSerializer, JSONSerializer,
+                               buffer_data)
+
+
+out_of_band = pytest.mark.skipif(
+    not hasattr(pickle, 'PickleBuffer'),
+    reason='pickle protocol 5 is not available')
+
+
+# Get serializer.
+
+
+def test_get_serializer_by_name():
+    """Find registered serializer by its name."""
+
+    assert isinstance(get_serializer('pickle'), PickleSerializer)
+    assert isinstance(get_serializer('json'), JSONSerializer)
+
+
+def test_get_serializer_instance():
+    """Serializer instance is returned as is."""
+
+    serializer = JSONSerializer()
+    assert get_serializer(serializer) is serializer
+
+
+def test_get_serializer_unknown():
+    """Unknown serializer name is an error."""
+
+    with pytest.raises(ValueError):
+        get_serializer('yaml')
+
+
+def test_get_serializer_unregistered_instance():
+    """Serializer instance with unknown name is an error."""
+
+    class YAMLSerializer(JSONSerializer):
+        name = 'yaml'
+
+    with pytest.raises(ValueError):
+        get_serializer(YAMLSerializer())
+
+
+def test_register_serializer():
+    """Registered serializer is available by its name."""
+
+    class YAMLSerializer(JSONSerializer):
+        name = 'yaml'
+
+    serializer = register_serializer(YAMLSerializer())
+    try:
+        assert get_serializer('yaml') is serializer
+        assert get_serializer(serializer) is serializer
+    finally:
+        del serializers['yaml']
+
+
+# Round trip.
+
+
+@pytest.mark.parametrize('name', sorted(serializers))
+def test_serializer_round_trip(name):
+    """Job tuple survives serialization."""
+
+    serializer = serializers[name]
+    job_tuple = ('fixtures.some_calculation', None, (3, 4), {'z': 2})
+    assert serializer.loads(serializer.dumps(job_tuple)) == job_tuple
+
+
+# Out-of-band buffers.
+
+
+@out_of_band
+def test_pickle_out_of_band_buffers():
+    """Large bytes arguments are kept out of the pickle stream."""
+
+    serializer = PickleSerializer()
+    payload = b'x' * serializer.out_of_band_threshold
+    buffers = []
+    data = serializer.dumps(('foo', None, (payload,), {'y': b'y'}), buffers)
+    assert len(data) < len(payload)
+    assert len(buffers) == 1
+    assert buffer_data(buffers[0]) is payload
+    restored = serializer.loads(data, [buffer_data(b) for b in buffers])
+    assert restored == ('foo', None, (payload,), {'y': b'y'})
+
+
+def test_pickle_without_buffers():
+    """Arguments are pickled in-band without buffers list."""
+
+    serializer = PickleSerializer()
+    payload = b'x' * serializer.out_of_band_threshold
+    data = serializer.dumps(('foo', None, (payload,), {}))
+    assert len(data) > len(payload)
+    assert serializer.loads(data) == ('foo', None, (payload,), {})
@@ -1,6 +1,10 @@
+import gc
+import weakref
+
 import pytest
 
-from aiorq.utils import function_name, make_description
+from aiorq.utils import (function_name, function_names, make_description,
+                         traceback_hash, resolve_function, preload_module)
 from fixtures import some_calculation, Number, CallableObject
 
 
@@ -66,6 +70,29 @@ def test_function_name_not_a_function():
         function_name(1)
 
 
+def test_function_name_cached():
+    """Function name is cached by function object."""
+
+    function_name(some_calculation)
+    assert function_names[some_calculation] == 'fixtures.some_calculation'
+
+
+def test_function_name_doesnt_keep_closures():
+    """Name cache doesn't hold references to functions."""
+
+    def make_closure():
+        def closure():
+            pass
+        return closure
+
+    closure = make_closure()
+    reference = weakref.ref(closure)
+    assert function_name(closure)[0] == 'test_utils.closure'
+    del closure
+    gc.collect()
+    assert reference() is None
+
+
 # Make description.
 
 
@@ -74,3 +101,37 @@ def test_make_description():
 
     desc = make_description('fixtures.some_calculation', (3, 4), {'z': 2})
     assert desc == 'fixtures.some_calculation(3, 4, z=2)'
+
+
+# Resolve function.
+
+
+def test_resolve_function_cached():
+    """Function is imported once for the same name."""
+
+    resolve_function.cache_clear()
+    assert resolve_function('fixtures.some_calculation') is some_calculation
+    assert resolve_function('fixtures.some_calculation') is some_calculation
+    assert resolve_function.cache_info().hits == 1
+
+
+def test_preload_module():
+    """Preloaded module functions are resolved from the cache."""
+
+    resolve_function.cache_clear()
+    assert preload_module('fixtures') > 0
+    misses = resolve_function.cache_info().misses
+    resolve_function('fixtures.say_hello')
+    assert resolve_function.cache_info().misses == misses
+
+
+# Traceback hash.
+
+
+def test_traceback_hash_ignores_addresses():
+    """Tracebacks different in object addresses only have same hash."""
+
+    first = 'ValueError: <object at 0x7f3a2c1d5e80>\n'
+    second = 'ValueError: <object at 0x7f3a2c1d6f10>\n'
+    assert traceback_hash(first) == traceback_hash(second)
+    assert traceback_hash(first) != traceback_hash('KeyError: foo\n')
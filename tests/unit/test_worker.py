@@ -1,16 +1,23 @@
 import asyncio
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
+import aioredis
+import pytest
 from rq.compat import as_text
-from rq.job import JobStatus
 from rq.utils import utcnow
 
 from aiorq import Worker, Queue, get_failed_queue
+from aiorq.compat import ensure_future
 from aiorq.job import Job
+from aiorq.protocol import failure_summary
 from aiorq.registry import StartedJobRegistry
+from aiorq.specs import JobStatus
 from aiorq.suspension import resume, suspend
 from fixtures import (say_hello, div_by_zero, mock, touch_a_mock,
-                      touch_a_mock_after_timeout, do_nothing)
+                      touch_a_mock_after_timeout, do_nothing,
+                      some_calculation, blocking_sleep, long_running_job)
 from helpers import strip_microseconds
 
 
@@ -77,6 +84,30 @@ def test_work_via_string_argument(loop):
     assert (yield from job.result) == 'Hi there, Frank!'
 
 
+def test_work_blocking_function(redis, loop):
+    """Worker runs blocking functions in the executor."""
+
+    queue = Queue(connection=redis)
+    job = yield from queue.enqueue(some_calculation, 3, 4, z=2)
+    worker = Worker([queue], connection=redis,
+                    executor=ThreadPoolExecutor(1))
+    assert (yield from worker.work(burst=True, loop=loop))
+    result = yield from redis.hget('rq:job:' + job.id, 'result')
+    assert pickle.loads(result) == 6
+
+
+def test_work_default_result_ttl(redis, loop):
+    """Job enqueued without result TTL keeps its result for the worker
+    default TTL."""
+
+    queue = Queue(connection=redis)
+    job = yield from queue.enqueue(say_hello)
+    worker = Worker([queue], connection=redis, default_result_ttl=100)
+    yield from worker.work(burst=True, loop=loop)
+    assert (yield from job.get_status()) == JobStatus.FINISHED
+    assert 0 < (yield from redis.ttl('rq:job:' + job.id)) <= 100
+
+
 def test_job_times(loop):
     """Job times are set correctly."""
 
@@ -200,6 +231,22 @@ def test_custom_exc_handling(loop):
     assert job.is_failed
 
 
+def test_exc_handler_swallows_error(redis, loop):
+    """Failed job leaves the started registry even if exception
+    handler stops the default one."""
+
+    @asyncio.coroutine
+    def black_hole(job, *exc_info):
+        return False
+
+    queue = Queue(connection=redis)
+    job = yield from queue.enqueue(div_by_zero, 1)
+    worker = Worker([queue], connection=redis, exception_handlers=black_hole)
+    yield from worker.work(burst=True, loop=loop)
+    assert not (yield from redis.zscore('rq:wip:' + queue.name, job.id))
+    assert (yield from job.get_status()) == JobStatus.FAILED
+
+
 def test_cancelled_jobs_arent_executed(redis, loop):
     """Cancelling jobs."""
 
@@ -238,6 +285,18 @@ def test_timeouts(set_loop):
     mock.reset_mock()
 
 
+def test_executor_timeouts(redis, loop):
+    """Worker stops waiting for blocking job after timeout."""
+
+    queue = Queue(connection=redis)
+    job = yield from queue.enqueue(blocking_sleep, args=(2,), timeout=1)
+    worker = Worker([queue], connection=redis,
+                    executor=ThreadPoolExecutor(1))
+    yield from worker.work(burst=True, loop=loop)
+    yield from job.refresh()
+    assert 'JobTimeoutException' in as_text(job.exc_info)
+
+
 def test_worker_sets_result_ttl(redis, loop):
     """Ensure that Worker properly sets result_ttl for individual jobs."""
 
@@ -332,21 +391,106 @@ def test_custom_job_class():
     assert worker.job_class == CustomJob
 
 
-def test_prepare_job_execution(redis):
-    """Prepare job execution does the necessary bookkeeping."""
+def test_claim_job(redis):
+    """Claim job starts it within single call."""
 
     queue = Queue(connection=redis)
     job = yield from queue.enqueue(say_hello)
-    worker = Worker([queue])
-    yield from worker.prepare_job_execution(job)
+    worker = Worker([queue], connection=redis)
+    claimed = yield from worker.claim_job()
+    assert claimed.id == job.id
 
     # Updates working queue
     registry = StartedJobRegistry(connection=redis)
     assert (yield from registry.get_job_ids()) == [job.id]
 
-    # Updates worker statuses
-    assert worker.get_state() == 'busy'
-    assert (yield from worker.get_current_job_id()) == job.id
+
+def test_claim_job_empty_queues(redis):
+    """Claim job returns None when there is nothing to do."""
+
+    worker = Worker([Queue(connection=redis)], connection=redis)
+    assert (yield from worker.claim_job()) is None
+
+
+def test_claim_job_unimportable(redis):
+    """Job with unimportable function is failed and the next job is
+    claimed instead."""
+
+    queue = Queue(connection=redis)
+    broken = yield from queue.enqueue('fixtures.nay_hello')
+    job = yield from queue.enqueue(say_hello)
+    worker = Worker([queue], connection=redis)
+    claimed = yield from worker.claim_job()
+    assert claimed.id == job.id
+    assert (yield from broken.get_status()) == JobStatus.FAILED
+    assert not (yield from redis.zscore('rq:wip:' + queue.name, broken.id))
+    assert (yield from failure_summary(redis)) == {
+        ('AttributeError', 'fixtures.nay_hello()', queue.name): 1}
+
+
+def test_claim_job_blobs(redis):
+    """Worker restores offloaded arguments and caches their blobs."""
+
+    queue = Queue(connection=redis, blob_threshold=100)
+    yield from queue.enqueue(say_hello, 'x' * 1000)
+    yield from queue.enqueue(say_hello, 'x' * 1000)
+    worker = Worker([queue], connection=redis)
+    claimed = yield from worker.claim_job()
+    assert claimed.args == ('x' * 1000,)
+    assert worker.blob_cache.size
+    yield from redis.delete(*(yield from redis.keys('rq:blob:*')))
+    claimed = yield from worker.claim_job()
+    assert claimed.args == ('x' * 1000,)
+
+
+def test_claim_job_broadcast(redis):
+    """Worker resolves broadcast handles and unpickles each value
+    once."""
+
+    queue = Queue(connection=redis)
+    handle = yield from queue.broadcast({'model': 'x' * 1000})
+    yield from queue.enqueue(say_hello, handle)
+    yield from queue.enqueue(say_hello, handle)
+    worker = Worker([queue], connection=redis)
+    first = yield from worker.claim_job()
+    assert first.args == ({'model': 'x' * 1000},)
+    yield from queue.delete_broadcast(handle)
+    second = yield from worker.claim_job()
+    assert second.args[0] is first.args[0]
+
+
+def test_claim_job_missing_broadcast(redis):
+    """Job with missing broadcast value is failed instead of getting
+    the handle as its argument."""
+
+    queue = Queue(connection=redis)
+    handle = yield from queue.broadcast({'model': 'x' * 1000})
+    job = yield from queue.enqueue(say_hello, handle)
+    yield from queue.delete_broadcast(handle)
+    worker = Worker([queue], connection=redis)
+    assert not (yield from worker.claim_job())
+    assert (yield from job.get_status()) == JobStatus.FAILED
+    [(exc_type, _, _)] = (yield from failure_summary(redis)).keys()
+    assert exc_type == 'MissingArgumentError'
+
+
+def test_execute_job_releases_slot(redis, set_loop):
+    """Job is removed from running jobs even if its execution
+    raises."""
+
+    queue = Queue(connection=redis)
+    job = yield from queue.enqueue(say_hello)
+    worker = Worker([queue], connection=redis)
+
+    @asyncio.coroutine
+    def perform_job(job, *, loop=None):
+        assert worker.running_jobs == {(queue.name, job.id)}
+        raise RuntimeError
+
+    worker.perform_job = perform_job
+    with pytest.raises(RuntimeError):
+        yield from worker.execute_job(job)
+    assert not worker.running_jobs
 
 
 def test_work_unicode_friendly(loop):
@@ -487,3 +631,54 @@ def test_worker_calls_clean_registries(redis, loop):
     worker = Worker(queue, connection=redis)
     yield from worker.work(burst=True, loop=loop)
     assert not (yield from redis.zcard(registry.key))
+
+
+def test_cancel_running_job(redis, set_loop):
+    """Worker stops running job canceled with `cancel_job`."""
+
+    pubsub = yield from aioredis.create_redis(('localhost', 6379))
+    queue = Queue(connection=redis)
+    job = yield from queue.enqueue(long_running_job, 10)
+    worker = Worker([queue], connection=redis, pubsub_connection=pubsub)
+    work = ensure_future(worker.work(burst=True))
+    while job.id not in worker.job_tasks:
+        yield from asyncio.sleep(0.01)
+    yield from queue.remove(job)
+    yield from asyncio.wait_for(work, 5)
+    assert (yield from job.get_status()) == JobStatus.CANCELED
+    assert not worker.running_jobs
+    pubsub.close()
+
+
+def test_cancel_running_blocking_job(redis, loop):
+    """Canceled blocking job keeps its slot until its thread returns."""
+
+    pubsub = yield from aioredis.create_redis(('localhost', 6379), loop=loop)
+    queue = Queue(connection=redis)
+    job = yield from queue.enqueue(blocking_sleep, 1)
+    worker = Worker([queue], connection=redis, pubsub_connection=pubsub,
+                    executor=ThreadPoolExecutor(1))
+    work = ensure_future(worker.work(burst=True, loop=loop), loop=loop)
+    while job.id not in worker.job_tasks:
+        yield from asyncio.sleep(0.01, loop=loop)
+    yield from queue.remove(job)
+    yield from asyncio.sleep(0.2, loop=loop)
+    assert job.id in worker.job_tasks
+    yield from asyncio.wait_for(work, 5, loop=loop)
+    assert (yield from job.get_status()) == JobStatus.CANCELED
+    pubsub.close()
+
+
+def test_warm_stop_waits_for_running_jobs(redis, set_loop):
+    """Worker stopped on request finishes running jobs before it
+    stops heartbeats."""
+
+    queue = Queue(connection=redis)
+    job = yield from queue.enqueue(long_running_job, 0.5)
+    worker = Worker([queue], connection=redis)
+    work = ensure_future(worker.work())
+    while job.id not in worker.job_tasks:
+        yield from asyncio.sleep(0.01)
+    worker._stop_requested = True
+    yield from asyncio.wait_for(work, 5)
+    assert (yield from job.get_status()) == JobStatus.FINISHED